@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Stress test for the parser on deeply nested programs.
+#
+#   python3 benchmarks/deep_nesting.py [depth ...]
+#
+# Every shape is lexed and parsed at each depth with the default recursion
+# limit, and the time per nesting level is printed.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lang
+
+SHAPES = {
+    'parens': lambda n: '(' * n + '1' + ')' * n,
+    'lists': lambda n: '[' * n + '1' + ']' * n,
+    'calls': lambda n: 'f(' * n + ')' * n,
+    'unary': lambda n: '-' * n + '1',
+    'power': lambda n: '^'.join(['2'] * n),
+    'set': lambda n: 'SET x = ' * n + '1',
+    'if blocks': lambda n: 'IF x THEN\n' * n + '1\n' + 'STOP\n' * n,
+    'for blocks': lambda n: 'FOR i = 0 TO 1 THEN\n' * n + '1\n' + 'STOP\n' * n,
+    'func bodies': lambda n: 'FUNC (a)\n' * n + '1\n' + 'STOP\n' * n,
+    'inline ifs': lambda n: 'IF x THEN ' * n + '1',
+}
+
+def bench(name, text, depth):
+    start = time.perf_counter()
+    tokens, error = lang.Lexer('<bench>', text).make_tokens()
+    if not error:
+        error = lang.Parser(tokens).parse().error
+    elapsed = time.perf_counter() - start
+
+    status = 'error' if error else 'ok'
+    print(f"{name:<12} {depth:>7} {status:<6} {elapsed:8.3f}s {elapsed / depth * 1e6:8.2f}us/level", flush=True)
+    return error is None
+
+if __name__ == "__main__":
+    depths = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+    print(f"recursion limit {sys.getrecursionlimit()}")
+
+    ok = True
+    for depth in depths:
+        for name, shape in SHAPES.items():
+            ok = bench(name, shape(depth), depth) and ok
+
+    sys.exit(0 if ok else 1)
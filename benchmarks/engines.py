@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Compares the tree-walking interpreter with the bytecode VM, the closure
+# compiler and the Python transpiler.
+#
+#   python3 benchmarks/engines.py [--optimize]
+#
+# Every program is run on each engine, which must all print the same thing,
+# and the best time of a few runs is printed along with the speedup over the
+# tree. The VM's speedup on the loop and call programs is checked against
+# VM_TARGET; the lists program spends its time inside APPEND, which runs the
+# same in every engine, and is only reported.
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lang
+
+RUNS = 5
+
+VM_TARGET = 3.0
+VM_TARGETED = ('for loop', 'while loop', 'calls')
+
+PROGRAMS = {
+    'for loop': (
+        'SET total = 0\n'
+        'FOR i = 0 TO 200000 THEN\n'
+        '  SET total = total + i * 2\n'
+        'STOP\n'
+        'PRINT(total)\n'
+    ),
+    'while loop': (
+        'SET i = 0\n'
+        'SET acc = 0\n'
+        'WHILE i < 100000 THEN\n'
+        '  SET i = i + 1\n'
+        '  IF i - 1 == 0 THEN\n'
+        '    SET acc = acc + 1\n'
+        '  ELSE\n'
+        '    SET acc = acc - 1\n'
+        '  STOP\n'
+        'STOP\n'
+        'PRINT(acc)\n'
+    ),
+    'calls': (
+        'FUNC fib(n)\n'
+        '  IF n < 2 THEN BACK n\n'
+        '  BACK fib(n - 1) + fib(n - 2)\n'
+        'STOP\n'
+        'PRINT(fib(20))\n'
+    ),
+    'lists': (
+        'SET items = []\n'
+        'FOR i = 0 TO 50000 THEN\n'
+        '  APPEND(items, i)\n'
+        'STOP\n'
+        'PRINT(LEN(items))\n'
+    ),
+}
+
+def bench(text, engine, optimize):
+    best = None
+    for _ in range(RUNS):
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            _, error = lang.run('<bench>', text, optimize, engine)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output.getvalue() + (error.as_string() if error else '')
+
+if __name__ == "__main__":
+    optimize = '--optimize' in sys.argv[1:]
+    sys.setrecursionlimit(10000)
+
+    ok = True
+    for name, text in PROGRAMS.items():
+        tree_time, tree_output = bench(text, 'tree', optimize)
+        line = f"{name:<12} tree {tree_time:7.3f}s"
+
+        for engine in ('vm', 'closure', 'python'):
+            engine_time, engine_output = bench(text, engine, optimize)
+            same = tree_output == engine_output
+            ok = ok and same
+            line += f"  {engine} {engine_time:7.3f}s {tree_time / engine_time:5.1f}x{'' if same else ' OUTPUT DIFFERS'}"
+
+            if engine == 'vm' and name in VM_TARGETED and tree_time / engine_time < VM_TARGET:
+                ok = False
+                line += f' BELOW {VM_TARGET:.0f}x TARGET'
+
+        print(line, flush=True)
+
+    sys.exit(0 if ok else 1)
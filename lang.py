@@ -4,9 +4,10 @@
 
 from errorcomp import *
 from colorama import init, Fore, Style
-import string, os, math
+import string, os, math, bisect
 import random
 import re
+import gc, hashlib, hmac, operator, pickle, secrets, tempfile, weakref
 
 ########
 # CONS #
@@ -63,35 +64,111 @@ class RTError(Error):
 
     while ctx:
       result = f'  {Fore.YELLOW}File {pos.fn}, line {str(pos.ln + 1)}, in {ctx.display_name}{Style.RESET_ALL}\n' + result
+      if ctx.tail_calls:
+        result = f'  {Fore.YELLOW}[{ctx.tail_calls} tail call{"s" if ctx.tail_calls > 1 else ""} not shown]{Style.RESET_ALL}\n' + result
       pos = ctx.parent_entry_pos
       ctx = ctx.parent
 
     return f'{Fore.RED}Traceback (most recent call last):{Style.RESET_ALL}\n' + result
 
+class Diagnostic:
+  def __init__(self, error):
+    self.kind = error.error_name
+    self.message = error.details
+    self.start = error.pos_start.idx
+    self.end = error.pos_end.idx
+    self.start_ln, self.start_col = error.pos_start.ln, error.pos_start.col
+    self.end_ln, self.end_col = error.pos_end.ln, error.pos_end.col
+
+  def as_dict(self):
+    return {
+      'kind': self.kind,
+      'message': self.message,
+      'start': self.start,
+      'end': self.end,
+      'start_ln': self.start_ln,
+      'start_col': self.start_col,
+      'end_ln': self.end_ln,
+      'end_col': self.end_col,
+    }
+
+  def __repr__(self):
+    return f'{self.start_ln + 1}:{self.start_col + 1}: {self.kind}: {self.message}'
+
 #########
 #  POS  # 
 #########
 
+class SourceFile:
+  __slots__ = ('fn', 'text', 'line_starts')
+
+  def __init__(self, fn, text):
+    self.fn = fn
+    self.text = text
+    self.line_starts = None
+
+  def line_col(self, idx):
+    if self.line_starts is None:
+      self.line_starts = [0] + [match.end() for match in re.finditer('\n', self.text)]
+
+    ln = bisect.bisect_right(self.line_starts, idx) - 1
+    return ln, idx - self.line_starts[ln]
+
 class Position:
-  def __init__(self, idx, ln, col, fn, ftxt):
+  __slots__ = ('idx', 'src', 'is_end')
+
+  def __init__(self, idx, src, is_end=False):
     self.idx = idx
-    self.ln = ln
-    self.col = col
-    self.fn = fn
-    self.ftxt = ftxt
+    self.src = src
+    self.is_end = is_end
 
-  def advance(self, current_char=None):
-    self.idx += 1
-    self.col += 1
+  def __reduce__(self):
+    return Position, (self.idx, self.src, self.is_end)
 
-    if current_char == '\n':
-      self.ln += 1
-      self.col = 0
+  def line_col(self):
+    if not self.is_end:
+      return self.src.line_col(self.idx)
 
-    return self
+    # An end position stays on the line of the character before it
+    ln, col = self.src.line_col(self.idx - 1)
+    return ln, col + 1
 
-  def copy(self):
-    return Position(self.idx, self.ln, self.col, self.fn, self.ftxt)
+  @property
+  def ln(self):
+    return self.line_col()[0]
+
+  @property
+  def col(self):
+    return self.line_col()[1]
+
+  @property
+  def fn(self):
+    return self.src.fn
+
+  @property
+  def ftxt(self):
+    return self.src.text
+
+# The slot behind Position.idx, for ChunkedPosition to store its own in
+POSITION_IDX = Position.idx
+
+class ChunkedPosition(Position):
+  # A position kept relative to a chunk of the source, anything with the
+  # src and base of one, so that moving the chunk moves it
+  __slots__ = ('chunk',)
+
+  def __init__(self, idx, chunk, is_end=False):
+    self.chunk = chunk
+    POSITION_IDX.__set__(self, idx - chunk.base)
+    self.src = chunk.src
+    self.is_end = is_end
+
+  @property
+  def idx(self):
+    return POSITION_IDX.__get__(self) + self.chunk.base
+
+  def __reduce__(self):
+    return Position, (self.idx, self.src, self.is_end)
 
 ##########
 # TOKENS #
@@ -126,7 +203,7 @@ LU_AMPERSAND   = 'AMPERSAND'
 LU_PLUSEQ      = 'PLUSEQ'
 LU_MINUSEQ     = 'MINUSEQ'
 
-KEYWORDS = [
+KEYWORDS = {
   'SET',
   'AND',
   'OR',
@@ -144,20 +221,98 @@ KEYWORDS = [
   'BACK',
   'CONTINUE',
   'BREAK',
-]
+}
+
+OPERATORS = {
+  '+':  LU_PLUS,
+  '-':  LU_MINUS,
+  '*':  LU_MUL,
+  '/':  LU_DIV,
+  '^':  LU_POW,
+  '(':  LU_LPAREN,
+  ')':  LU_RPAREN,
+  '[':  LU_LSQUARE,
+  ']':  LU_RSQUARE,
+  ',':  LU_COMMA,
+  '&':  LU_AMPERSAND,
+  '=':  LU_EQ,
+  '<':  LU_LT,
+  '>':  LU_GT,
+  '==': LU_EE,
+  '!=': LU_NE,
+  '<=': LU_LTE,
+  '>=': LU_GTE,
+  '+=': LU_PLUSEQ,
+  '-=': LU_MINUSEQ,
+  '->': LU_ARROW,
+}
+
+# Left and right binding powers of binary operators, keyed by token type
+# or by keyword. The right operand is parsed at the right binding power,
+# so a lower right power makes an operator right associative.
+BP_LOGIC      = 1
+BP_COMPARISON = 2
+BP_ARITH      = 3
+BP_TERM       = 4
+BP_POWER      = 5
+
+BINARY_BINDING_POWERS = {
+  'AND':        (BP_LOGIC, BP_LOGIC),
+  'OR':         (BP_LOGIC, BP_LOGIC),
+  LU_AMPERSAND: (BP_LOGIC, BP_LOGIC),
+  LU_EE:        (BP_COMPARISON, BP_COMPARISON),
+  LU_NE:        (BP_COMPARISON, BP_COMPARISON),
+  LU_LT:        (BP_COMPARISON, BP_COMPARISON),
+  LU_GT:        (BP_COMPARISON, BP_COMPARISON),
+  LU_LTE:       (BP_COMPARISON, BP_COMPARISON),
+  LU_GTE:       (BP_COMPARISON, BP_COMPARISON),
+  LU_PLUS:      (BP_ARITH, BP_ARITH),
+  LU_MINUS:     (BP_ARITH, BP_ARITH),
+  LU_MUL:       (BP_TERM, BP_TERM),
+  LU_DIV:       (BP_TERM, BP_TERM),
+  LU_POW:       (BP_POWER, BP_TERM),
+}
+
+# Binding power of a prefix operator's operand. A prefix operator is only
+# allowed where the surrounding binding power is not higher than its own.
+PREFIX_BINDING_POWERS = {
+  'NOT':        BP_LOGIC,
+  LU_PLUS:      BP_TERM,
+  LU_MINUS:     BP_TERM,
+}
+
+# These tokens only span their first character
+SHORT_OPERATORS = {LU_PLUSEQ, LU_MINUSEQ, LU_ARROW}
+
+TOKEN_REGEX = re.compile(r"""
+    (?P<SKIP>[ \t]+|\#[^\n]*\n?)
+  | (?P<NEWLINE>[;\n])
+  | (?P<NUMBER>[0-9]+(?:\.[0-9]*)?)
+  | (?P<IDENTIFIER>[A-Za-z][A-Za-z0-9_]*)
+  | (?P<STRING>"[^"]*"?)
+  | (?P<OPERATOR>[-+]=|->|[=!<>]=|[-+*/^()\[\],&=<>])
+""", re.VERBOSE)
 
 class Token:
-  def __init__(self, type_, value=None, pos_start=None, pos_end=None):
+  __slots__ = ('type', 'value', 'start', 'end', 'src')
+
+  def __init__(self, type_, value=None, start=0, end=0, src=None):
     self.type = type_
     self.value = value
+    self.start = start
+    self.end = end
+    self.src = src
 
-    if pos_start:
-      self.pos_start = pos_start.copy()
-      self.pos_end = pos_start.copy()
-      self.pos_end.advance()
+  def __reduce__(self):
+    return Token, (self.type, self.value, self.start, self.end, self.src)
 
-    if pos_end:
-      self.pos_end = pos_end.copy()
+  @property
+  def pos_start(self):
+    return Position(self.start, self.src)
+
+  @property
+  def pos_end(self):
+    return Position(self.end, self.src, True)
 
   def matches(self, type_, value):
     return self.type == type_ and self.value == value
@@ -166,6 +321,61 @@ class Token:
     if self.value: return f'{self.type}:{self.value}'
     return f'{self.type}'
 
+# The slots behind Token's fields, for ChunkedToken to store its own in
+TOKEN_START, TOKEN_END, TOKEN_SRC = Token.start, Token.end, Token.src
+
+# Tokens of a list relex keeps up to date, in runs of RELEX_CHUNK
+RELEX_CHUNK = 256
+
+class TokenChunk:
+  __slots__ = ('src', 'base', 'count')
+
+  def __init__(self, src, base, count):
+    self.src = src
+    self.base = base
+    self.count = count
+
+class ChunkedToken(Token):
+  # A token whose offsets are kept relative to the chunk it is in, so an
+  # edit moves the tokens after it a chunk at a time. Its src slot holds
+  # the chunk, anything with the src and base of one, and it reads like
+  # any other token.
+  __slots__ = ()
+
+  @property
+  def start(self):
+    return TOKEN_START.__get__(self) + TOKEN_SRC.__get__(self).base
+
+  @start.setter
+  def start(self, start):
+    TOKEN_START.__set__(self, start - TOKEN_SRC.__get__(self).base)
+
+  @property
+  def end(self):
+    return TOKEN_END.__get__(self) + TOKEN_SRC.__get__(self).base
+
+  @end.setter
+  def end(self, end):
+    TOKEN_END.__set__(self, end - TOKEN_SRC.__get__(self).base)
+
+  @property
+  def src(self):
+    return TOKEN_SRC.__get__(self).src
+
+def chunk_tokens(tokens, src, spans=None):
+  # Puts tokens into chunks, at the given (start, end) offsets or, without
+  # spans, at the ones they have
+  for first in range(0, len(tokens), RELEX_CHUNK):
+    chunk = TokenChunk(src, spans[first][0] if spans else 0, min(RELEX_CHUNK, len(tokens) - first))
+    for idx in range(first, first + chunk.count):
+      token = tokens[idx]
+      token.__class__ = Token
+      if spans:
+        token.start = spans[idx][0] - chunk.base
+        token.end = spans[idx][1] - chunk.base
+      token.src = chunk
+      token.__class__ = ChunkedToken
+
 #########
 # LEXER #
 #########
@@ -174,291 +384,289 @@ class Lexer:
   def __init__(self, fn, text):
     self.fn = fn
     self.text = text
-    self.pos = Position(-1, 0, -1, fn, text)
-    self.current_char = None
-    self.advance()
-  
-  def advance(self):
-    self.pos.advance(self.current_char)
-    self.current_char = self.text[self.pos.idx] if self.pos.idx < len(self.text) else None
+    self.src = SourceFile(fn, text)
+    self.error = None
 
   def make_tokens(self):
-    tokens = []
-
-    while self.current_char != None:
-      if self.current_char in ' \t':
-        self.advance()
-      elif self.current_char == '#':
-        self.skip_comment()
-      elif self.current_char in ';\n':
-        tokens.append(Token(LU_NEWLINE, pos_start=self.pos))
-        self.advance()
-      elif self.current_char in DIGITS:
-        tokens.append(self.make_number())
-      elif self.current_char in LETTERS:
-        tokens.append(self.make_identifier())
-      elif self.current_char == '"':
-        tokens.append(self.make_string())
-      elif self.current_char == '+':
-        if self.pos.idx + 1 < len(self.text) and self.text[self.pos.idx + 1] == '=':
-          tokens.append(Token(LU_PLUSEQ, pos_start=self.pos))
-          self.advance()
-          self.advance()
-        else:
-          tokens.append(Token(LU_PLUS, pos_start=self.pos))
-          self.advance()
-      elif self.current_char == '-':
-        if self.pos.idx + 1 < len(self.text) and self.text[self.pos.idx + 1] == '=':
-          tokens.append(Token(LU_MINUSEQ, pos_start=self.pos))
-          self.advance()
-          self.advance()
-        elif self.pos.idx + 1 < len(self.text) and self.text[self.pos.idx + 1] == '>':
-          tokens.append(Token(LU_ARROW, pos_start=self.pos))
-          self.advance()
-          self.advance()
-        else:
-          tokens.append(Token(LU_MINUS, pos_start=self.pos))
-          self.advance()
-      elif self.current_char == '*':
-        tokens.append(Token(LU_MUL, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '/':
-        tokens.append(Token(LU_DIV, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '^':
-        tokens.append(Token(LU_POW, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '(':
-        tokens.append(Token(LU_LPAREN, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == ')':
-        tokens.append(Token(LU_RPAREN, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '[':
-        tokens.append(Token(LU_LSQUARE, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == ']':
-        tokens.append(Token(LU_RSQUARE, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '!':
-        token, error = self.make_not_equals()
-        if error: return [], error
-        tokens.append(token)
-      elif self.current_char == '=':
-        tokens.append(self.make_equals())
-      elif self.current_char == '<':
-        tokens.append(self.make_less_than())
-      elif self.current_char == '>':
-        tokens.append(self.make_greater_than())
-      elif self.current_char == ',':
-        tokens.append(Token(LU_COMMA, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '&':
-        tokens.append(Token(LU_AMPERSAND, pos_start=self.pos))
-        self.advance()
-      else:
-        pos_start = self.pos.copy()
-        char = self.current_char
-        self.advance()
-        return [], IllegalCharError(pos_start, self.pos, "'" + char + "'")
-
-    tokens.append(Token(LU_EOF, pos_start=self.pos))
+    tokens = list(self.generate_tokens())
+    if self.error: return [], self.error
     return tokens, None
 
-  def make_number(self):
-    num_str = ''
-    dot_count = 0
-    pos_start = self.pos.copy()
-
-    while self.current_char != None and self.current_char in DIGITS + '.':
-      if self.current_char == '.':
-        if dot_count == 1: break
-        dot_count += 1
-      num_str += self.current_char
-      self.advance()
-
-    if dot_count == 0:
-      return Token(LU_INT, int(num_str), pos_start, self.pos)
-    else:
-      return Token(LU_FLOAT, float(num_str), pos_start, self.pos)
-
-  def make_string(self):
-    string = ''
-    pos_start = self.pos.copy()
-    escape_character = False
-    self.advance()
-
-    escape_characters = {
-      'n': '\n',
-      't': '\t'
-    }
+  def generate_tokens(self, idx=0, errors=None):
+    src = self.src
+    self.error = None
 
-    while self.current_char != None and (self.current_char != '"' or escape_character):
-      if escape_character:
-        string += escape_characters.get(self.current_char, self.current_char)
+    # With an errors list, each run of bad characters is recorded there and
+    # skipped instead of ending the stream
+    for match in TOKEN_REGEX.finditer(self.text, idx):
+      if match.start() != idx:
+        if errors is None: break
+        errors.append(self.make_error(idx))
+        idx = match.start()
+      kind = match.lastgroup
+      end = match.end()
+
+      if kind == 'SKIP':
+        pass
+      elif kind == 'NEWLINE':
+        yield Token(LU_NEWLINE, None, idx, end, src)
+      elif kind == 'IDENTIFIER':
+        value = match.group()
+        tok_type = LU_KEYWORD if value in KEYWORDS else LU_IDENTIFIER
+        yield Token(tok_type, value, idx, end, src)
+      elif kind == 'NUMBER':
+        value = match.group()
+        if '.' in value:
+          yield Token(LU_FLOAT, float(value), idx, end, src)
+        else:
+          yield Token(LU_INT, int(value), idx, end, src)
+      elif kind == 'STRING':
+        token = self.make_string(match.group(), idx, end)
+        end = token.end
+        yield token
       else:
-        if self.current_char == '\\':
-          escape_character = True
+        tok_type = OPERATORS[match.group()]
+        if tok_type in SHORT_OPERATORS:
+          yield Token(tok_type, None, idx, idx + 1, src)
         else:
-          string += self.current_char
-      self.advance()
-      escape_character = False
-    
-    self.advance()
-    return Token(LU_STRING, string, pos_start, self.pos)
-
-  def make_identifier(self):
-    id_str = ''
-    pos_start = self.pos.copy()
-
-    while self.current_char != None and self.current_char in LETTERS_DIGITS + '_':
-      id_str += self.current_char
-      self.advance()
-
-    tok_type = LU_KEYWORD if id_str in KEYWORDS else LU_IDENTIFIER
-    return Token(tok_type, id_str, pos_start, self.pos)
-
-  def make_minus_or_arrow(self):
-    tok_type = LU_MINUS
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '>':
-      self.advance()
-      tok_type = LU_ARROW
-
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-  def make_not_equals(self):
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '=':
-      self.advance()
-      return Token(LU_NE, pos_start=pos_start, pos_end=self.pos), None
-
-    self.advance()
-    return None, ExpectedCharError(pos_start, self.pos, "'=' (after '!')")
-  
-  def make_equals(self):
-    tok_type = LU_EQ
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '=':
-      self.advance()
-      tok_type = LU_EE
-
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-  def make_less_than(self):
-    tok_type = LU_LT
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '=':
-      self.advance()
-      tok_type = LU_LTE
-
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-  def make_greater_than(self):
-    tok_type = LU_GT
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '=':
-      self.advance()
-      tok_type = LU_GTE
-
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
+          yield Token(tok_type, None, idx, end, src)
 
-  def skip_comment(self):
-    self.advance()
+      idx = end
 
-    while self.current_char != '\n':
-      self.advance()
+    # The stream always ends with EOF, check self.error to tell a
+    # complete file from one that stopped at a bad character
+    if idx < len(self.text):
+      if errors is None:
+        self.error = self.make_error(idx)
+      else:
+        errors.append(self.make_error(idx))
+        idx = len(self.text)
+
+    yield Token(LU_EOF, None, idx, idx + 1, src)
+
+  def make_string(self, value, start, end):
+    terminated = len(value) > 1 and value[-1] == '"'
+    string = value[1:-1] if terminated else value[1:]
+    if not terminated: end += 1
+
+    # Backslashes never escape anything, they are simply dropped
+    return Token(LU_STRING, string.replace('\\', ''), start, end, self.src)
+
+  def make_error(self, idx):
+    pos_start = Position(idx, self.src)
+    char = self.text[idx]
+
+    if char == '!':
+      return ExpectedCharError(pos_start, Position(idx + 2, self.src), "'=' (after '!')")
+
+    return IllegalCharError(pos_start, Position(idx + 1, self.src, True), "'" + char + "'")
+
+def relex(tokens, offset, removed, inserted):
+  # Updates a complete token list in place after `removed` characters at
+  # `offset` were replaced by `inserted`, re-lexing only the damaged part.
+  # The first edit turns the tokens into ChunkedTokens, so that those after
+  # an edit are moved a chunk at a time.
+  src = tokens[-1].src
+  if type(tokens[0]) is not ChunkedToken:
+    chunk_tokens(tokens, src)
+  text = src.text[:offset] + inserted + src.text[offset + removed:]
+  delta = len(inserted) - removed
+
+  # Restart one token before the first one the edit can touch, since the
+  # lexer may have looked one character past that token's end
+  lo, hi = 0, len(tokens) - 1
+  while lo < hi:
+    mid = (lo + hi) // 2
+    if tokens[mid].end < offset: lo = mid + 1
+    else: hi = mid
+  first = max(lo - 1, 0)
+
+  # Old tokens starting after the removed range are candidates to resume at
+  old_idx = first
+  while old_idx < len(tokens) and tokens[old_idx].start < offset + removed:
+    old_idx += 1
+
+  lexer = Lexer(src.fn, text)
+  new_tokens = []
+  damage_end = offset + len(inserted)
+
+  for token in lexer.generate_tokens(tokens[first].start if first else 0):
+    if lexer.error: return [], lexer.error
+
+    if token.start >= damage_end:
+      while old_idx < len(tokens) and tokens[old_idx].start + delta < token.start:
+        old_idx += 1
+
+      # Same suffix of text from a token boundary, the rest is unchanged
+      if old_idx < len(tokens) and tokens[old_idx].start + delta == token.start:
+        break
 
-    self.advance()
+    token.src = src
+    new_tokens.append(token)
+  else:
+    old_idx = len(tokens)
+
+  # The chunks the replaced tokens were in are made again around the new
+  # ones, and the chunks after them moved
+  lo = first
+  chunk = TOKEN_SRC.__get__(tokens[first])
+  while lo and TOKEN_SRC.__get__(tokens[lo - 1]) is chunk:
+    lo -= 1
+  hi = max(old_idx, first + 1)
+  if hi <= len(tokens):
+    chunk = TOKEN_SRC.__get__(tokens[hi - 1])
+    while hi < len(tokens) and TOKEN_SRC.__get__(tokens[hi]) is chunk:
+      hi += 1
+  hi = max(hi, old_idx)
+
+  region = tokens[lo:first] + new_tokens + tokens[old_idx:hi]
+  spans = (
+    [(token.start, token.end) for token in tokens[lo:first]] +
+    [(token.start, token.end) for token in new_tokens] +
+    [(token.start + delta, token.end + delta) for token in tokens[old_idx:hi]]
+  )
+
+  idx = hi
+  while idx < len(tokens):
+    chunk = TOKEN_SRC.__get__(tokens[idx])
+    chunk.base += delta
+    idx += chunk.count
+
+  chunk_tokens(region, src, spans)
+  tokens[lo:hi] = region
+  src.text = text
+  src.line_starts = None
+  return tokens, None
 
 #########
 # NODES #
 #########
 
-class NumberNode:
+# Nodes keep their source range as offsets into a shared SourceFile, like
+# tokens. Their Position objects are only built, and then kept, the first
+# time the interpreter asks for them. Nodes the incremental parser keeps
+# have only ChunkedPositions, which their offsets are read from. The
+# resolver fills in resolved: a variable's address, for a FUNC the layout
+# of the frames it runs in, for a call whether it is in tail position, for
+# a binary operation its inline cache, or UNBOXED for one on proven
+# numbers, and for an IF whether the value it passes on needs a position.
+# Type inference fills in inferred: Number or String when the node always
+# evaluates to one, otherwise None.
+class Node:
+  __slots__ = ('start', 'end', 'src', 'pos_start', 'pos_end', 'resolved', 'inferred')
+
+  def __getattr__(self, name):
+    if name in ('resolved', 'inferred'):
+      return None
+    if name == 'pos_start':
+      self.pos_start = Position(self.start, self.src)
+      return self.pos_start
+    if name == 'pos_end':
+      self.pos_end = Position(self.end, self.src, True)
+      return self.pos_end
+    if name == 'start':
+      return object.__getattribute__(self, 'pos_start').idx
+    if name == 'end':
+      return object.__getattribute__(self, 'pos_end').idx
+    raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+  # Pickled as a flat tuple of field values, without the cached positions
+  def __reduce__(self):
+    node_class = type(self)
+    return restore_node, (node_class, tuple([getattr(self, name) for name in node_class.__slots__]), self.start, self.end, self.src)
+
+def restore_node(node_class, fields, start, end, src):
+  node = node_class.__new__(node_class)
+  for name, value in zip(node_class.__slots__, fields):
+    setattr(node, name, value)
+  node.start, node.end, node.src = start, end, src
+  return node
+
+class NumberNode(Node):
+  __slots__ = ('tok',)
+
   def __init__(self, tok):
     self.tok = tok
 
-    self.pos_start = self.tok.pos_start
-    self.pos_end = self.tok.pos_end
+    self.start, self.end, self.src = tok.start, tok.end, tok.src
 
   def __repr__(self):
     return f'{self.tok}'
 
-class StringNode:
+class StringNode(Node):
+  __slots__ = ('tok',)
+
   def __init__(self, tok):
     self.tok = tok
 
-    self.pos_start = self.tok.pos_start
-    self.pos_end = self.tok.pos_end
+    self.start, self.end, self.src = tok.start, tok.end, tok.src
 
   def __repr__(self):
     return f'{self.tok}'
 
-class ListNode:
-  def __init__(self, element_nodes, pos_start, pos_end):
+class ListNode(Node):
+  __slots__ = ('element_nodes',)
+
+  def __init__(self, element_nodes, start, end, src):
     self.element_nodes = element_nodes
 
-    self.pos_start = pos_start
-    self.pos_end = pos_end
+    self.start, self.end, self.src = start, end, src
+
+class VarAccessNode(Node):
+  __slots__ = ('var_name_tok',)
 
-class VarAccessNode:
   def __init__(self, var_name_tok):
     self.var_name_tok = var_name_tok
 
-    self.pos_start = self.var_name_tok.pos_start
-    self.pos_end = self.var_name_tok.pos_end
+    self.start, self.end, self.src = var_name_tok.start, var_name_tok.end, var_name_tok.src
+
+class VarAssignNode(Node):
+  __slots__ = ('var_name_tok', 'value_node')
 
-class VarAssignNode:
   def __init__(self, var_name_tok, value_node):
     self.var_name_tok = var_name_tok
     self.value_node = value_node
 
-    self.pos_start = self.var_name_tok.pos_start
-    self.pos_end = self.value_node.pos_end
+    self.start, self.end, self.src = var_name_tok.start, value_node.end, var_name_tok.src
+
+class BinOpNode(Node):
+  __slots__ = ('left_node', 'op_tok', 'right_node')
 
-class BinOpNode:
   def __init__(self, left_node, op_tok, right_node):
     self.left_node = left_node
     self.op_tok = op_tok
     self.right_node = right_node
 
-    self.pos_start = self.left_node.pos_start
-    self.pos_end = self.right_node.pos_end
+    self.start, self.end, self.src = left_node.start, right_node.end, left_node.src
 
   def __repr__(self):
     return f'({self.left_node}, {self.op_tok}, {self.right_node})'
 
-class UnaryOpNode:
+class UnaryOpNode(Node):
+  __slots__ = ('op_tok', 'node')
+
   def __init__(self, op_tok, node):
     self.op_tok = op_tok
     self.node = node
 
-    self.pos_start = self.op_tok.pos_start
-    self.pos_end = node.pos_end
+    self.start, self.end, self.src = op_tok.start, node.end, op_tok.src
 
   def __repr__(self):
     return f'({self.op_tok}, {self.node})'
 
-class IfNode:
+class IfNode(Node):
+  __slots__ = ('cases', 'else_case')
+
   def __init__(self, cases, else_case):
     self.cases = cases
     self.else_case = else_case
 
-    self.pos_start = self.cases[0][0].pos_start
-    self.pos_end = (self.else_case or self.cases[len(self.cases) - 1])[0].pos_end
+    first = cases[0][0]
+    self.start, self.end, self.src = first.start, (else_case or cases[len(cases) - 1])[0].end, first.src
+
+class ForNode(Node):
+  __slots__ = ('var_name_tok', 'start_value_node', 'end_value_node', 'step_value_node', 'body_node', 'should_return_null')
 
-class ForNode:
   def __init__(self, var_name_tok, start_value_node, end_value_node, step_value_node, body_node, should_return_null):
     self.var_name_tok = var_name_tok
     self.start_value_node = start_value_node
@@ -467,19 +675,21 @@ class ForNode:
     self.body_node = body_node
     self.should_return_null = should_return_null
 
-    self.pos_start = self.var_name_tok.pos_start
-    self.pos_end = self.body_node.pos_end
+    self.start, self.end, self.src = var_name_tok.start, body_node.end, var_name_tok.src
+
+class WhileNode(Node):
+  __slots__ = ('condition_node', 'body_node', 'should_return_null')
 
-class WhileNode:
   def __init__(self, condition_node, body_node, should_return_null):
     self.condition_node = condition_node
     self.body_node = body_node
     self.should_return_null = should_return_null
 
-    self.pos_start = self.condition_node.pos_start
-    self.pos_end = self.body_node.pos_end
+    self.start, self.end, self.src = condition_node.start, body_node.end, condition_node.src
+
+class FuncDefNode(Node):
+  __slots__ = ('var_name_tok', 'arg_name_toks', 'body_node', 'should_auto_return')
 
-class FuncDefNode:
   def __init__(self, var_name_tok, arg_name_toks, body_node, should_auto_return):
     self.var_name_tok = var_name_tok
     self.arg_name_toks = arg_name_toks
@@ -487,42 +697,186 @@ class FuncDefNode:
     self.should_auto_return = should_auto_return
 
     if self.var_name_tok:
-      self.pos_start = self.var_name_tok.pos_start
+      self.start = self.var_name_tok.start
     elif len(self.arg_name_toks) > 0:
-      self.pos_start = self.arg_name_toks[0].pos_start
+      self.start = self.arg_name_toks[0].start
     else:
-      self.pos_start = self.body_node.pos_start
+      self.start = self.body_node.start
+
+    self.end, self.src = body_node.end, body_node.src
 
-    self.pos_end = self.body_node.pos_end
+class CallNode(Node):
+  __slots__ = ('node_to_call', 'arg_nodes')
 
-class CallNode:
   def __init__(self, node_to_call, arg_nodes):
     self.node_to_call = node_to_call
     self.arg_nodes = arg_nodes
 
-    self.pos_start = self.node_to_call.pos_start
+    self.start, self.src = node_to_call.start, node_to_call.src
 
     if len(self.arg_nodes) > 0:
-      self.pos_end = self.arg_nodes[len(self.arg_nodes) - 1].pos_end
+      self.end = self.arg_nodes[len(self.arg_nodes) - 1].end
     else:
-      self.pos_end = self.node_to_call.pos_end
+      self.end = self.node_to_call.end
 
-class ReturnNode:
-  def __init__(self, node_to_return, pos_start, pos_end):
+class ReturnNode(Node):
+  __slots__ = ('node_to_return',)
+
+  def __init__(self, node_to_return, start, end, src):
     self.node_to_return = node_to_return
 
-    self.pos_start = pos_start
-    self.pos_end = pos_end
+    self.start, self.end, self.src = start, end, src
 
-class ContinueNode:
-  def __init__(self, pos_start, pos_end):
-    self.pos_start = pos_start
-    self.pos_end = pos_end
+class ContinueNode(Node):
+  __slots__ = ()
 
-class BreakNode:
-  def __init__(self, pos_start, pos_end):
-    self.pos_start = pos_start
-    self.pos_end = pos_end
+  def __init__(self, start, end, src):
+    self.start, self.end, self.src = start, end, src
+
+class BreakNode(Node):
+  __slots__ = ()
+
+  def __init__(self, start, end, src):
+    self.start, self.end, self.src = start, end, src
+
+# Only made by the optimizer, around an expression in a loop that reads no
+# variable the loop assigns
+class InvariantNode(Node):
+  __slots__ = ('node', 'var_names', 'callee_names')
+
+  def __init__(self, node, var_names, callee_names):
+    self.node = node
+    self.var_names = var_names
+    self.callee_names = callee_names
+
+    self.start, self.end, self.src = node.start, node.end, node.src
+
+def child_nodes(node):
+  for name in type(node).__slots__:
+    value = getattr(node, name)
+    if isinstance(value, Node):
+      yield value
+    elif isinstance(value, (list, tuple)):
+      for item in value:
+        if isinstance(item, Node):
+          yield item
+        elif isinstance(item, tuple):
+          yield from [case_item for case_item in item if isinstance(case_item, Node)]
+
+# The variables a body sets in its own symbol table, which leaves out those
+# set inside the functions it defines
+def assigned_names(node):
+  assigned = set()
+  stack = [node]
+
+  while stack:
+    node = stack.pop()
+    if isinstance(node, (VarAssignNode, ForNode)):
+      assigned.add(node.var_name_tok.value)
+    elif isinstance(node, FuncDefNode):
+      if node.var_name_tok: assigned.add(node.var_name_tok.value)
+      continue
+    stack.extend(child_nodes(node))
+
+  return assigned
+
+# Whether running the node may read the variable: it names the variable, or
+# calls something that could look it up by name in the caller
+def may_read(node, var_name):
+  stack = [node]
+
+  while stack:
+    node = stack.pop()
+    if isinstance(node, CallNode):
+      return True
+    if isinstance(node, VarAccessNode) and node.var_name_tok.value == var_name:
+      return True
+    if isinstance(node, FuncDefNode):
+      continue
+    stack.extend(child_nodes(node))
+
+  return False
+
+# Whether running the node may call anything, leaving out the bodies of the
+# functions it defines
+def may_call(node):
+  stack = [node]
+
+  while stack:
+    node = stack.pop()
+    if isinstance(node, CallNode):
+      return True
+    if isinstance(node, FuncDefNode):
+      continue
+    stack.extend(child_nodes(node))
+
+  return False
+
+# The calls that are a FUNC body's last step: those BACK returns or that are
+# the value of an auto-returned body, unless a loop in the body would catch
+# a CONTINUE or BREAK coming out of them
+def tail_calls(body_node, should_auto_return):
+  calls = []
+  stack = [(body_node, should_auto_return)]
+
+  while stack:
+    node, tail = stack.pop()
+    if isinstance(node, (ForNode, WhileNode, FuncDefNode)):
+      continue
+    if isinstance(node, CallNode) and tail:
+      calls.append(node)
+    if isinstance(node, ReturnNode):
+      if node.node_to_return: stack.append((node.node_to_return, True))
+    elif isinstance(node, IfNode) and tail:
+      for condition, expr, should_return_null in node.cases:
+        stack.append((condition, False))
+        stack.append((expr, not should_return_null))
+      if node.else_case:
+        stack.append((node.else_case[0], not node.else_case[1]))
+    else:
+      stack.extend((child, False) for child in child_nodes(node))
+
+  return calls
+
+# Makes every loop whose value nothing reads evaluate to NULL, so that no
+# engine keeps the values of its body: a loop in a block, in the body of a
+# FUNC that does not return its value, or in the body of another such loop
+def discard_loop_results(node, used=True):
+  stack = [(node, used)]
+
+  while stack:
+    node, used = stack.pop()
+    if isinstance(node, (ForNode, WhileNode)):
+      if not used: node.should_return_null = True
+      stack.extend((child, child is not node.body_node or not node.should_return_null) for child in child_nodes(node))
+    elif isinstance(node, IfNode):
+      for condition, expr, should_return_null in node.cases:
+        stack.append((condition, True))
+        stack.append((expr, used and not should_return_null))
+      if node.else_case:
+        expr, should_return_null = node.else_case
+        stack.append((expr, used and not should_return_null))
+    elif isinstance(node, FuncDefNode):
+      stack.append((node.body_node, node.should_auto_return))
+    elif isinstance(node, (ListNode, InvariantNode)):
+      stack.extend((child, used) for child in child_nodes(node))
+    else:
+      stack.extend((child, True) for child in child_nodes(node))
+
+  return node
+
+# The loops in a tree that collect their body's values
+def collecting_loops(node):
+  loops = []
+  stack = [node]
+
+  while stack:
+    node = stack.pop()
+    if isinstance(node, (ForNode, WhileNode)) and not node.should_return_null:
+      loops.append(node)
+    stack.extend(child_nodes(node))
+
+  return loops
 
 ################
 # PARSE RESULT #
@@ -532,42 +886,87 @@ class ParseResult:
   def __init__(self):
     self.error = None
     self.node = None
-    self.last_registered_advance_count = 0
-    self.advance_count = 0
-    self.to_reverse_count = 0
-
-  def register_advancement(self):
-    self.last_registered_advance_count = 1
-    self.advance_count += 1
 
   def register(self, res):
-    self.last_registered_advance_count = res.advance_count
-    self.advance_count += res.advance_count
     if res.error: self.error = res.error
     return res.node
 
-  def try_register(self, res):
-    if res.error:
-      self.to_reverse_count = res.advance_count
-      return None
-    return self.register(res)
-
   def success(self, node):
     self.node = node
     return self
 
   def failure(self, error):
-    if not self.error or self.last_registered_advance_count == 0:
-      self.error = error
+    self.error = error
     return self
 
+################
+# TOKEN STREAM #
+################
+
+TOKEN_LOOKBACK = 64
+
+class TokenStream:
+  def __init__(self, tokens, lookback=TOKEN_LOOKBACK):
+    if isinstance(tokens, list):
+      self.tokens = tokens
+      self.source = None
+    else:
+      self.tokens = []
+      self.source = iter(tokens)
+
+    self.base = 0
+    self.lookback = lookback
+
+  def get(self, idx):
+    while idx - self.base >= len(self.tokens) and self.source:
+      self.fill()
+
+    idx -= self.base
+    if idx < 0:
+      raise Exception(f'Token {idx + self.base} is no longer buffered')
+
+    return self.tokens[idx] if idx < len(self.tokens) else self.tokens[-1]
+
+  def fill(self):
+    token = next(self.source, None)
+    if token is None:
+      self.source = None
+      return
+
+    self.tokens.append(token)
+
+    # Drop tokens that fell out of the lookback window, in batches
+    drop = len(self.tokens) - self.lookback
+    if drop >= self.lookback:
+      del self.tokens[:drop]
+      self.base += drop
+
 ##########
 # PARSER #
 ##########
 
+# Tokens that can start each rule, keyed like the binding power tables. The
+# parser picks a rule from the current token alone and never backtracks.
+ATOM_FIRST = {
+  LU_INT, LU_FLOAT, LU_STRING, LU_IDENTIFIER, LU_LPAREN, LU_LSQUARE,
+  'IF', 'FOR', 'WHILE', 'FUNC',
+}
+EXPR_FIRST = ATOM_FIRST | {LU_PLUS, LU_MINUS, 'NOT', 'SET'}
+STATEMENT_FIRST = EXPR_FIRST | {'BACK', 'CONTINUE', 'BREAK'}
+BLOCK_END = {'STOP', 'ELSE', 'OTHER'}
+
+# Operands that binary_expr builds directly, without entering call and atom
+SIMPLE_OPERAND_NODES = {
+  LU_INT: NumberNode,
+  LU_FLOAT: NumberNode,
+  LU_STRING: StringNode,
+  LU_IDENTIFIER: VarAccessNode,
+}
+
 class Parser:
-  def __init__(self, tokens):
-    self.tokens = tokens
+  def __init__(self, tokens, errors=None):
+    self.tokens = TokenStream(tokens)
+    self.errors = errors
     self.tok_idx = -1
     self.advance()
 
@@ -576,44 +975,111 @@ class Parser:
     self.update_current_tok()
     return self.current_tok
 
-  def reverse(self, amount=1):
-    self.tok_idx -= amount
-    self.update_current_tok()
-    return self.current_tok
-
   def update_current_tok(self):
-    if self.tok_idx >= 0 and self.tok_idx < len(self.tokens):
-      self.current_tok = self.tokens[self.tok_idx]
+    if self.tok_idx >= 0:
+      self.current_tok = self.tokens.get(self.tok_idx)
+      self.current_key = self.current_tok.value if self.current_tok.type == LU_KEYWORD else self.current_tok.type
+
+  def run_rule(self, rule):
+    # Rules are generators that yield the sub-rules they need and are sent
+    # back their results. Nesting lives on this stack instead of the Python
+    # stack, so deeply nested programs can't overflow it.
+    stack = [rule]
+    result = None
+
+    while stack:
+      try:
+        sub_rule = stack[-1].send(result)
+      except StopIteration as e:
+        stack.pop()
+        result = e.value
+      else:
+        stack.append(sub_rule)
+        result = None
+
+    return result
 
   def parse(self):
     res = ParseResult()
     
-    statements = res.register(self.statements())
+    statements = res.register(self.run_rule(self.statements()))
     if res.error: return res
     
-    if self.current_tok.type != LU_EOF:
-        return res.failure(InvalidSyntaxError(
-            self.current_tok.pos_start, self.current_tok.pos_end,
-            "Expected '+', '-', '*', '/', '^', '==', '!=', '<', '>', <=', '>=', 'AND', 'OR', '->', newline or EOF"
-        ))
+    while self.current_tok.type != LU_EOF:
+        error = self.stray_token_error()
+        if self.errors is None: return res.failure(error)
+
+        # With an errors list, the top level carries on after the line with
+        # the stray token
+        self.errors.append(error)
+        self.skip_line()
+        while self.current_tok.type == LU_NEWLINE:
+            self.advance()
+        if self.current_tok.type == LU_EOF: break
+
+        more_statements = self.run_rule(self.statements()).node
+        statements.element_nodes.extend(more_statements.element_nodes)
         
     return res.success(statements)
 
+  def stream(self):
+    # The program's statements one at a time, as ParseResults paired with
+    # whether the statement is the last, each parsed only when the one
+    # before it is done with. An error ends the stream, and a statement with
+    # a stray token after it is never given out.
+    while self.current_tok.type == LU_NEWLINE:
+      self.advance()
+
+    while True:
+      res = ParseResult()
+      statement = res.register(self.run_rule(self.statement()))
+      if res.error:
+        yield res, True
+        return
+
+      newline_count = 0
+      while self.current_tok.type == LU_NEWLINE:
+        self.advance()
+        newline_count += 1
+      last = newline_count == 0 or self.current_key not in STATEMENT_FIRST
+      if last and self.current_tok.type != LU_EOF:
+        yield res.failure(self.stray_token_error()), True
+        return
+
+      if isinstance(statement, ListNode):
+        statements = statement.element_nodes
+      else:
+        statements = [statement] if statement else []
+      for idx, statement in enumerate(statements):
+        yield ParseResult().success(statement), last and idx == len(statements) - 1
+      if last: return
+
+  def stray_token_error(self):
+    return InvalidSyntaxError(
+      self.current_tok.pos_start, self.current_tok.pos_end,
+      "Expected '+', '-', '*', '/', '^', '==', '!=', '<', '>', <=', '>=', 'AND', 'OR', '->', newline or EOF"
+    )
+
+  def skip_line(self):
+    while self.current_tok.type not in (LU_NEWLINE, LU_EOF):
+      self.advance()
+
   def statements(self):
     res = ParseResult()
     statements = []
-    pos_start = self.current_tok.pos_start.copy()
+    start_tok = self.current_tok
 
     while self.current_tok.type == LU_NEWLINE:
-      res.register_advancement()
       self.advance()
 
-    statement = res.register(self.statement())
-    if res.error: return res
+    statement = res.register((yield self.statement()))
+    if res.error:
+      if self.errors is None: return res
+      statement = yield self.recover(res)
     
     if isinstance(statement, ListNode):
         statements.extend(statement.element_nodes)
-    else:
+    elif statement:
         statements.append(statement)
 
     more_statements = True
@@ -621,90 +1087,94 @@ class Parser:
     while True:
       newline_count = 0
       while self.current_tok.type == LU_NEWLINE:
-        res.register_advancement()
         self.advance()
         newline_count += 1
       if newline_count == 0:
         more_statements = False
       
-      if not more_statements: break
-      statement = res.try_register(self.statement())
-      if not statement:
-        self.reverse(res.to_reverse_count)
-        more_statements = False
-        continue
+      if not more_statements or self.current_key not in STATEMENT_FIRST: break
+      statement = res.register((yield self.statement()))
+      if res.error:
+        if self.errors is None: return res
+        statement = yield self.recover(res)
         
       if isinstance(statement, ListNode):
           statements.extend(statement.element_nodes)
-      else:
+      elif statement:
           statements.append(statement)
 
     return res.success(ListNode(
       statements,
-      pos_start,
-      self.current_tok.pos_end.copy()
+      start_tok.start,
+      self.current_tok.end,
+      start_tok.src
     ))
 
+  def recover(self, res):
+    # With an errors list, a failed statement's error is recorded there and
+    # the rest of its line skipped, so the statement list carries on. A
+    # skipped line that opens a block has that block parsed as well, so its
+    # STOP doesn't end the enclosing one. A keyword closing the enclosing
+    # block is left for it.
+    self.errors.append(res.error)
+    res.error = None
+    if self.current_key in BLOCK_END: return
+
+    # A FUNC header may have started before the failing token
+    in_func = False
+    idx = self.tok_idx - 1
+    while idx >= self.tokens.base and self.tokens.get(idx).type != LU_NEWLINE:
+      in_func = in_func or self.tokens.get(idx).matches(LU_KEYWORD, 'FUNC')
+      idx -= 1
+
+    while True:
+      opens_block = False
+      while self.current_tok.type not in (LU_NEWLINE, LU_EOF):
+        in_func = in_func or self.current_key == 'FUNC'
+        opens_block = self.current_key in ('THEN', 'ELSE') or (in_func and self.current_tok.type == LU_RPAREN)
+        self.advance()
+      if not opens_block or self.current_tok.type == LU_EOF: return
+
+      yield self.statements()
+      in_func = False
+      if self.current_key == 'STOP':
+        self.advance()
+        return
+      if self.current_key not in ('ELSE', 'OTHER'): return
+
   def statement(self):
     res = ParseResult()
-    pos_start = self.current_tok.pos_start.copy()
+    start_tok = self.current_tok
 
     if self.current_tok.matches(LU_KEYWORD, 'BACK'):
-      res.register_advancement()
       self.advance()
 
-      expr = res.try_register(self.expr())
-      if not expr:
-        self.reverse(res.to_reverse_count)
-      return res.success(ReturnNode(expr, pos_start, self.current_tok.pos_start.copy()))
+      expr = None
+      if self.current_key in EXPR_FIRST:
+        expr = res.register((yield self.expr()))
+        if res.error: return res
+      return res.success(ReturnNode(expr, start_tok.start, self.current_tok.start, start_tok.src))
     
     if self.current_tok.matches(LU_KEYWORD, 'CONTINUE'):
-      res.register_advancement()
       self.advance()
-      return res.success(ContinueNode(pos_start, self.current_tok.pos_start.copy()))
+      return res.success(ContinueNode(start_tok.start, self.current_tok.start, start_tok.src))
       
     if self.current_tok.matches(LU_KEYWORD, 'BREAK'):
-      res.register_advancement()
       self.advance()
-      return res.success(BreakNode(pos_start, self.current_tok.pos_start.copy()))
+      return res.success(BreakNode(start_tok.start, self.current_tok.start, start_tok.src))
 
-    expr = res.register(self.expr())
-    if res.error:
+    if self.current_key not in EXPR_FIRST:
       return res.failure(InvalidSyntaxError(
         self.current_tok.pos_start, self.current_tok.pos_end,
         "Expected 'BACK', 'CONTINUE', 'BREAK', 'SET', 'IF', 'FOR', 'WHILE', 'FUNC', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
       ))
-    return res.success(expr)
+
+    return (yield from self.expr())
 
   def expr(self):
     res = ParseResult()
 
-    if self.current_tok.type == LU_IDENTIFIER:
-        var_name = self.current_tok
-        res.register_advancement()
-        self.advance()
-
-        if self.current_tok.type in (LU_PLUSEQ, LU_MINUSEQ):
-            op_tok = self.current_tok
-            res.register_advancement()
-            self.advance()
-            
-            expr = res.register(self.expr())
-            if res.error: return res
-            
-            operation = BinOpNode(
-                VarAccessNode(var_name),
-                Token(LU_PLUS if op_tok.type == LU_PLUSEQ else LU_MINUS, pos_start=op_tok.pos_start, pos_end=op_tok.pos_end),
-                expr
-            )
-            
-            return res.success(VarAssignNode(var_name, operation))
-
-        self.tok_idx -= 1
-        self.update_current_tok()
-
     if self.current_tok.matches(LU_KEYWORD, 'SET'):
-        res.register_advancement()
         self.advance()
 
         if self.current_tok.type != LU_IDENTIFIER:
@@ -714,20 +1184,18 @@ class Parser:
             ))
 
         var_name = self.current_tok
-        res.register_advancement()
         self.advance()
 
         if self.current_tok.type in (LU_PLUSEQ, LU_MINUSEQ):
             op_tok = self.current_tok
-            res.register_advancement()
             self.advance()
             
-            expr = res.register(self.expr())
+            expr = res.register((yield self.expr()))
             if res.error: return res
             
             operation = BinOpNode(
                 VarAccessNode(var_name),
-                Token(LU_PLUS if op_tok.type == LU_PLUSEQ else LU_MINUS, pos_start=op_tok.pos_start, pos_end=op_tok.pos_end),
+                Token(LU_PLUS if op_tok.type == LU_PLUSEQ else LU_MINUS, None, op_tok.start, op_tok.end, op_tok.src),
                 expr
             )
             
@@ -739,92 +1207,96 @@ class Parser:
                 "Expected '=', '+=' or '-='"
             ))
 
-        res.register_advancement()
         self.advance()
-        expr = res.register(self.expr())
+        expr = res.register((yield self.expr()))
         if res.error: return res
         return res.success(VarAssignNode(var_name, expr))
 
-    node = res.register(self.bin_op(self.comp_expr, ((LU_KEYWORD, 'AND'), (LU_KEYWORD, 'OR'), (LU_AMPERSAND, None))))
-
-    if res.error:
+    if self.current_key not in EXPR_FIRST:
         return res.failure(InvalidSyntaxError(
             self.current_tok.pos_start, self.current_tok.pos_end,
             "Expected 'SET', 'IF', 'FOR', 'WHILE', 'FUNC', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
         ))
 
-    return res.success(node)
+    return (yield from self.binary_expr(0))
 
-  def comp_expr(self):
+  def binary_expr(self, min_bp):
     res = ParseResult()
+    tok = self.current_tok
+    prefix_bp = PREFIX_BINDING_POWERS.get(self.current_key)
 
-    if self.current_tok.matches(LU_KEYWORD, 'NOT'):
-      op_tok = self.current_tok
-      res.register_advancement()
+    if prefix_bp is not None and min_bp <= prefix_bp:
       self.advance()
 
-      node = res.register(self.comp_expr())
+      node = res.register((yield self.binary_expr(prefix_bp)))
       if res.error: return res
-      return res.success(UnaryOpNode(op_tok, node))
-    
-    node = res.register(self.bin_op(self.arith_expr, (LU_EE, LU_NE, LU_LT, LU_GT, LU_LTE, LU_GTE)))
-    
-    if res.error:
+      left = UnaryOpNode(tok, node)
+    elif min_bp < BP_COMPARISON and self.current_key not in ATOM_FIRST:
       return res.failure(InvalidSyntaxError(
         self.current_tok.pos_start, self.current_tok.pos_end,
         "Expected int, float, identifier, '+', '-', '(', '[', 'IF', 'FOR', 'WHILE', 'FUNC' or 'NOT'"
       ))
+    else:
+      left = self.simple_operand()
+      if left is None:
+        left = res.register((yield self.call()))
+        if res.error: return res
 
-    return res.success(node)
+    while True:
+      op_tok = self.current_tok
+      binding_powers = BINARY_BINDING_POWERS.get(self.current_key)
+      if binding_powers is None or binding_powers[0] <= min_bp: break
 
-  def arith_expr(self):
-    return self.bin_op(self.term, (LU_PLUS, LU_MINUS))
+      self.advance()
 
-  def term(self):
-    return self.bin_op(self.factor, (LU_MUL, LU_DIV))
+      right = self.simple_operand(binding_powers[1])
+      if right is None:
+        right = res.register((yield self.binary_expr(binding_powers[1])))
+        if res.error: return res
+      left = BinOpNode(left, op_tok, right)
 
-  def factor(self):
-    res = ParseResult()
-    tok = self.current_tok
+    return res.success(left)
 
-    if tok.type in (LU_PLUS, LU_MINUS):
-      res.register_advancement()
-      self.advance()
-      factor = res.register(self.factor())
-      if res.error: return res
-      return res.success(UnaryOpNode(tok, factor))
+  def simple_operand(self, min_bp=None):
+    node_class = SIMPLE_OPERAND_NODES.get(self.current_tok.type)
+    if node_class is None: return None
 
-    return self.power()
+    # Calls and +=/-= need the full rules, and so does an operand that the
+    # next operator binds tighter than min_bp
+    next_tok = self.tokens.get(self.tok_idx + 1)
+    if next_tok.type in (LU_LPAREN, LU_PLUSEQ, LU_MINUSEQ): return None
+    if min_bp is not None:
+      binding_powers = BINARY_BINDING_POWERS.get(next_tok.value if next_tok.type == LU_KEYWORD else next_tok.type)
+      if binding_powers is not None and binding_powers[0] > min_bp: return None
 
-  def power(self):
-    return self.bin_op(self.call, (LU_POW, ), self.factor)
+    tok = self.current_tok
+    self.advance()
+    return node_class(tok)
 
   def call(self):
     res = ParseResult()
-    atom = res.register(self.atom())
+    atom = res.register((yield self.atom()))
     if res.error: return res
 
     if self.current_tok.type == LU_LPAREN:
-      res.register_advancement()
       self.advance()
       arg_nodes = []
 
       if self.current_tok.type == LU_RPAREN:
-        res.register_advancement()
         self.advance()
+      elif self.current_key not in EXPR_FIRST:
+        return res.failure(InvalidSyntaxError(
+          self.current_tok.pos_start, self.current_tok.pos_end,
+          "Expected ')', 'SET', 'IF', 'FOR', 'WHILE', 'FUNC', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
+        ))
       else:
-        arg_nodes.append(res.register(self.expr()))
-        if res.error:
-          return res.failure(InvalidSyntaxError(
-            self.current_tok.pos_start, self.current_tok.pos_end,
-            "Expected ')', 'SET', 'IF', 'FOR', 'WHILE', 'FUNC', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
-          ))
+        arg_nodes.append(res.register((yield self.expr())))
+        if res.error: return res
 
         while self.current_tok.type == LU_COMMA:
-          res.register_advancement()
           self.advance()
 
-          arg_nodes.append(res.register(self.expr()))
+          arg_nodes.append(res.register((yield self.expr())))
           if res.error: return res
 
         if self.current_tok.type != LU_RPAREN:
@@ -833,7 +1305,6 @@ class Parser:
             f"Expected ',' or ')'"
           ))
 
-        res.register_advancement()
         self.advance()
       return res.success(CallNode(atom, arg_nodes))
     return res.success(atom)
@@ -843,30 +1314,26 @@ class Parser:
     tok = self.current_tok
 
     if tok.type in (LU_INT, LU_FLOAT):
-        res.register_advancement()
         self.advance()
         return res.success(NumberNode(tok))
 
     elif tok.type == LU_STRING:
-        res.register_advancement()
         self.advance()
         return res.success(StringNode(tok))
 
     elif tok.type == LU_IDENTIFIER:
-        res.register_advancement()
         self.advance()
         
         if self.current_tok.type in (LU_PLUSEQ, LU_MINUSEQ):
             op_tok = self.current_tok
-            res.register_advancement()
             self.advance()
             
-            expr = res.register(self.expr())
+            expr = res.register((yield self.expr()))
             if res.error: return res
             
             operation = BinOpNode(
                 VarAccessNode(tok),
-                Token(LU_PLUS if op_tok.type == LU_PLUSEQ else LU_MINUS, pos_start=op_tok.pos_start, pos_end=op_tok.pos_end),
+                Token(LU_PLUS if op_tok.type == LU_PLUSEQ else LU_MINUS, None, op_tok.start, op_tok.end, op_tok.src),
                 expr
             )
             
@@ -875,12 +1342,10 @@ class Parser:
         return res.success(VarAccessNode(tok))
 
     elif tok.type == LU_LPAREN:
-      res.register_advancement()
       self.advance()
-      expr = res.register(self.expr())
+      expr = res.register((yield self.expr()))
       if res.error: return res
       if self.current_tok.type == LU_RPAREN:
-        res.register_advancement()
         self.advance()
         return res.success(expr)
       else:
@@ -890,27 +1355,27 @@ class Parser:
         ))
 
     elif tok.type == LU_LSQUARE:
-      list_expr = res.register(self.list_expr())
+      list_expr = res.register((yield self.list_expr()))
       if res.error: return res
       return res.success(list_expr)
     
     elif tok.matches(LU_KEYWORD, 'IF'):
-      if_expr = res.register(self.if_expr())
+      if_expr = res.register((yield self.if_expr()))
       if res.error: return res
       return res.success(if_expr)
 
     elif tok.matches(LU_KEYWORD, 'FOR'):
-      for_expr = res.register(self.for_expr())
+      for_expr = res.register((yield self.for_expr()))
       if res.error: return res
       return res.success(for_expr)
 
     elif tok.matches(LU_KEYWORD, 'WHILE'):
-      while_expr = res.register(self.while_expr())
+      while_expr = res.register((yield self.while_expr()))
       if res.error: return res
       return res.success(while_expr)
 
     elif tok.matches(LU_KEYWORD, 'FUNC'):
-      func_def = res.register(self.func_def())
+      func_def = res.register((yield self.func_def()))
       if res.error: return res
       return res.success(func_def)
 
@@ -922,7 +1387,7 @@ class Parser:
   def list_expr(self):
     res = ParseResult()
     element_nodes = []
-    pos_start = self.current_tok.pos_start.copy()
+    start_tok = self.current_tok
 
     if self.current_tok.type != LU_LSQUARE:
       return res.failure(InvalidSyntaxError(
@@ -930,25 +1395,23 @@ class Parser:
         f"Expected '['"
       ))
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == LU_RSQUARE:
-      res.register_advancement()
       self.advance()
+    elif self.current_key not in EXPR_FIRST:
+      return res.failure(InvalidSyntaxError(
+        self.current_tok.pos_start, self.current_tok.pos_end,
+        "Expected ']', 'SET', 'IF', 'FOR', 'WHILE', 'FUNC', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
+      ))
     else:
-      element_nodes.append(res.register(self.expr()))
-      if res.error:
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          "Expected ']', 'SET', 'IF', 'FOR', 'WHILE', 'FUNC', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
-        ))
+      element_nodes.append(res.register((yield self.expr())))
+      if res.error: return res
 
       while self.current_tok.type == LU_COMMA:
-        res.register_advancement()
         self.advance()
 
-        element_nodes.append(res.register(self.expr()))
+        element_nodes.append(res.register((yield self.expr())))
         if res.error: return res
 
       if self.current_tok.type != LU_RSQUARE:
@@ -957,43 +1420,40 @@ class Parser:
           f"Expected ',' or ']'"
         ))
 
-      res.register_advancement()
       self.advance()
 
     return res.success(ListNode(
       element_nodes,
-      pos_start,
-      self.current_tok.pos_end.copy()
+      start_tok.start,
+      self.current_tok.end,
+      start_tok.src
     ))
 
   def if_expr(self):
     res = ParseResult()
-    all_cases = res.register(self.if_expr_cases('IF'))
+    all_cases = res.register((yield self.if_expr_cases('IF')))
     if res.error: return res
     cases, else_case = all_cases
     return res.success(IfNode(cases, else_case))
 
   def if_expr_b(self):
-    return self.if_expr_cases('OTHER')
+    return (yield self.if_expr_cases('OTHER'))
     
   def if_expr_c(self):
     res = ParseResult()
     else_case = None
 
     if self.current_tok.matches(LU_KEYWORD, 'ELSE'):
-      res.register_advancement()
       self.advance()
 
       if self.current_tok.type == LU_NEWLINE:
-        res.register_advancement()
         self.advance()
 
-        statements = res.register(self.statements())
+        statements = res.register((yield self.statements()))
         if res.error: return res
         else_case = (statements, True)
 
         if self.current_tok.matches(LU_KEYWORD, 'STOP'):
-          res.register_advancement()
           self.advance()
         else:
           return res.failure(InvalidSyntaxError(
@@ -1001,7 +1461,7 @@ class Parser:
             "Expected 'STOP'"
           ))
       else:
-        expr = res.register(self.statement())
+        expr = res.register((yield self.statement()))
         if res.error: return res
         else_case = (expr, False)
 
@@ -1012,11 +1472,11 @@ class Parser:
     cases, else_case = [], None
 
     if self.current_tok.matches(LU_KEYWORD, 'OTHER'):
-      all_cases = res.register(self.if_expr_b())
+      all_cases = res.register((yield self.if_expr_b()))
       if res.error: return res
       cases, else_case = all_cases
     else:
-      else_case = res.register(self.if_expr_c())
+      else_case = res.register((yield self.if_expr_c()))
       if res.error: return res
     
     return res.success((cases, else_case))
@@ -1032,10 +1492,9 @@ class Parser:
         f"Expected '{case_keyword}'"
       ))
 
-    res.register_advancement()
     self.advance()
 
-    condition = res.register(self.expr())
+    condition = res.register((yield self.expr()))
     if res.error: return res
 
     if not self.current_tok.matches(LU_KEYWORD, 'THEN'):
@@ -1044,31 +1503,28 @@ class Parser:
         f"Expected 'THEN'"
       ))
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == LU_NEWLINE:
-      res.register_advancement()
       self.advance()
 
-      statements = res.register(self.statements())
+      statements = res.register((yield self.statements()))
       if res.error: return res
       cases.append((condition, statements, True))
 
       if self.current_tok.matches(LU_KEYWORD, 'STOP'):
-        res.register_advancement()
         self.advance()
       else:
-        all_cases = res.register(self.if_expr_b_or_c())
+        all_cases = res.register((yield self.if_expr_b_or_c()))
         if res.error: return res
         new_cases, else_case = all_cases
         cases.extend(new_cases)
     else:
-      expr = res.register(self.statement())
+      expr = res.register((yield self.statement()))
       if res.error: return res
       cases.append((condition, expr, False))
 
-      all_cases = res.register(self.if_expr_b_or_c())
+      all_cases = res.register((yield self.if_expr_b_or_c()))
       if res.error: return res
       new_cases, else_case = all_cases
       cases.extend(new_cases)
@@ -1084,7 +1540,6 @@ class Parser:
         f"Expected 'FOR'"
       ))
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type != LU_IDENTIFIER:
@@ -1094,7 +1549,6 @@ class Parser:
       ))
 
     var_name = self.current_tok
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type != LU_EQ:
@@ -1103,10 +1557,9 @@ class Parser:
         f"Expected '='"
       ))
     
-    res.register_advancement()
     self.advance()
 
-    start_value = res.register(self.expr())
+    start_value = res.register((yield self.expr()))
     if res.error: return res
 
     if not self.current_tok.matches(LU_KEYWORD, 'TO'):
@@ -1115,17 +1568,15 @@ class Parser:
         f"Expected 'TO'"
       ))
     
-    res.register_advancement()
     self.advance()
 
-    end_value = res.register(self.expr())
+    end_value = res.register((yield self.expr()))
     if res.error: return res
 
     if self.current_tok.matches(LU_KEYWORD, 'STEP'):
-      res.register_advancement()
       self.advance()
 
-      step_value = res.register(self.expr())
+      step_value = res.register((yield self.expr()))
       if res.error: return res
     else:
       step_value = None
@@ -1136,14 +1587,12 @@ class Parser:
         f"Expected 'THEN'"
       ))
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == LU_NEWLINE:
-      res.register_advancement()
       self.advance()
 
-      body = res.register(self.statements())
+      body = res.register((yield self.statements()))
       if res.error: return res
 
       if not self.current_tok.matches(LU_KEYWORD, 'STOP'):
@@ -1152,12 +1601,11 @@ class Parser:
           f"Expected 'STOP'"
         ))
 
-      res.register_advancement()
       self.advance()
 
       return res.success(ForNode(var_name, start_value, end_value, step_value, body, True))
     
-    body = res.register(self.statement())
+    body = res.register((yield self.statement()))
     if res.error: return res
 
     return res.success(ForNode(var_name, start_value, end_value, step_value, body, False))
@@ -1171,10 +1619,9 @@ class Parser:
         f"Expected 'WHILE'"
       ))
 
-    res.register_advancement()
     self.advance()
 
-    condition = res.register(self.expr())
+    condition = res.register((yield self.expr()))
     if res.error: return res
 
     if not self.current_tok.matches(LU_KEYWORD, 'THEN'):
@@ -1183,14 +1630,12 @@ class Parser:
         f"Expected 'THEN'"
       ))
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == LU_NEWLINE:
-      res.register_advancement()
       self.advance()
 
-      body = res.register(self.statements())
+      body = res.register((yield self.statements()))
       if res.error: return res
 
       if not self.current_tok.matches(LU_KEYWORD, 'STOP'):
@@ -1199,12 +1644,11 @@ class Parser:
           f"Expected 'STOP'"
         ))
 
-      res.register_advancement()
       self.advance()
 
       return res.success(WhileNode(condition, body, True))
     
-    body = res.register(self.statement())
+    body = res.register((yield self.statement()))
     if res.error: return res
 
     return res.success(WhileNode(condition, body, False))
@@ -1218,12 +1662,10 @@ class Parser:
         f"Expected 'FUNC'"
       ))
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == LU_IDENTIFIER:
       var_name_tok = self.current_tok
-      res.register_advancement()
       self.advance()
       if self.current_tok.type != LU_LPAREN:
         return res.failure(InvalidSyntaxError(
@@ -1238,17 +1680,14 @@ class Parser:
           f"Expected identifier or '('"
         ))
     
-    res.register_advancement()
     self.advance()
     arg_name_toks = []
 
     if self.current_tok.type == LU_IDENTIFIER:
       arg_name_toks.append(self.current_tok)
-      res.register_advancement()
       self.advance()
       
       while self.current_tok.type == LU_COMMA:
-        res.register_advancement()
         self.advance()
 
         if self.current_tok.type != LU_IDENTIFIER:
@@ -1258,7 +1697,6 @@ class Parser:
           ))
 
         arg_name_toks.append(self.current_tok)
-        res.register_advancement()
         self.advance()
       
       if self.current_tok.type != LU_RPAREN:
@@ -1273,14 +1711,12 @@ class Parser:
           f"Expected identifier or ')'"
         ))
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == LU_ARROW:
-      res.register_advancement()
       self.advance()
 
-      body = res.register(self.expr())
+      body = res.register((yield self.expr()))
       if res.error: return res
 
       return res.success(FuncDefNode(
@@ -1296,10 +1732,9 @@ class Parser:
         f"Expected '->' or NEWLINE"
       ))
 
-    res.register_advancement()
     self.advance()
 
-    body = res.register(self.statements())
+    body = res.register((yield self.statements()))
     if res.error: return res
 
     if not self.current_tok.matches(LU_KEYWORD, 'STOP'):
@@ -1308,7 +1743,6 @@ class Parser:
         f"Expected 'STOP'"
       ))
 
-    res.register_advancement()
     self.advance()
     
     return res.success(FuncDefNode(
@@ -1318,43 +1752,297 @@ class Parser:
       False
     ))
 
-  def bin_op(self, func_a, ops, func_b=None):
-    if func_b == None:
-        func_b = func_a
-    
-    res = ParseResult()
-    left = res.register(func_a())
-    if res.error: return res
+######################
+# INCREMENTAL PARSER #
+######################
+
+class TopLevelStatement:
+  # A statement's trees and errors, with every offset in them relative to
+  # base, so an edit before the statement only moves base. A statement
+  # parsed first in a statement list may start with any token.
+  __slots__ = ('src', 'base', 'start', 'first', 'nodes', 'errors')
+
+  def __init__(self, src, start, first, nodes, errors):
+    self.src = src
+    self.base = 0
+    self.start = start
+    self.first = first
+    self.nodes = nodes
+    self.errors = errors
+
+    anchor_nodes(nodes, self)
+    for error in errors:
+      error.pos_start = ChunkedPosition(error.pos_start.idx, self, error.pos_start.is_end)
+      error.pos_end = ChunkedPosition(error.pos_end.idx, self, error.pos_end.is_end)
+
+def anchor_nodes(nodes, chunk):
+  # Makes newly parsed nodes and their tokens keep their offsets relative to
+  # chunk, whose base is still 0, without recursion since trees can be
+  # nested arbitrarily deep
+  stack = list(nodes)
+  seen = set()
+
+  while stack:
+    item = stack.pop()
+    item_type = type(item)
+
+    if item_type is Token:
+      item.src = chunk
+      item.__class__ = ChunkedToken
+    elif item_type is list or item_type is tuple:
+      stack.extend(item)
+    elif isinstance(item, Node):
+      if id(item) in seen: continue
+      seen.add(id(item))
+      item.pos_start = ChunkedPosition(item.start, chunk)
+      item.pos_end = ChunkedPosition(item.end, chunk, True)
+      del item.start, item.end
+      for name in item_type.__slots__:
+        stack.append(getattr(item, name))
+
+class IncrementalParser:
+  # Keeps a program's top-level statements between edits. An edit relexes
+  # and reparses from the statement it starts in until the parser is back
+  # at the start of an untouched statement, in the same state, which is
+  # reused and moved along with every one after it. Syntax errors are
+  # recovered from as check() does, so every statement has a tree or the
+  # errors that replaced it.
+  def __init__(self, fn, text):
+    self.src = SourceFile(fn, text)
+    self.statements = []
+    self.start = 0
+    self.end = 0
+
+    # Like check(), the whole program's trees are allocated at once
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+      self.reparse(0, 0, 0)
+    finally:
+      if gc_enabled: gc.enable()
+
+  def edit(self, offset, removed, inserted):
+    self.src.text = self.src.text[:offset] + inserted + self.src.text[offset + removed:]
+    self.src.line_starts = None
+    self.reparse(offset, removed, len(inserted))
+
+  def reparse(self, offset, removed, inserted):
+    delta = inserted - removed
+
+    # Statements before the one the edit starts in are untouched, the ones
+    # starting after the removed text may be reused
+    first = max(bisect.bisect_right([statement.start for statement in self.statements], offset) - 1, 0)
+    reusable = first
+    while reusable < len(self.statements) and self.statements[reusable].start < offset + removed:
+      reusable += 1
+    damage_end = offset + inserted
+
+    lexer = Lexer(self.src.fn, self.src.text)
+    lexer.src = self.src
+    errors = []
+    tokens = lexer.generate_tokens(self.statements[first].start if first else 0, errors)
+    parser = Parser(tokens, errors)
+    if not first: self.start = parser.current_tok.start
+
+    # Like Parser.parse, a statement list ends at a token that cannot start
+    # a statement, which is reported and its line skipped, and the next list
+    # starts with whatever statement comes after
+    list_first = self.statements[first].first if first else True
+    start_first = list_first
+
+    new_statements = []
+    while True:
+      while parser.current_tok.type == LU_NEWLINE:
+        parser.advance()
 
-    while self.current_tok.type in ops or (self.current_tok.type, self.current_tok.value) in ops:
-        op_tok = self.current_tok
-        res.register_advancement()
-        self.advance()
+      if not list_first and parser.current_tok.type != LU_EOF and parser.current_key not in STATEMENT_FIRST:
+        errors.append(parser.stray_token_error())
+        parser.skip_line()
+        list_first = True
+        continue
 
-        if op_tok.type in (LU_PLUSEQ, LU_MINUSEQ):
-            if not isinstance(left, VarAccessNode):
-                return res.failure(InvalidSyntaxError(
-                    op_tok.pos_start, op_tok.pos_end,
-                    f"Expected variable"
-                ))
-            
-            right = res.register(func_b())
-            if res.error: return res
+      # Bad characters and lines skipped since the last statement belong to
+      # the next one, which then starts at them
+      start = parser.current_tok.start
+      if errors: start = errors[0].pos_start.idx
+
+      if parser.current_tok.type == LU_EOF:
+        # Like the full parser, a program needs at least one statement
+        if not first and not new_statements:
+          errors.append(InvalidSyntaxError(
+            parser.current_tok.pos_start, parser.current_tok.pos_end,
+            "Expected 'BACK', 'CONTINUE', 'BREAK', 'SET', 'IF', 'FOR', 'WHILE', 'FUNC', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
+          ))
+        if errors: new_statements.append(TopLevelStatement(self.src, start, start_first, [], errors[:]))
+        reusable = len(self.statements)
+        self.end = parser.current_tok.end
+        break
 
-            operation = BinOpNode(
-                left,
-                Token(LU_PLUS if op_tok.type == LU_PLUSEQ else LU_MINUS, pos_start=op_tok.pos_start, pos_end=op_tok.pos_end),
-                right
-            )
-            
-            left = VarAssignNode(left.var_name_tok, operation)
-            continue
+      if start >= damage_end and not errors:
+        while reusable < len(self.statements) and self.statements[reusable].start + delta < start:
+          reusable += 1
+        if (
+          reusable < len(self.statements) and self.statements[reusable].start + delta == start and
+          self.statements[reusable].first == list_first
+        ):
+          self.end += delta
+          break
+
+      res = parser.run_rule(parser.statement())
+      nodes = []
+      if res.error:
+        parser.run_rule(parser.recover(res))
+      elif isinstance(res.node, ListNode):
+        nodes = res.node.element_nodes
+      else:
+        nodes = [res.node]
 
-        right = res.register(func_b())
-        if res.error: return res
-        left = BinOpNode(left, op_tok, right)
+      list_first = False
+      if parser.current_tok.type not in (LU_NEWLINE, LU_EOF):
+        errors.append(parser.stray_token_error())
+        parser.skip_line()
+        list_first = True
 
-    return res.success(left)
+      new_statements.append(TopLevelStatement(self.src, start, start_first, nodes, errors[:]))
+      errors.clear()
+      start_first = list_first
+
+    for statement in self.statements[reusable:]:
+      statement.start += delta
+      statement.base += delta
+
+    self.statements[first:reusable] = new_statements
+
+  def parse(self):
+    res = ParseResult()
+    errors = self.errors
+    if errors: return res.failure(errors[0])
+
+    nodes = []
+    for statement in self.statements:
+      nodes.extend(statement.nodes)
+
+    return res.success(ListNode(nodes, self.start, self.end, self.src))
+
+  @property
+  def errors(self):
+    errors = [error for statement in self.statements for error in statement.errors]
+    return sorted(errors, key=lambda error: error.pos_start.idx)
+
+  def diagnostics(self):
+    return unique_diagnostics(self.errors)
+
+#############
+# AST CACHE #
+#############
+
+# Parsed programs are pickled into a __lumencache__ directory next to their
+# source file, one entry per file named after a hash of the source text and
+# of this interpreter, so any change to either misses the cache.
+CACHE_DIR = '__lumencache__'
+CACHE_SUFFIX = '.ast'
+
+# Loading an entry unpickles it, which can run any code the entry names,
+# and whoever can write next to a script can write its cache. So entries
+# are signed with a key only this user can read, and one whose signature
+# does not check out is ignored.
+CACHE_KEY_FILE = os.path.join(os.path.expanduser('~'), '.lumencache_key')
+CACHE_KEY_SIZE = 32
+
+interpreter_hash = None
+cache_key = None
+
+def get_cache_key():
+  # Raises OSError when there is no key to be had, and then nothing is
+  # cached
+  global cache_key
+  if cache_key is None:
+    try:
+      fd = os.open(CACHE_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+      with open(CACHE_KEY_FILE, 'rb') as f:
+        key = f.read()
+      # Another run may not have finished writing it
+      if len(key) != CACHE_KEY_SIZE: raise OSError('Cache key is not ready')
+      cache_key = key
+    else:
+      key = secrets.token_bytes(CACHE_KEY_SIZE)
+      with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+      cache_key = key
+  return cache_key
+
+def cache_signature(entry, data):
+  return hmac.new(get_cache_key(), entry.encode('utf-8', 'surrogatepass') + data, hashlib.sha256).digest()
+
+def cache_entry(fn, text):
+  global interpreter_hash
+  if interpreter_hash is None:
+    with open(__file__, 'rb') as f:
+      interpreter_hash = hashlib.sha256(f.read()).hexdigest()
+
+  key = hashlib.sha256((interpreter_hash + text).encode('utf-8', 'surrogatepass')).hexdigest()
+  name = os.path.basename(fn)
+  return os.path.join(os.path.dirname(fn), CACHE_DIR), name, f'{name}.{key}{CACHE_SUFFIX}'
+
+def load_cached_ast(fn, text):
+  if not os.path.isfile(fn): return None
+
+  # A whole tree is allocated at once, which would otherwise trigger many
+  # pointless cyclic garbage collections
+  gc_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    cache_dir, _, entry = cache_entry(fn, text)
+    with open(os.path.join(cache_dir, entry), 'rb') as f:
+      signature = f.read(hashlib.sha256().digest_size)
+      data = f.read()
+    if not hmac.compare_digest(signature, cache_signature(entry, data)): return None
+    node = pickle.loads(data)
+  except Exception:
+    return None
+  finally:
+    if gc_enabled: gc.enable()
+
+  # The same file may have been cached under another path
+  node.src.fn = fn
+  return node
+
+def save_cached_ast(fn, text, node):
+  if not os.path.isfile(fn): return
+
+  gc_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    cache_dir, name, entry = cache_entry(fn, text)
+    data = pickle.dumps(node, pickle.HIGHEST_PROTOCOL)
+    signature = cache_signature(entry, data)
+  except (OSError, RecursionError, pickle.PicklingError):
+    return
+  finally:
+    if gc_enabled: gc.enable()
+
+  try:
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Write under a temporary name first so readers never see a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(signature)
+        f.write(data)
+      os.replace(tmp_path, os.path.join(cache_dir, entry))
+    except BaseException:
+      os.remove(tmp_path)
+      raise
+
+    # Evict entries for older versions of the same file
+    for other in os.listdir(cache_dir):
+      other_name, _, _ = other[:-len(CACHE_SUFFIX)].rpartition('.')
+      if other != entry and other_name == name and other.endswith(CACHE_SUFFIX):
+        os.remove(os.path.join(cache_dir, other))
+  except OSError:
+    pass
 
 ##########
 # RT RES #
@@ -1411,6 +2099,40 @@ class RTResult:
       self.loop_should_break
     )
 
+# The same outcomes as exceptions, for code that does not pass an RTResult
+# back from every step
+
+class RuntimeFailure(Exception):
+  def __init__(self, error):
+    super().__init__(error.details)
+    self.error = error
+
+class FunctionReturn(Exception):
+  def __init__(self, value):
+    super().__init__()
+    self.value = value
+
+class LoopContinue(Exception):
+  pass
+
+class LoopBreak(Exception):
+  pass
+
+# A call in tail position, for the function making it to run in its place
+class TailCall(Exception):
+  def __init__(self, function, args):
+    super().__init__()
+    self.function = function
+    self.args = args
+
+def unwrap(res):
+  # An RTResult's value, or its outcome raised as one of the above
+  if res.error: raise RuntimeFailure(res.error)
+  if res.func_return_value: raise FunctionReturn(res.func_return_value)
+  if res.loop_should_continue: raise LoopContinue()
+  if res.loop_should_break: raise LoopBreak()
+  return res.value
+
 #######
 # VAL #
 #######
@@ -1681,10 +2403,10 @@ class String(Value):
         
         if '{' in result and '}' in result:
             variables = {}
-            current_ctx = exec_ctx
-            while current_ctx:
-                variables.update(current_ctx.symbol_table.symbols)
-                current_ctx = current_ctx.parent
+            symbol_table = exec_ctx.symbol_table
+            while symbol_table:
+                variables.update(symbol_table.symbols)
+                symbol_table = symbol_table.parent
 
             result = result.replace('{{', '###LEFTBRACE###')
             result = result.replace('}}', '###RIGHTBRACE###')
@@ -1732,6 +2454,7 @@ class List(Value):
   def added_to(self, other):
     new_list = self.copy()
     new_list.elements.append(other)
+    List.mutations += 1
     return new_list, None
 
   def subbed_by(self, other):
@@ -1739,6 +2462,7 @@ class List(Value):
       new_list = self.copy()
       try:
         new_list.elements.pop(other.value)
+        List.mutations += 1
         return new_list, None
       except:
         return None, RTError(
@@ -1753,6 +2477,7 @@ class List(Value):
     if isinstance(other, List):
       new_list = self.copy()
       new_list.elements.extend(other.elements)
+      List.mutations += 1
       return new_list, None
     else:
       return None, Value.illegal_operation(self, other)
@@ -1782,6 +2507,10 @@ class List(Value):
   def __repr__(self):
     return f'[{", ".join([repr(x) for x in self.elements])}]'
 
+# Counts every change made to a list's elements, which copies of the list
+# share
+List.mutations = 0
+
 class BaseFunction(Value):
   def __init__(self, name):
     super().__init__()
@@ -1813,10 +2542,7 @@ class BaseFunction(Value):
 
   def populate_args(self, arg_names, args, exec_ctx):
     for i in range(len(args)):
-      arg_name = arg_names[i]
-      arg_value = args[i]
-      arg_value.set_context(exec_ctx)
-      exec_ctx.symbol_table.set(arg_name, arg_value)
+      exec_ctx.symbol_table.set(arg_names[i], args[i])
 
   def check_and_populate_args(self, arg_names, args, exec_ctx):
     res = RTResult()
@@ -1831,23 +2557,89 @@ class Function(BaseFunction):
     self.body_node = body_node
     self.arg_names = arg_names
     self.should_auto_return = should_auto_return
+    self.compiled_body = None
+    self.transpiled_body = None
+    self.layout = None
+
+  def generate_new_frame(self, context, pos_start):
+    # The context of a call made from context, in which a resolved body's
+    # variables have slots
+    new_context = Context(self.name, context, pos_start)
+    if self.layout is None:
+      new_context.symbol_table = SymbolTable(context.symbol_table)
+    else:
+      new_context.symbol_table = FrameTable(self.layout, context.symbol_table)
+    return new_context
+
+  def generate_tail_frame(self, frame):
+    # The frame of a call in tail position from frame, to run in its place.
+    # A call to the same FUNC reuses frame, whose other variables are what
+    # the call would have seen through its caller. Any other call gets a new
+    # frame under frame's caller, with what it would have seen of frame's
+    # variables kept in a TailScope between them, which later calls add to
+    # instead of nesting frames. frame looks through the scope from then on,
+    # so values made in it do not keep the frames before it.
+    symbol_table = frame.symbol_table
+    if self.layout is not None and type(symbol_table) is FrameTable and symbol_table.layout is self.layout:
+      frame.tail_calls += 1
+      return frame
+
+    scope = symbol_table.parent
+    if type(scope) is not TailScope:
+      scope = TailScope(scope)
+    scope.symbols.update(symbol_table.symbols)
+    frame.symbol_table = scope
+
+    new_context = Context(self.name, frame.parent, frame.parent_entry_pos)
+    new_context.tail_calls = frame.tail_calls + 1
+    if self.layout is None:
+      new_context.symbol_table = SymbolTable(scope)
+    else:
+      new_context.symbol_table = FrameTable(self.layout, scope)
+    return new_context
 
   def execute(self, args):
     res = RTResult()
-    interpreter = Interpreter()
-    exec_ctx = self.generate_new_context()
+    try:
+      return res.success(self.call(args, self.context, self.pos_start, self.pos_end))
+    except RuntimeFailure as failure:
+      return res.failure(failure.error)
+    except LoopContinue:
+      return res.success_continue()
+    except LoopBreak:
+      return res.success_break()
+
+  def call(self, args, context, pos_start, pos_end):
+    # What a call made from context evaluates to, with errors, CONTINUE and
+    # BREAK raised. A call in tail position comes back as a TailCall and
+    # runs in this loop instead, in the frame generate_tail_frame gives it.
+    if len(args) != len(self.arg_names):
+      function = self.copy().set_pos(pos_start, pos_end).set_context(context)
+      unwrap(function.check_args(function.arg_names, args))
 
-    res.register(self.check_and_populate_args(self.arg_names, args, exec_ctx))
-    if res.should_return(): return res
+    interpreter = Interpreter()
+    function = self
+    exec_ctx = self.generate_new_frame(context, pos_start)
+    self.populate_args(self.arg_names, args, exec_ctx)
 
-    value = res.register(interpreter.visit(self.body_node, exec_ctx))
-    if res.should_return() and res.func_return_value == None: return res
+    while True:
+      try:
+        value = interpreter.visit(function.body_node, exec_ctx)
+      except FunctionReturn as function_return:
+        return function_return.value
+      except TailCall as tail_call:
+        function = tail_call.function
+        exec_ctx = function.generate_tail_frame(exec_ctx)
+        function.populate_args(function.arg_names, tail_call.args, exec_ctx)
+        continue
 
-    ret_value = (value if self.should_auto_return else None) or res.func_return_value or Number.null
-    return res.success(ret_value)
+      return value if function.should_auto_return else Number.null
 
   def copy(self):
     copy = Function(self.name, self.body_node, self.arg_names, self.should_auto_return)
+    copy.compiled_body = self.compiled_body
+    copy.transpiled_body = self.transpiled_body
+    copy.layout = self.layout
     copy.set_context(self.context)
     copy.set_pos(self.pos_start, self.pos_end)
     return copy
@@ -1980,6 +2772,7 @@ class BuiltInFunction(BaseFunction):
       ))
 
     list_.elements.append(value)
+    List.mutations += 1
     return RTResult().success(Number.null)
   execute_append.arg_names = ["list", "value"]
 
@@ -2003,6 +2796,7 @@ class BuiltInFunction(BaseFunction):
 
     try:
       element = list_.elements.pop(index.value)
+      List.mutations += 1
     except:
       return RTResult().failure(RTError(
         self.pos_start, self.pos_end,
@@ -2031,6 +2825,7 @@ class BuiltInFunction(BaseFunction):
       ))
 
     listA.elements.extend(listB.elements)
+    List.mutations += 1
     return RTResult().success(Number.null)
   execute_extend.arg_names = ["listA", "listB"]
 
@@ -2071,6 +2866,7 @@ class BuiltInFunction(BaseFunction):
         exec_ctx
       ))
 
+    BuiltInFunction.scripts_run += 1
     _, error = run(fn, script)
     
     if error:
@@ -2234,10 +3030,20 @@ BuiltInFunction.random_float  = BuiltInFunction("random_float")
 BuiltInFunction.random_choice = BuiltInFunction("random_choice")
 BuiltInFunction.format      = BuiltInFunction("format")
 
+# Counts scripts started by RUN, which may set global variables
+BuiltInFunction.scripts_run = 0
+
 BuiltInFunction.execute_to_int.arg_names = ["value"]
 BuiltInFunction.execute_to_float.arg_names = ["value"]
 BuiltInFunction.execute_to_str.arg_names = ["value"]
 
+# Built-ins whose result depends on nothing but their arguments and that
+# change nothing, so the optimizer may reuse a call's value
+PURE_BUILTINS = {
+  'print_ret', 'is_number', 'is_string', 'is_list', 'is_function', 'len',
+  'to_int', 'to_float', 'to_str'
+}
+
 ###########
 # CONTEXT #
 ###########
@@ -2248,6 +3054,9 @@ class Context:
     self.parent = parent
     self.parent_entry_pos = parent_entry_pos
     self.symbol_table = None
+    self.invariants = None
+    # Calls that ran in this context in place of the one that made them
+    self.tail_calls = 0
 
 ################
 # SYMBOL TABLE #
@@ -2270,11 +3079,188 @@ class SymbolTable:
   def remove(self, name):
     del self.symbols[name]
 
+# The variables of the frames tail calls have replaced, as the calls that
+# replaced them would have seen them through their callers
+class TailScope(SymbolTable):
+  pass
+
+class FrameTable(SymbolTable):
+  # The symbol table of a resolved function call. The variables the body
+  # binds live in a list, at the slots the layout maps their names to, and
+  # anything else set by name goes in extra.
+  def __init__(self, layout, parent=None):
+    self.layout = layout
+    self.slots = [None] * len(layout)
+    self.extra = {}
+    self.parent = parent
+
+  # For code that reads variables by name at run time, like FORMAT
+  @property
+  def symbols(self):
+    symbols = {name: self.slots[slot] for name, slot in self.layout.items() if self.slots[slot] is not None}
+    symbols.update(self.extra)
+    return symbols
+
+  def get(self, name):
+    slot = self.layout.get(name)
+    value = self.extra.get(name) if slot is None else self.slots[slot]
+    if value == None and self.parent:
+      return self.parent.get(name)
+    return value
+
+  def set(self, name, value):
+    slot = self.layout.get(name)
+    if slot is None:
+      self.extra[name] = value
+    else:
+      self.slots[slot] = value
+
+  def remove(self, name):
+    slot = self.layout.get(name)
+    if slot is None:
+      del self.extra[name]
+    else:
+      self.slots[slot] = None
+
+#################
+# INLINE CACHES #
+#################
+
+# Every inline cache of a tree still alive, for inline_cache_stats(). A
+# cache is kept by its node, and goes with it.
+INLINE_CACHES = weakref.WeakSet()
+
+# Operators on two numbers, computed without the method and its type check
+NUMBER_OPERATORS = {
+  LU_PLUS: (operator.add, False),
+  LU_MINUS: (operator.sub, False),
+  LU_MUL: (operator.mul, False),
+  LU_EE: (operator.eq, True),
+  LU_NE: (operator.ne, True),
+  LU_LT: (operator.lt, True),
+  LU_GT: (operator.gt, True),
+  LU_LTE: (operator.le, True),
+  LU_GTE: (operator.ge, True),
+}
+
+def number_operation(compute, comparison):
+  if comparison:
+    def operation(left, right, node, context):
+      number = Number.__new__(Number)
+      number.value = 1 if compute(left.value, right.value) else 0
+      number.context = context
+      number.pos_start = node.pos_start
+      number.pos_end = node.pos_end
+      return number
+    return operation
+
+  def operation(left, right, node, context):
+    number = Number.__new__(Number)
+    number.value = compute(left.value, right.value)
+    number.context = context
+    number.pos_start = node.pos_start
+    number.pos_end = node.pos_end
+    return number
+  return operation
+
+def method_operation(method):
+  def operation(left, right, node, context):
+    result, error = method(left, right)
+    if error:
+      result, error = method(place(left, node.left_node, context), place(right, node.right_node, context))
+      raise RuntimeFailure(error)
+    return result
+  return operation
+
+class InlineCache:
+  # The operand types a binary operation last saw and the implementation
+  # picked for them, so the next run with the same types goes straight to
+  # it. A run with other types is a miss and picks again.
+  __slots__ = ('node', 'method_name', 'left_type', 'right_type', 'implementation', 'hits', 'misses', 'seen', '__weakref__')
+
+  def __init__(self, node):
+    op_tok = node.op_tok
+    self.node = node
+    if op_tok.matches(LU_KEYWORD, 'AND'):
+      self.method_name = 'anded_by'
+    elif op_tok.matches(LU_KEYWORD, 'OR'):
+      self.method_name = 'ored_by'
+    else:
+      self.method_name = BINOP_METHODS.get(op_tok.type)
+    self.left_type = None
+    self.right_type = None
+    self.implementation = None
+    self.hits = 0
+    self.misses = 0
+    self.seen = set()
+
+  def miss(self, left_type, right_type):
+    self.misses += 1
+    self.seen.add((left_type.__name__, right_type.__name__))
+    if self.method_name is None: return None
+
+    if left_type is Number and right_type is Number and self.node.op_tok.type in NUMBER_OPERATORS:
+      implementation = number_operation(*NUMBER_OPERATORS[self.node.op_tok.type])
+    else:
+      implementation = method_operation(getattr(left_type, self.method_name))
+
+    self.left_type, self.right_type, self.implementation = left_type, right_type, implementation
+    return implementation
+
+def inline_cache_stats():
+  # One entry per binary operation resolved in a tree still alive, the most
+  # missed first.
+  # A site that has seen more than one pair of types is polymorphic.
+  stats = []
+  for cache in INLINE_CACHES:
+    pos = cache.node.pos_start
+    ln, col = pos.line_col()
+    stats.append({
+      'file': pos.fn,
+      'line': ln + 1,
+      'column': col + 1,
+      'operator': cache.method_name or str(cache.node.op_tok),
+      'hits': cache.hits,
+      'misses': cache.misses,
+      'types': sorted(cache.seen),
+      'polymorphic': len(cache.seen) > 1,
+    })
+  stats.sort(key=lambda entry: (-entry['misses'], entry['file'], entry['line'], entry['column']))
+  return stats
+
+def clear_inline_caches():
+  INLINE_CACHES.clear()
+
 #########
 # INTER #
 #########
 
+# Values are handed to every reader as they are, without a copy placed at
+# the reading node. An operation that fails is worked out again on copies
+# placed where its operands came from, for the error to point at the source.
+def place(value, node, context):
+  node = origin(node)
+  value = value.copy().set_context(context)
+  # An IF has already placed the value its case gave, if it gave one
+  if type(node) is not IfNode or value.pos_start is None:
+    value.set_pos(node.pos_start, node.pos_end)
+  return value
+
+# The node whose range a value is read at, past the nodes that hand on the
+# value of another as it is
+def origin(node):
+  while True:
+    if type(node) is InvariantNode:
+      node = node.node
+    elif type(node) is VarAssignNode:
+      node = node.value_node
+    else:
+      return node
+
 class Interpreter:
+  # Each visit returns the node's value. A runtime error, BACK, CONTINUE and
+  # BREAK leave the normal path as RuntimeFailure, FunctionReturn,
+  # LoopContinue and LoopBreak, caught where they stop.
   def visit(self, node, context):
     method_name = f'visit_{type(node).__name__}'
     method = getattr(self, method_name, self.no_visit_method)
@@ -2284,58 +3270,77 @@ class Interpreter:
     raise Exception(f'No visit_{type(node).__name__} method defined')
 
   def visit_NumberNode(self, node, context):
-    return RTResult().success(
-      Number(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return Number(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
 
   def visit_StringNode(self, node, context):
-    return RTResult().success(
-      String(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return String(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
 
   def visit_ListNode(self, node, context):
-    res = RTResult()
-    elements = []
-
-    for element_node in node.element_nodes:
-      elements.append(res.register(self.visit(element_node, context)))
-      if res.should_return(): return res
-
-    return res.success(
-      List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    elements = [self.visit(element_node, context) for element_node in node.element_nodes]
+    return List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
 
   def visit_VarAccessNode(self, node, context):
-    res = RTResult()
     var_name = node.var_name_tok.value
-    value = context.symbol_table.get(var_name)
+    address = node.resolved
+
+    if address is None:
+      value = context.symbol_table.get(var_name)
+    elif address[0] == GLOBAL_DEPTH:
+      value = global_symbol_table.symbols.get(var_name)
+    else:
+      # A local the body has not set yet is still looked for in the caller
+      value = context.symbol_table.slots[address[1]]
+      if value is None: value = context.symbol_table.parent.get(var_name)
 
     if not value:
-      return res.failure(RTError(
+      raise RuntimeFailure(RTError(
         node.pos_start, node.pos_end,
         f"'{var_name}' is not defined",
         context
       ))
 
-    value = value.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
-    return res.success(value)
+    return value
 
   def visit_VarAssignNode(self, node, context):
-    res = RTResult()
-    var_name = node.var_name_tok.value
-    value = res.register(self.visit(node.value_node, context))
-    if res.should_return(): return res
+    value = self.visit(node.value_node, context)
+    self.store(node.resolved, node.var_name_tok.value, value, context)
+    return value
 
-    context.symbol_table.set(var_name, value)
-    return res.success(value)
+  def store(self, address, var_name, value, context):
+    if address is None:
+      context.symbol_table.set(var_name, value)
+    elif address[0] == GLOBAL_DEPTH:
+      global_symbol_table.symbols[var_name] = value
+    else:
+      context.symbol_table.slots[address[1]] = value
 
   def visit_BinOpNode(self, node, context):
-    res = RTResult()
-    left = res.register(self.visit(node.left_node, context))
-    if res.should_return(): return res
-    right = res.register(self.visit(node.right_node, context))
-    if res.should_return(): return res
+    cache = node.resolved
+    if cache is UNBOXED:
+      return new_number(self.number(node, context), context, node.pos_start, node.pos_end)
+
+    left = self.visit(node.left_node, context)
+    right = self.visit(node.right_node, context)
+
+    if cache is None:
+      return self.operate(node, left, right, context)
+    if type(left) is cache.left_type and type(right) is cache.right_type:
+      cache.hits += 1
+      return cache.implementation(left, right, node, context)
+
+    implementation = cache.miss(type(left), type(right))
+    if implementation is None:
+      return self.operate(node, left, right, context)
+    return implementation(left, right, node, context)
+
+  def operate(self, node, left, right, context):
+    result, error = self.apply(node, left, right, context)
+    if error:
+      result, error = self.apply(node, place(left, node.left_node, context), place(right, node.right_node, context), context)
+      raise RuntimeFailure(error)
+    return result
 
+  def apply(self, node, left, right, context):
     result = None
     error = None
 
@@ -2372,164 +3377,2914 @@ class Interpreter:
         context
       )
 
-    if error:
-      return res.failure(error)
-    else:
-      return res.success(result.set_pos(node.pos_start, node.pos_end))
+    return result, error
+
+  def number(self, node, context):
+    # The Python number a node proven to be a Number evaluates to. Operators
+    # the resolver marked unboxed and their operands are computed without
+    # making a Number for each step; other nodes are visited as usual.
+    node_type = type(node)
+    if node_type is BinOpNode and node.resolved is UNBOXED:
+      compute, comparison = NUMBER_OPERATORS[node.op_tok.type]
+      value = compute(self.number(node.left_node, context), self.number(node.right_node, context))
+      if comparison: return 1 if value else 0
+      return value
+    if node_type is NumberNode:
+      return node.tok.value
+    if node_type is VarAccessNode:
+      address = node.resolved
+      if address is not None:
+        if address[0] == GLOBAL_DEPTH:
+          value = global_symbol_table.symbols.get(node.var_name_tok.value)
+        else:
+          value = context.symbol_table.slots[address[1]]
+        if value is not None: return value.value
+    return self.visit(node, context).value
 
   def visit_UnaryOpNode(self, node, context):
-    res = RTResult()
-    number = res.register(self.visit(node.node, context))
-    if res.should_return(): return res
-
-    error = None
+    number = self.visit(node.node, context)
 
     if node.op_tok.type == LU_MINUS:
-      number, error = number.multed_by(Number(-1))
+      operation = lambda number: number.multed_by(Number(-1))
     elif node.op_tok.matches(LU_KEYWORD, 'NOT'):
-      number, error = number.notted()
+      operation = lambda number: number.notted()
+    else:
+      return number
 
+    result, error = operation(number)
     if error:
-      return res.failure(error)
-    else:
-      return res.success(number.set_pos(node.pos_start, node.pos_end))
+      result, error = operation(place(number, node.node, context))
+      raise RuntimeFailure(error)
+    return result
 
   def visit_IfNode(self, node, context):
-    res = RTResult()
-
     for condition, expr, should_return_null in node.cases:
-      condition_value = res.register(self.visit(condition, context))
-      if res.should_return(): return res
+      if condition.resolved is UNBOXED:
+        is_true = self.number(condition, context) != 0
+      else:
+        is_true = self.visit(condition, context).is_true()
 
-      if condition_value.is_true():
-        expr_value = res.register(self.visit(expr, context))
-        if res.should_return(): return res
-        return res.success(Number.null if should_return_null else expr_value)
+      if is_true:
+        expr_value = self.visit(expr, context)
+        if should_return_null: return Number.null
+        return place(expr_value, expr, context) if node.resolved else expr_value
 
     if node.else_case:
       expr, should_return_null = node.else_case
-      expr_value = res.register(self.visit(expr, context))
-      if res.should_return(): return res
-      return res.success(Number.null if should_return_null else expr_value)
+      expr_value = self.visit(expr, context)
+      if should_return_null: return Number.null
+      return place(expr_value, expr, context) if node.resolved else expr_value
 
-    return res.success(Number.null)
+    return Number.null
 
   def visit_ForNode(self, node, context):
-    res = RTResult()
-    elements = []
-
-    start_value = res.register(self.visit(node.start_value_node, context))
-    if res.should_return(): return res
-
-    end_value = res.register(self.visit(node.end_value_node, context))
-    if res.should_return(): return res
+    start_value = self.visit(node.start_value_node, context)
+    end_value = self.visit(node.end_value_node, context)
 
     if node.step_value_node:
-      step_value = res.register(self.visit(node.step_value_node, context))
-      if res.should_return(): return res
+      step_value = self.visit(node.step_value_node, context)
     else:
       step_value = Number(1)
 
+    if (
+      type(start_value.value) is int and type(end_value.value) is int and
+      type(step_value.value) is int and step_value.value != 0 and node.resolved is not None
+    ):
+      return self.counted_for(node, context, range(start_value.value, end_value.value, step_value.value))
+
+    collect = not node.should_return_null
+    elements = []
     i = start_value.value
 
     if step_value.value >= 0:
       condition = lambda: i < end_value.value
     else:
       condition = lambda: i > end_value.value
-    
+
     while condition():
-      context.symbol_table.set(node.var_name_tok.value, Number(i))
+      self.store(node.resolved, node.var_name_tok.value, Number(i), context)
       i += step_value.value
 
-      value = res.register(self.visit(node.body_node, context))
-      if res.should_return() and res.loop_should_continue == False and res.loop_should_break == False: return res
-      
-      if res.loop_should_continue:
+      try:
+        value = self.visit(node.body_node, context)
+      except LoopContinue:
         continue
-      
-      if res.loop_should_break:
+      except LoopBreak:
         break
 
-      elements.append(value)
+      if collect: elements.append(value)
 
-    return res.success(
-      Number.null if node.should_return_null else
-      List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
+    return (
+      List(elements).set_context(context).set_pos(node.pos_start, node.pos_end) if collect else
+      Number.null
     )
 
-  def visit_WhileNode(self, node, context):
-    res = RTResult()
+  def counted_for(self, node, context, counts):
+    # A FOR over integer bounds. The bound is range's to check, and a loop
+    # whose body never reads its variable updates one Number in place.
+    depth, slot, in_place = node.resolved
+    if depth == GLOBAL_DEPTH:
+      variables, slot = global_symbol_table.symbols, node.var_name_tok.value
+    else:
+      variables = context.symbol_table.slots
+
+    # A block's value is NULL, so its statements run without building one,
+    # and those that are only a literal need not run at all
+    body_node = node.body_node
+    collect = not node.should_return_null
+    if not collect and isinstance(body_node, ListNode):
+      statements = [
+        statement for statement in body_node.element_nodes
+        if not isinstance(statement, (NumberNode, StringNode))
+      ]
+    else:
+      statements = (body_node,)
     elements = []
+    visit = self.visit
+    counter = Number(0)
 
-    while True:
-      condition = res.register(self.visit(node.condition_node, context))
-      if res.should_return(): return res
+    for i in counts:
+      if in_place:
+        counter.value = i
+        variables[slot] = counter
+      else:
+        variables[slot] = Number(i)
 
-      if not condition.is_true():
+      try:
+        for statement in statements:
+          value = visit(statement, context)
+      except LoopContinue:
+        continue
+      except LoopBreak:
         break
 
-      value = res.register(self.visit(node.body_node, context))
-      if res.should_return() and res.loop_should_continue == False and res.loop_should_break == False: return res
+      if collect: elements.append(value)
+
+    return (
+      List(elements).set_context(context).set_pos(node.pos_start, node.pos_end) if collect else
+      Number.null
+    )
+
+  def visit_WhileNode(self, node, context):
+    collect = not node.should_return_null
+    elements = []
 
-      if res.loop_should_continue:
+    condition_node = node.condition_node
+    unboxed = condition_node.resolved is UNBOXED
+
+    while True:
+      if unboxed:
+        if self.number(condition_node, context) == 0: break
+      elif not self.visit(condition_node, context).is_true():
+        break
+
+      try:
+        value = self.visit(node.body_node, context)
+      except LoopContinue:
         continue
-      
-      if res.loop_should_break:
+      except LoopBreak:
         break
 
-      elements.append(value)
+      if collect: elements.append(value)
 
-    return res.success(
-      Number.null if node.should_return_null else
-      List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
+    return (
+      List(elements).set_context(context).set_pos(node.pos_start, node.pos_end) if collect else
+      Number.null
     )
 
   def visit_FuncDefNode(self, node, context):
-    res = RTResult()
-
     func_name = node.var_name_tok.value if node.var_name_tok else None
     body_node = node.body_node
     arg_names = [arg_name.value for arg_name in node.arg_name_toks]
     func_value = Function(func_name, body_node, arg_names, node.should_auto_return).set_context(context).set_pos(node.pos_start, node.pos_end)
-    
+    func_value.layout = node.resolved
+
     if node.var_name_tok:
       context.symbol_table.set(func_name, func_value)
 
-    return res.success(func_value)
+    return func_value
 
   def visit_CallNode(self, node, context):
-    res = RTResult()
-    args = []
+    value_to_call = self.visit(node.node_to_call, context)
+    args = [self.visit(arg_node, context) for arg_node in node.arg_nodes]
+
+    if type(value_to_call) is Function:
+      if node.resolved and len(args) == len(value_to_call.arg_names):
+        raise TailCall(value_to_call, args)
+      return value_to_call.call(args, context, node.pos_start, node.pos_end)
+
+    # Built-ins report their errors at their own position, and those in
+    # formatting a string at the string's
+    args = [
+      place(arg, arg_node, context) if type(arg) is String else arg
+      for arg, arg_node in zip(args, node.arg_nodes)
+    ]
+    return unwrap(place(value_to_call, node, context).execute(args))
 
-    value_to_call = res.register(self.visit(node.node_to_call, context))
-    if res.should_return(): return res
-    value_to_call = value_to_call.copy().set_pos(node.pos_start, node.pos_end)
+  def visit_ReturnNode(self, node, context):
+    if node.node_to_return:
+      value = self.visit(node.node_to_return, context)
+    else:
+      value = Number.null
+
+    raise FunctionReturn(value)
+
+  def visit_ContinueNode(self, node, context):
+    raise LoopContinue()
+
+  def visit_BreakNode(self, node, context):
+    raise LoopBreak()
+
+  def visit_InvariantNode(self, node, context):
+    symbol_table = context.symbol_table
+    bindings = [symbol_table.get(var_name) for var_name in node.var_names]
+
+    # The cached value stands while every variable still holds the same
+    # value and, if a list was involved, no list has changed since
+    if context.invariants is None: context.invariants = {}
+    cached = context.invariants.get(node)
+    if cached:
+      cached_bindings, mutations, value = cached
+      if (mutations is None or mutations == List.mutations) and all(
+        binding is cached_binding for binding, cached_binding in zip(bindings, cached_bindings)
+      ):
+        return value
+
+    mutations = List.mutations
+    value = self.visit(node.node, context)
+
+    # Nothing is cached if evaluating it changed a list or called a function
+    # that may have effects
+    if List.mutations == mutations and all(
+      isinstance(binding, BuiltInFunction) and binding.name in PURE_BUILTINS
+      for var_name, binding in zip(node.var_names, bindings) if var_name in node.callee_names
+    ):
+      if not isinstance(value, List) and not any(isinstance(binding, List) for binding in bindings):
+        mutations = None
+      context.invariants[node] = (bindings, mutations, value)
+
+    return value
+
+#############
+# OPTIMIZER #
+#############
+
+# Folded values bigger than this many bits or characters are left for the
+# program to compute, so optimizing never costs more than running would
+FOLD_LIMIT = 4096
+
+class Optimizer:
+  # Folds operations on literals into literals and drops IF cases whose
+  # conditions are literals. Folding runs the interpreter on the literal
+  # operands, so a folded node has the exact value the program would have
+  # computed, and keeps the source range of the node it replaces. Anything
+  # that fails at run time is left in place to fail there.
+  def __init__(self):
+    self.interpreter = Interpreter()
+    self.context = Context('<optimizer>')
+
+  def visit(self, node):
+    method_name = f'visit_{type(node).__name__}'
+    method = getattr(self, method_name, self.no_visit_method)
+    return method(node)
+
+  def no_visit_method(self, node):
+    raise Exception(f'No visit_{type(node).__name__} method defined')
+
+  def unchanged(self, old, new):
+    if isinstance(new, (list, tuple)):
+      return len(old) == len(new) and all(old_item is new_item for old_item, new_item in zip(old, new))
+    return old is new
+
+  def updated(self, original, **fields):
+    # Nodes are shared with the parsed tree, so changed ones are copied
+    if all(self.unchanged(getattr(original, name), value) for name, value in fields.items()): return original
+    node_class = type(original)
+    return restore_node(
+      node_class, tuple([fields.get(name, getattr(original, name)) for name in node_class.__slots__]),
+      original.start, original.end, original.src
+    )
+
+  def is_literal(self, node):
+    return isinstance(node, (NumberNode, StringNode))
+
+  def literal_value(self, node):
+    return node.tok.value
+
+  def too_costly(self, node):
+    if not isinstance(node, BinOpNode): return False
+    left = self.literal_value(node.left_node)
+    right = self.literal_value(node.right_node)
+
+    if node.op_tok.type == LU_POW and isinstance(left, (int, float)) and isinstance(right, (int, float)):
+      return abs(left) > 1 and right > 0 and right * math.log2(abs(left)) > FOLD_LIMIT
+    if node.op_tok.type == LU_MUL and isinstance(left, str) and isinstance(right, int):
+      return len(left) * right > FOLD_LIMIT
+    return False
+
+  def fold(self, node):
+    if self.too_costly(node): return node
+
+    try:
+      value = self.interpreter.visit(node, self.context).value
+    except (RuntimeFailure, ArithmeticError, TypeError, ValueError):
+      return node
+
+    if isinstance(value, str) and len(value) > FOLD_LIMIT: return node
+    if isinstance(value, int) and value.bit_length() > FOLD_LIMIT: return node
+    return self.literal(value, node.start, node.end, node.src) or node
+
+  def literal(self, value, start, end, src):
+    if isinstance(value, str):
+      return StringNode(Token(LU_STRING, value, start, end, src))
+    if isinstance(value, int):
+      return NumberNode(Token(LU_INT, value, start, end, src))
+    if isinstance(value, float):
+      return NumberNode(Token(LU_FLOAT, value, start, end, src))
+    return None
+
+  def is_true(self, node):
+    return self.interpreter.visit(node, self.context).is_true()
+
+  def visit_NumberNode(self, node):
+    return node
+
+  def visit_StringNode(self, node):
+    return node
+
+  def visit_ListNode(self, node):
+    return self.updated(node, element_nodes=[self.visit(element_node) for element_node in node.element_nodes])
+
+  def visit_VarAccessNode(self, node):
+    return node
+
+  def visit_VarAssignNode(self, node):
+    return self.updated(node, value_node=self.visit(node.value_node))
+
+  def visit_BinOpNode(self, node):
+    node = self.updated(node, left_node=self.visit(node.left_node), right_node=self.visit(node.right_node))
+    if self.is_literal(node.left_node) and self.is_literal(node.right_node):
+      return self.fold(node)
+    return node
+
+  def visit_UnaryOpNode(self, node):
+    node = self.updated(node, node=self.visit(node.node))
+    if self.is_literal(node.node):
+      return self.fold(node)
+    return node
+
+  def visit_IfNode(self, node):
+    cases = []
+    else_case = None
+
+    for condition, expr, should_return_null in node.cases:
+      condition = self.visit(condition)
+      if self.is_literal(condition):
+        if not self.is_true(condition): continue
+
+        # Later cases can never run, so this one is what runs otherwise
+        else_case = (self.visit(expr), should_return_null)
+        break
+      cases.append((condition, self.visit(expr), should_return_null))
+    else:
+      if node.else_case:
+        else_case = (self.visit(node.else_case[0]), node.else_case[1])
+
+    if not cases:
+      # A branch's value is the IF's value unless the IF evaluates to NULL,
+      # which a literal condition still gets from the interpreter
+      if else_case and not else_case[1]: return else_case[0]
+      if else_case:
+        cases.append((self.literal(1, node.start, node.start, node.src), else_case[0], True))
+      else:
+        cases.append((self.literal(0, node.start, node.start, node.src), self.literal(0, node.start, node.start, node.src), False))
+      else_case = None
+
+    if else_case == node.else_case and len(cases) == len(node.cases) and all(
+      self.unchanged(old_case, new_case) for old_case, new_case in zip(node.cases, cases)
+    ):
+      return node
+
+    # The IF keeps the source range it was parsed with
+    optimized = IfNode(cases, else_case)
+    optimized.start, optimized.end = node.start, node.end
+    return optimized
+
+  def visit_ForNode(self, node):
+    node = self.updated(
+      node,
+      start_value_node=self.visit(node.start_value_node),
+      end_value_node=self.visit(node.end_value_node),
+      step_value_node=self.visit(node.step_value_node) if node.step_value_node else None,
+      body_node=self.visit(node.body_node)
+    )
+
+    assigned = assigned_names(node.body_node)
+    assigned.add(node.var_name_tok.value)
+    return self.updated(node, body_node=self.hoisted(node.body_node, assigned))
+
+  def visit_WhileNode(self, node):
+    node = self.updated(node, condition_node=self.visit(node.condition_node), body_node=self.visit(node.body_node))
+
+    assigned = assigned_names(node.condition_node) | assigned_names(node.body_node)
+    return self.updated(
+      node,
+      condition_node=self.hoisted(node.condition_node, assigned),
+      body_node=self.hoisted(node.body_node, assigned)
+    )
+
+  def visit_FuncDefNode(self, node):
+    return self.updated(node, body_node=self.visit(node.body_node))
+
+  def visit_CallNode(self, node):
+    return self.updated(
+      node,
+      node_to_call=self.visit(node.node_to_call),
+      arg_nodes=[self.visit(arg_node) for arg_node in node.arg_nodes]
+    )
+
+  def visit_ReturnNode(self, node):
+    return self.updated(node, node_to_return=self.visit(node.node_to_return) if node.node_to_return else None)
+
+  def visit_ContinueNode(self, node):
+    return node
+
+  def visit_BreakNode(self, node):
+    return node
+
+  ###################################
+
+  # Loop invariant expressions are wrapped in InvariantNodes, which the
+  # interpreter evaluates on the first pass of the loop and reuses for as
+  # long as what they read stays the same. Function bodies run in their
+  # own context, so loops in them are optimized on their own.
+
+  def is_invariant(self, node, assigned):
+    if isinstance(node, (NumberNode, StringNode, InvariantNode)):
+      return True
+    if isinstance(node, VarAccessNode):
+      return node.var_name_tok.value not in assigned
+    if isinstance(node, BinOpNode):
+      return self.is_invariant(node.left_node, assigned) and self.is_invariant(node.right_node, assigned)
+    if isinstance(node, UnaryOpNode):
+      return self.is_invariant(node.node, assigned)
+    if isinstance(node, CallNode):
+      if not isinstance(node.node_to_call, VarAccessNode): return False
+      # Only calls to built-ins declared pure, which the interpreter checks
+      # again before reusing a value
+      callee = global_symbol_table.get(node.node_to_call.var_name_tok.value)
+      return (
+        isinstance(callee, BuiltInFunction) and callee.name in PURE_BUILTINS and
+        self.is_invariant(node.node_to_call, assigned) and
+        all(self.is_invariant(arg_node, assigned) for arg_node in node.arg_nodes)
+      )
+    return False
+
+  def hoisted(self, node, assigned):
+    if isinstance(node, (InvariantNode, FuncDefNode)):
+      return node
+
+    if self.is_invariant(node, assigned):
+      # Literals and variables are as cheap to evaluate as a cached value
+      if isinstance(node, (NumberNode, StringNode, VarAccessNode)): return node
+
+      var_names = {}
+      callee_names = set()
+      stack = [node]
+      while stack:
+        item = stack.pop()
+        if isinstance(item, VarAccessNode):
+          var_names[item.var_name_tok.value] = True
+        elif isinstance(item, CallNode):
+          callee_names.add(item.node_to_call.var_name_tok.value)
+        stack.extend(child_nodes(item))
+
+      return InvariantNode(node, tuple(var_names), callee_names)
+
+    return self.updated(node, **{
+      name: self.hoisted_field(getattr(node, name), assigned) for name in type(node).__slots__
+    })
+
+  def hoisted_field(self, value, assigned):
+    if isinstance(value, Node):
+      return self.hoisted(value, assigned)
+    if isinstance(value, list):
+      return [self.hoisted_field(item, assigned) for item in value]
+    if isinstance(value, tuple):
+      items = tuple([self.hoisted_field(item, assigned) for item in value])
+      return value if self.unchanged(value, items) else items
+    return value
+
+############
+# RESOLVER #
+############
+
+# An address is a (depth, slot) pair. Depth 0 is the frame of the running
+# call, and the slot an index into its FrameTable. The program's variables
+# are shared with every engine and with scripts started by RUN, so they stay
+# in the global symbol table by name, at GLOBAL_DEPTH.
+GLOBAL_DEPTH = -1
+GLOBAL_ADDRESS = (GLOBAL_DEPTH, None)
+
+class FrameLayout(dict):
+  # A resolved FUNC's frame layout, from the names its calls bind to their
+  # slots. It also keeps the reads in the body given a global address, by
+  # name, so that a program resolved later which binds the name in a frame
+  # can take them back.
+  def __init__(self):
+    super().__init__()
+    self.global_reads = {}
+
+  # One layout is never another, however alike, as a member of a WeakSet
+  __hash__ = object.__hash__
+  __eq__ = object.__eq__
+  __ne__ = object.__ne__
+
+# How many layouts still alive bind each name in their frame. Scoping is
+# dynamic, so a function sees its callers' variables, and only a name no
+# frame can hold is read straight from the global symbol table.
+FRAME_NAMES = {}
+
+# Every layout still alive, which goes with its FUNC and the functions made
+# from it
+FRAME_LAYOUTS = weakref.WeakSet()
+
+def release_frame_names(names):
+  for name in names:
+    FRAME_NAMES[name] -= 1
+    if not FRAME_NAMES[name]: del FRAME_NAMES[name]
+
+class Resolver:
+  # Gives every variable node an address ahead of time, and every FUNC the
+  # layout of the frames its calls run in: its arguments, then the other
+  # names its body binds. A name a function does not bind and some frame may
+  # hold is left unresolved and looked up by name, through the callers.
+  # How many times a program has bound a name no frame could hold before,
+  # for code compiled with the addresses that takes back
+  frame_names_added = 0
+
+  def resolve(self, node):
+    layouts = []
+    stack = [node]
+    while stack:
+      item = stack.pop()
+      if isinstance(item, FuncDefNode):
+        item.resolved = self.layout(item)
+        layouts.append(item.resolved)
+      stack.extend(child_nodes(item))
+
+    new_names = {name for layout in layouts for name in layout if name not in FRAME_NAMES}
+    if new_names:
+      Resolver.frame_names_added += 1
+      for layout in FRAME_LAYOUTS:
+        for name in new_names:
+          for read in layout.global_reads.pop(name, ()):
+            read.resolved = None
+
+    for layout in layouts:
+      for name in layout:
+        FRAME_NAMES[name] = FRAME_NAMES.get(name, 0) + 1
+      weakref.finalize(layout, release_frame_names, tuple(layout)).atexit = False
+      FRAME_LAYOUTS.add(layout)
+
+    stack = [(node, None)]
+    while stack:
+      item, layout = stack.pop()
+      if isinstance(item, (VarAccessNode, VarAssignNode, ForNode)):
+        item.resolved = self.address(item.var_name_tok.value, item, layout)
+      if isinstance(item, ForNode):
+        # Whether a counted loop may keep one Number for its variable
+        item.resolved += (not may_read(item.body_node, item.var_name_tok.value),)
+      if isinstance(item, BinOpNode):
+        # Proven numbers need no cache to find what to compute them with
+        if (
+          item.inferred is Number and item.op_tok.type in NUMBER_OPERATORS and
+          item.left_node.inferred is Number and item.right_node.inferred is Number
+        ):
+          item.resolved = UNBOXED
+        else:
+          item.resolved = InlineCache(item)
+          INLINE_CACHES.add(item.resolved)
+          self.mark_placed_cases((item.left_node, item.right_node))
+      if isinstance(item, UnaryOpNode):
+        self.mark_placed_cases((item.node,))
+      if isinstance(item, CallNode):
+        self.mark_placed_cases(item.arg_nodes)
+      if isinstance(item, FuncDefNode):
+        for call in tail_calls(item.body_node, item.should_auto_return):
+          call.resolved = True
+        stack.append((item.body_node, item.resolved))
+        continue
+      stack.extend((child, layout) for child in child_nodes(item))
+
+    return node
+
+  def mark_placed_cases(self, nodes):
+    # An IF whose value may end up in an error, as an operand or a string
+    # argument, places the value of its case at the case's node as reading
+    # it did before values were shared
+    stack = list(nodes)
+    while stack:
+      item = origin(stack.pop())
+      if isinstance(item, IfNode):
+        item.resolved = True
+        stack.extend(expr for condition, expr, should_return_null in item.cases if not should_return_null)
+        if item.else_case and not item.else_case[1]:
+          stack.append(item.else_case[0])
+
+  def layout(self, node):
+    slots = FrameLayout()
+    for arg_name_tok in node.arg_name_toks:
+      slots.setdefault(arg_name_tok.value, len(slots))
+    for name in sorted(assigned_names(node.body_node)):
+      slots.setdefault(name, len(slots))
+    return slots
+
+  def address(self, var_name, node, layout):
+    # The program's own variables are the global ones
+    if layout is None: return GLOBAL_ADDRESS
+
+    slot = layout.get(var_name)
+    if slot is not None: return (0, slot)
+    if var_name in FRAME_NAMES: return None
+
+    layout.global_reads.setdefault(var_name, []).append(node)
+    return GLOBAL_ADDRESS
+
+#########
+# TYPES #
+#########
+
+# A variable's type while no assignment to it has given it one yet
+PENDING = object()
+
+# What the resolver puts on a binary operation the tree engine computes on
+# raw numbers instead of through an inline cache
+UNBOXED = object()
+
+# Operators whose result is a Number when both operands are
+NUMBER_RESULTS = frozenset({
+  LU_PLUS, LU_MINUS, LU_MUL, LU_DIV, LU_POW, LU_EE, LU_NE, LU_LT, LU_GT, LU_LTE, LU_GTE, LU_AMPERSAND,
+})
+
+COMPARISONS = frozenset({LU_EE, LU_NE, LU_LT, LU_GT, LU_LTE, LU_GTE})
+
+def join_types(first, second):
+  if first is PENDING: return second
+  if second is PENDING: return first
+  return first if first is second else None
+
+def operation_type(op_tok, left, right):
+  # What a binary operation on values of these types evaluates to, when it
+  # does not fail
+  if left is PENDING or right is PENDING: return PENDING
+  logic = op_tok.matches(LU_KEYWORD, 'AND') or op_tok.matches(LU_KEYWORD, 'OR') or op_tok.type == LU_AMPERSAND
+
+  if left is Number and right is Number:
+    return Number if logic or op_tok.type in NUMBER_RESULTS else None
+  if left is String and right is String:
+    if op_tok.type == LU_PLUS: return String
+    return Number if op_tok.type in COMPARISONS else None
+  if left is String and right is Number:
+    if op_tok.type == LU_MUL: return String
+    return Number if logic else None
+  return None
+
+class TypeInference:
+  # Proves which nodes always evaluate to a Number or a String, one body at
+  # a time: the program, then every FUNC body in it. Scoping is dynamic, so
+  # only a body's own variables are typed, and a read of one only where the
+  # body has certainly set it by then; before that the read finds a caller's
+  # variable. A variable's type joins those of every assignment to it.
+  # Arguments may hold anything. Calls in the program may run a script with
+  # RUN, which sets the program's variables, so a call forgets what the
+  # program has set.
+  def infer(self, node, known=None):
+    annotations = []
+    bodies = [(node, (), True)]
+    while bodies:
+      body_node, arg_names, top_level = bodies.pop()
+      annotations.extend(self.body(body_node, arg_names, top_level, bodies, known if top_level else None))
+
+    for item, inferred in annotations:
+      item.inferred = inferred
+    return node
+
+  def body(self, node, arg_names, top_level, bodies, known):
+    # Known variables are set, to values of the given types, before the
+    # body runs
+    known = known or {}
+    self.variables = (assigned_names(node) - set(arg_names)) | known.keys()
+    self.top_level = top_level
+    self.bodies = bodies
+    self.nodes = []
+    self.definite = set()
+    self.assignments = []
+    self.assign(node, frozenset(known))
+
+    # Every type starts out pending and only ever widens, so this settles
+    self.types = dict.fromkeys(self.variables, PENDING)
+    self.types.update(known)
+    changed = True
+    while changed:
+      changed = False
+      self.known = {}
+      for var_name, item in self.assignments:
+        var_type = join_types(self.types[var_name], self.assignment_type(item))
+        if var_type is not self.types[var_name]:
+          self.types[var_name] = var_type
+          changed = True
+
+    for var_name, var_type in self.types.items():
+      if var_type is PENDING: self.types[var_name] = None
+
+    self.known = {}
+    annotations = []
+    for item in self.nodes:
+      inferred = self.type_of(item)
+      annotations.append((item, None if inferred is PENDING else inferred))
+    return annotations
+
+  def bind(self, node, assigned):
+    var_name = node.var_name_tok.value
+    if var_name not in self.variables: return assigned
+    self.assignments.append((var_name, node))
+    return assigned | {var_name}
+
+  def assign(self, node, assigned):
+    # Walks the node in the order it runs, noting the reads of variables
+    # set on every path to them, and returns the variables set after it
+    self.nodes.append(node)
+
+    if isinstance(node, VarAccessNode):
+      if node.var_name_tok.value in assigned: self.definite.add(id(node))
+      return assigned
+
+    if isinstance(node, VarAssignNode):
+      return self.bind(node, self.assign(node.value_node, assigned))
+
+    if isinstance(node, IfNode):
+      outcomes = []
+      for condition, expr, should_return_null in node.cases:
+        assigned = self.assign(condition, assigned)
+        outcomes.append(self.assign(expr, assigned))
+      outcomes.append(self.assign(node.else_case[0], assigned) if node.else_case else assigned)
+      return frozenset.intersection(*outcomes)
+
+    # A loop body may not run at all. In the program, a call in a loop may
+    # forget what was set before it on the next time round as well, so the
+    # loop is walked as if the call had already been made.
+    if isinstance(node, ForNode):
+      assigned = self.assign(node.start_value_node, assigned)
+      assigned = self.assign(node.end_value_node, assigned)
+      if node.step_value_node: assigned = self.assign(node.step_value_node, assigned)
+      if self.top_level and may_call(node.body_node):
+        self.assign(node.body_node, self.bind(node, frozenset()))
+        return frozenset()
+      self.assign(node.body_node, self.bind(node, assigned))
+      return assigned
+
+    if isinstance(node, WhileNode):
+      if self.top_level and may_call(node): assigned = frozenset()
+      assigned = self.assign(node.condition_node, assigned)
+      self.assign(node.body_node, assigned)
+      return assigned
+
+    if isinstance(node, FuncDefNode):
+      self.bodies.append((node.body_node, [arg_name_tok.value for arg_name_tok in node.arg_name_toks], False))
+      return self.bind(node, assigned) if node.var_name_tok else assigned
+
+    for child in child_nodes(node):
+      assigned = self.assign(child, assigned)
+    if isinstance(node, CallNode) and self.top_level:
+      return frozenset()
+    return assigned
+
+  def assignment_type(self, node):
+    if isinstance(node, VarAssignNode):
+      return self.type_of(node.value_node)
+    if isinstance(node, ForNode):
+      # The variable counts from the start value by the step
+      start = self.type_of(node.start_value_node)
+      step = self.type_of(node.step_value_node) if node.step_value_node else Number
+      if start is PENDING or step is PENDING: return PENDING
+      return Number if start is Number and step is Number else None
+    return None
+
+  def type_of(self, node):
+    # Each pass over the assignments works out a node's type once
+    known = self.known.get(id(node), PENDING)
+    if known is PENDING:
+      known = self.known[id(node)] = self.node_type(node)
+    return known
+
+  def node_type(self, node):
+    if isinstance(node, NumberNode):
+      return Number
+    if isinstance(node, StringNode):
+      return String
+    if isinstance(node, VarAccessNode):
+      if id(node) not in self.definite: return None
+      return self.types[node.var_name_tok.value]
+    if isinstance(node, VarAssignNode):
+      return self.type_of(node.value_node)
+    if isinstance(node, BinOpNode):
+      return operation_type(node.op_tok, self.type_of(node.left_node), self.type_of(node.right_node))
+    if isinstance(node, UnaryOpNode):
+      operand = self.type_of(node.node)
+      if node.op_tok.matches(LU_KEYWORD, 'NOT'):
+        return operand if operand is Number or operand is PENDING else None
+      return operand
+    if isinstance(node, IfNode):
+      result = PENDING
+      for condition, expr, should_return_null in node.cases:
+        result = join_types(result, None if should_return_null else self.type_of(expr))
+      if node.else_case:
+        expr, should_return_null = node.else_case
+        return join_types(result, None if should_return_null else self.type_of(expr))
+      return None
+    return None
+
+def infer_types(node, known=None):
+  # Fills in inferred on every node of a program, and returns it. Known maps
+  # variables the program starts with to their types. A program nested too
+  # deeply to walk is left with no types proven.
+  try:
+    return TypeInference().infer(node, known)
+  except RecursionError:
+    stack = [node]
+    while stack:
+      item = stack.pop()
+      item.inferred = None
+      stack.extend(child_nodes(item))
+    return node
+
+def inferred_types(node):
+  # One entry per node of an inferred program with a proven type, in source
+  # order, for tools to show
+  entries = []
+  stack = [node]
+  while stack:
+    item = stack.pop()
+    stack.extend(child_nodes(item))
+    if item.inferred is None: continue
+
+    pos = item.pos_start
+    ln, col = pos.line_col()
+    var_name_tok = getattr(item, 'var_name_tok', None)
+    entries.append((item.start, {
+      'file': pos.fn,
+      'line': ln + 1,
+      'column': col + 1,
+      'node': type(item).__name__,
+      'name': var_name_tok.value if var_name_tok else None,
+      'type': item.inferred.__name__,
+    }))
+
+  entries.sort(key=lambda entry: entry[0])
+  return [entry for start, entry in entries]
+
+######
+# VM #
+######
+
+# Each instruction is a tuple whose first item is one of these. Variables
+# the resolver gave an address are read and set at it, and values are
+# handed on as they are, like the tree engine does. Operations it proved to
+# be on numbers run on Python numbers pushed raw, between an OP_RAW_* that
+# pushes one and the OP_BOX or OP_STORE_* that makes a Number of the result,
+# and an operand that is a number literal is kept in the instruction that
+# uses it. The opcodes are in four groups the VM looks through apart: the
+# value and the control instructions loops and calls run most, then the
+# rest of each.
+OP_LOAD_SLOT           = 0
+OP_LOAD_GLOBAL         = 1
+OP_RAW_GLOBAL_ARITH    = 2
+OP_RAW_GLOBAL          = 3
+OP_RAW_SLOT_ARITH      = 4
+OP_RAW_SLOT            = 5
+OP_RAW_ARITH_NUMBER    = 6
+OP_RAW_ARITH           = 7
+OP_STORE_NUMBER_GLOBAL = 8
+OP_STORE_ARITH_GLOBAL  = 9
+OP_ARITH_NUMBER        = 10
+OP_ARITH               = 11
+OP_STORE_NUMBER_SLOT   = 12
+OP_STORE_ARITH_SLOT    = 13
+OP_FOR_ITER            = 14
+OP_RAW_JUMP_UNLESS     = 15
+OP_JUMP_UNLESS         = 16
+OP_CALL                = 17
+OP_RETURN              = 18
+OP_JUMP                = 19
+OP_APPEND              = 20
+OP_JUMP_FALSE          = 21
+OP_JUMP_ZERO           = 22
+OP_STORE_SLOT          = 23
+OP_STORE_GLOBAL        = 24
+OP_POP                 = 25
+OP_DUP                 = 26
+OP_NUMBER              = 27
+OP_RAW_NUMBER          = 28
+OP_BOX                 = 29
+OP_UNBOX               = 30
+OP_LOAD                = 31
+OP_STORE_POP           = 32
+OP_STRING              = 33
+OP_NULL                = 34
+OP_BINOP               = 35
+OP_MINUS               = 36
+OP_NOT                 = 37
+OP_LIST                = 38
+OP_PLACE               = 39
+OP_FOR_PREP            = 40
+OP_WHILE_PREP          = 41
+OP_LOOP_END            = 42
+OP_FUNC                = 43
+OP_CONTINUE            = 44
+OP_BREAK               = 45
+OP_INVARIANT           = 46
+OP_CACHE               = 47
+OP_END                 = 48
+
+# How a run of instructions ended
+VM_END      = 0
+VM_RETURN   = 1
+VM_CONTINUE = 2
+VM_BREAK    = 3
+VM_ERROR    = 4
+VM_TAIL     = 5
+
+BINOP_METHODS = {
+  LU_PLUS: 'added_to',
+  LU_MINUS: 'subbed_by',
+  LU_MUL: 'multed_by',
+  LU_DIV: 'dived_by',
+  LU_POW: 'powed_by',
+  LU_EE: 'get_comparison_eq',
+  LU_NE: 'get_comparison_ne',
+  LU_LT: 'get_comparison_lt',
+  LU_GT: 'get_comparison_gt',
+  LU_LTE: 'get_comparison_lte',
+  LU_GTE: 'get_comparison_gte',
+  LU_AMPERSAND: 'anded_by',
+}
+
+# Operators two numbers can never fail on, computed without a method call.
+# Jumps only test a comparison, and use NUMBER_OPERATORS' instead.
+ARITH_OPERATORS = {
+  LU_PLUS: operator.add,
+  LU_MINUS: operator.sub,
+  LU_MUL: operator.mul,
+  LU_EE: lambda left, right: int(left == right),
+  LU_NE: lambda left, right: int(left != right),
+  LU_LT: lambda left, right: int(left < right),
+  LU_GT: lambda left, right: int(left > right),
+  LU_LTE: lambda left, right: int(left <= right),
+  LU_GTE: lambda left, right: int(left >= right),
+}
+
+class Loop:
+  # Where CONTINUE and BREAK inside a loop body jump to, and how many
+  # values are on the stack under the body
+  __slots__ = ('continue_target', 'break_target', 'depth')
+
+  def __init__(self, continue_target, depth):
+    self.continue_target = continue_target
+    self.break_target = None
+    self.depth = depth
+
+class Compiler:
+  # Turns a program or a function body into a list of instructions for the
+  # VM. The compiler tracks how many values each instruction leaves on the
+  # stack, so a jump out of a loop body knows what to drop. Nodes whose
+  # value is never used are compiled without pushing it.
+  def __init__(self):
+    self.code = []
+    self.depth = 0
+    self.loops = []
+    # [name, whether nothing has read it as a value] for each FOR the node
+    # being compiled is in
+    self.counters = []
+
+  def compile_body(self, node, keep):
+    self.compile(node, keep)
+    self.emit((OP_END,))
+    return self.code
+
+  def emit(self, instruction, effect=0):
+    self.code.append(instruction)
+    self.depth += effect
+    return len(self.code) - 1
+
+  def patch(self, index, target):
+    self.code[index] = self.code[index][:-1] + (target,)
+
+  def compile(self, node, keep):
+    method_name = f'compile_{type(node).__name__}'
+    method = getattr(self, method_name, self.no_compile_method)
+    method(node, keep)
+
+  def no_compile_method(self, node, keep):
+    raise Exception(f'No compile_{type(node).__name__} method defined')
+
+  def compile_NumberNode(self, node, keep):
+    if keep: self.emit((OP_NUMBER, node.tok.value, node.pos_start, node.pos_end), 1)
+
+  def compile_StringNode(self, node, keep):
+    if keep: self.emit((OP_STRING, node.tok.value, node.pos_start, node.pos_end), 1)
+
+  def compile_ListNode(self, node, keep):
+    for element_node in node.element_nodes:
+      self.compile(element_node, keep)
+    if keep: self.emit((OP_LIST, len(node.element_nodes), node.pos_start, node.pos_end), 1 - len(node.element_nodes))
+
+  def compile_VarAccessNode(self, node, keep):
+    # Still looked up when unused, for the error if it is not defined
+    address = node.resolved
+    var_name = node.var_name_tok.value
+    if address is None:
+      self.emit((OP_LOAD, var_name, node.pos_start, node.pos_end), 1)
+    elif address[0] == GLOBAL_DEPTH:
+      self.emit((OP_LOAD_GLOBAL, var_name, node.pos_start, node.pos_end), 1)
+    else:
+      self.emit((OP_LOAD_SLOT, var_name, node.pos_start, node.pos_end, address[1]), 1)
+    if not keep: self.emit((OP_POP,), -1)
+    self.read_values((var_name,))
+
+  def read_values(self, var_names):
+    for counter in self.counters:
+      if counter[0] in var_names: counter[1] = False
+
+  def compile_VarAssignNode(self, node, keep):
+    address = node.resolved
+    value_node = node.value_node
+
+    # A proven number is boxed as it is stored, and computed as it is if the
+    # last step is an operation on two values
+    if address is not None and value_node.resolved is UNBOXED:
+      if type(value_node.right_node) is not NumberNode:
+        self.compile_number(value_node.left_node)
+        self.compile_number(value_node.right_node)
+        compute = ARITH_OPERATORS[value_node.op_tok.type]
+        if address[0] == GLOBAL_DEPTH:
+          self.emit((OP_STORE_ARITH_GLOBAL, node.var_name_tok.value, value_node.pos_start, value_node.pos_end, keep, compute), keep - 2)
+        else:
+          self.emit((OP_STORE_ARITH_SLOT, address[1], value_node.pos_start, value_node.pos_end, keep, compute), keep - 2)
+        return
+
+      self.compile_number(value_node)
+      if address[0] == GLOBAL_DEPTH:
+        self.emit((OP_STORE_NUMBER_GLOBAL, node.var_name_tok.value, value_node.pos_start, value_node.pos_end, keep), keep - 1)
+      else:
+        self.emit((OP_STORE_NUMBER_SLOT, address[1], value_node.pos_start, value_node.pos_end, keep), keep - 1)
+      return
+
+    self.compile(value_node, True)
+    if keep: self.emit((OP_DUP,), 1)
+
+    if address is None:
+      self.emit((OP_STORE_POP, node.var_name_tok.value), -1)
+    elif address[0] == GLOBAL_DEPTH:
+      self.emit((OP_STORE_GLOBAL, node.var_name_tok.value), -1)
+    else:
+      self.emit((OP_STORE_SLOT, address[1]), -1)
+
+  def compile_number(self, node):
+    # Pushes the Python number a node proven to be a Number evaluates to, as
+    # Interpreter.number computes it
+    node_type = type(node)
+    if node_type is BinOpNode and node.resolved is UNBOXED:
+      compute = ARITH_OPERATORS[node.op_tok.type]
+      left_node = node.left_node
+      if type(node.right_node) is NumberNode and type(left_node) is VarAccessNode and left_node.resolved is not None:
+        # A variable and a literal, read and computed with in one step
+        var_name = left_node.var_name_tok.value
+        if left_node.resolved[0] == GLOBAL_DEPTH:
+          self.emit((OP_RAW_GLOBAL_ARITH, var_name, left_node.pos_start, left_node.pos_end, compute, node.right_node.tok.value), 1)
+        else:
+          self.emit((OP_RAW_SLOT_ARITH, var_name, left_node.pos_start, left_node.pos_end, left_node.resolved[1], compute, node.right_node.tok.value), 1)
+        return
+
+      self.compile_number(left_node)
+      if type(node.right_node) is NumberNode:
+        self.emit((OP_RAW_ARITH_NUMBER, compute, node.right_node.tok.value))
+      else:
+        self.compile_number(node.right_node)
+        self.emit((OP_RAW_ARITH, compute), -1)
+    elif node_type is NumberNode:
+      self.emit((OP_RAW_NUMBER, node.tok.value), 1)
+    elif node_type is VarAccessNode and node.resolved is not None:
+      var_name = node.var_name_tok.value
+      if node.resolved[0] == GLOBAL_DEPTH:
+        self.emit((OP_RAW_GLOBAL, var_name, node.pos_start, node.pos_end), 1)
+      else:
+        self.emit((OP_RAW_SLOT, var_name, node.pos_start, node.pos_end, node.resolved[1]), 1)
+    else:
+      self.compile(node, True)
+      self.emit((OP_UNBOX,))
+
+  def compile_jump_false(self, condition):
+    # A comparison with a number literal is made and tested in one step
+    literal = (
+      type(condition) is BinOpNode and condition.op_tok.type in ARITH_OPERATORS and
+      type(condition.right_node) is NumberNode
+    )
+    if condition.resolved is UNBOXED:
+      if literal:
+        self.compile_number(condition.left_node)
+        compute = NUMBER_OPERATORS[condition.op_tok.type][0]
+        return self.emit((OP_RAW_JUMP_UNLESS, compute, condition.right_node.tok.value, None), -1)
+      self.compile_number(condition)
+      return self.emit((OP_JUMP_ZERO, None), -1)
+
+    if literal:
+      self.compile(condition.left_node, True)
+      compute = NUMBER_OPERATORS[condition.op_tok.type][0]
+      method_name = BINOP_METHODS[condition.op_tok.type]
+      return self.emit((OP_JUMP_UNLESS, compute, method_name, condition, condition.right_node.tok.value, None), -1)
+    self.compile(condition, True)
+    return self.emit((OP_JUMP_FALSE, None), -1)
+
+  def compile_BinOpNode(self, node, keep):
+    if node.resolved is UNBOXED:
+      self.compile_number(node)
+      if keep:
+        self.emit((OP_BOX, node.pos_start, node.pos_end))
+      else:
+        self.emit((OP_POP,), -1)
+      return
+
+    op_tok = node.op_tok
+    if op_tok.matches(LU_KEYWORD, 'AND'):
+      method_name = 'anded_by'
+    elif op_tok.matches(LU_KEYWORD, 'OR'):
+      method_name = 'ored_by'
+    else:
+      method_name = BINOP_METHODS.get(op_tok.type)
+
+    self.compile(node.left_node, True)
+    if op_tok.type in ARITH_OPERATORS and type(node.right_node) is NumberNode:
+      compute = ARITH_OPERATORS[op_tok.type]
+      self.emit((OP_ARITH_NUMBER, compute, method_name, node, node.right_node.tok.value, node.pos_start, node.pos_end))
+    else:
+      self.compile(node.right_node, True)
+      if op_tok.type in ARITH_OPERATORS:
+        self.emit((OP_ARITH, ARITH_OPERATORS[op_tok.type], method_name, node, node.pos_start, node.pos_end), -1)
+      else:
+        self.emit((OP_BINOP, method_name, f'Unknown operator: {op_tok}', node), -1)
+    if not keep: self.emit((OP_POP,), -1)
+
+  def compile_UnaryOpNode(self, node, keep):
+    self.compile(node.node, True)
+    if node.op_tok.type == LU_MINUS:
+      self.emit((OP_MINUS, node))
+    elif node.op_tok.matches(LU_KEYWORD, 'NOT'):
+      self.emit((OP_NOT, node))
+    if not keep: self.emit((OP_POP,), -1)
+
+  def compile_branch(self, node, expr, should_return_null, keep):
+    if should_return_null:
+      self.compile(expr, False)
+      if keep: self.emit((OP_NULL,), 1)
+    else:
+      self.compile(expr, keep)
+      if keep and node.resolved: self.emit((OP_PLACE, expr))
+
+  def compile_IfNode(self, node, keep):
+    depth = self.depth
+    end_jumps = []
+
+    for condition, expr, should_return_null in node.cases:
+      next_jump = self.compile_jump_false(condition)
+      self.compile_branch(node, expr, should_return_null, keep)
+      end_jumps.append(self.emit((OP_JUMP, None)))
+      self.patch(next_jump, len(self.code))
+      self.depth = depth
 
+    if node.else_case:
+      expr, should_return_null = node.else_case
+      self.compile_branch(node, expr, should_return_null, keep)
+    elif keep:
+      self.emit((OP_NULL,), 1)
+
+    for end_jump in end_jumps:
+      self.patch(end_jump, len(self.code))
+
+  def compile_loop_body(self, node, collect):
+    loop = Loop(None, self.depth)
+    self.loops.append(loop)
+    self.compile(node.body_node, collect)
+    self.loops.pop()
+
+    if collect: self.emit((OP_APPEND,), -1)
+    return loop
+
+  def compile_ForNode(self, node, keep):
+    self.compile(node.start_value_node, True)
+    self.compile(node.end_value_node, True)
+    if node.step_value_node:
+      self.compile(node.step_value_node, True)
+    # Where the variable is set, as (depth, slot or name, whether one Number
+    # may be reused for it)
+    address = node.resolved
+    if address is None:
+      address = (None, node.var_name_tok.value, False)
+    elif address[0] == GLOBAL_DEPTH:
+      address = (GLOBAL_DEPTH, node.var_name_tok.value, address[2])
+    prep = self.emit((OP_FOR_PREP, node.step_value_node is not None, address), -2 if node.step_value_node else -1)
+
+    # The variable is counted below the body, which it jumps back to while
+    # there is another value, so each time round takes one jump
+    collect = keep and not node.should_return_null
+    entry_jump = self.emit((OP_JUMP, None))
+    body_start = len(self.code)
+    counter = [node.var_name_tok.value, not may_call(node.body_node)]
+    self.counters.append(counter)
+    loop = self.compile_loop_body(node, collect)
+    self.counters.pop()
+    # Nor does a body that only reads the variable as a raw number, and
+    # makes no call that could read it, need a new Number each time round
+    if counter[1] and not address[2]:
+      self.code[prep] = (OP_FOR_PREP, node.step_value_node is not None, address[:2] + (True,))
+    loop.continue_target = len(self.code)
+    self.patch(entry_jump, len(self.code))
+    self.emit((OP_FOR_ITER, body_start))
+    loop.break_target = len(self.code)
+    self.emit((OP_LOOP_END, keep, node.should_return_null, node.pos_start, node.pos_end), 0 if keep else -1)
+
+  def compile_WhileNode(self, node, keep):
+    self.emit((OP_WHILE_PREP,), 1)
+
+    collect = keep and not node.should_return_null
+    loop_start = len(self.code)
+    exit_jump = self.compile_jump_false(node.condition_node)
+    loop = self.compile_loop_body(node, collect)
+    loop.continue_target = loop_start
+    self.emit((OP_JUMP, loop_start))
+    loop.break_target = len(self.code)
+    self.patch(exit_jump, len(self.code))
+    self.emit((OP_LOOP_END, keep, node.should_return_null, node.pos_start, node.pos_end), 0 if keep else -1)
+
+  def compile_FuncDefNode(self, node, keep):
+    func_name = node.var_name_tok.value if node.var_name_tok else None
+    arg_names = [arg_name.value for arg_name in node.arg_name_toks]
+    self.emit((OP_FUNC, func_name, node.body_node, arg_names, node.should_auto_return, node.pos_start, node.pos_end, node.resolved), 1)
+    if not keep: self.emit((OP_POP,), -1)
+
+  def compile_CallNode(self, node, keep):
+    self.compile(node.node_to_call, True)
     for arg_node in node.arg_nodes:
-      args.append(res.register(self.visit(arg_node, context)))
-      if res.should_return(): return res
+      self.compile(arg_node, True)
 
-    return_value = res.register(value_to_call.execute(args))
-    if res.should_return(): return res
-    return_value = return_value.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
-    return res.success(return_value)
+    loop = self.loops[len(self.loops) - 1] if self.loops else None
+    self.emit((OP_CALL, len(node.arg_nodes), loop, node, node.resolved is True, node.pos_start, node.pos_end), -len(node.arg_nodes))
+    if not keep: self.emit((OP_POP,), -1)
 
-  def visit_ReturnNode(self, node, context):
-    res = RTResult()
+  # Control never goes past RETURN, CONTINUE and BREAK, so the value they
+  # would leave on the stack is only counted
 
+  def compile_ReturnNode(self, node, keep):
+    depth = self.depth
     if node.node_to_return:
-      value = res.register(self.visit(node.node_to_return, context))
-      if res.should_return(): return res
+      self.compile(node.node_to_return, True)
     else:
-      value = Number.null
-    
-    return res.success_return(value)
+      self.emit((OP_NULL,), 1)
+    self.emit((OP_RETURN,))
+    self.depth = depth + keep
+
+  def compile_ContinueNode(self, node, keep):
+    self.emit((OP_CONTINUE, self.loops[len(self.loops) - 1] if self.loops else None))
+    self.depth += keep
+
+  def compile_BreakNode(self, node, keep):
+    self.emit((OP_BREAK, self.loops[len(self.loops) - 1] if self.loops else None))
+    self.depth += keep
+
+  def compile_InvariantNode(self, node, keep):
+    # The cached value is checked against the very values its variables hold
+    self.read_values(node.var_names)
+    skip_jump = self.emit((OP_INVARIANT, node, None), 1)
+    self.compile(node.node, True)
+    self.emit((OP_CACHE, node), -1)
+    self.patch(skip_jump, len(self.code))
+    if not keep: self.emit((OP_POP,), -1)
+
+def stepped_counts(i, end, step):
+  # The values of a FOR's variable when range cannot count them
+  if step >= 0:
+    while i < end:
+      yield i
+      i += step
+  else:
+    while i > end:
+      yield i
+      i += step
+
+def new_number(value, context, pos_start, pos_end):
+  # Number(value).set_context(context).set_pos(pos_start, pos_end), in one step
+  number = Number.__new__(Number)
+  number.value = value
+  number.context = context
+  number.pos_start = pos_start
+  number.pos_end = pos_end
+  return number
+
+def operation(method_name, left, right, node, context):
+  # A binary operation's method, worked out again on placed operands if it
+  # fails, as Interpreter.operate does
+  result, error = getattr(left, method_name)(right)
+  if error:
+    result, error = getattr(place(left, node.left_node, context), method_name)(place(right, node.right_node, context))
+  return result, error
+
+class VM:
+  # Runs compiled code with the same values, symbol tables and contexts as
+  # the Interpreter, so programs behave the same on both. Function bodies
+  # are compiled the first time they are called.
+  def __init__(self):
+    self.function_code = {}
+    self.frame_names_added = Resolver.frame_names_added
+
+  def run(self, node, context):
+    signal, value = self.execute(Compiler().compile_body(node, True), context)
+    if signal == VM_ERROR: return None, value
+    if signal == VM_END: return value, None
+    return None, None
+
+  def call(self, function, context, args, pos_start, pos_end):
+    # Function.call, returning how the body ended instead of raising it
+    if len(args) != len(function.arg_names):
+      function = function.copy().set_pos(pos_start, pos_end).set_context(context)
+      return VM_ERROR, function.check_args(function.arg_names, args).error
+
+    exec_ctx = function.generate_new_frame(context, pos_start)
+    function.populate_args(function.arg_names, args, exec_ctx)
+    signal, value = self.execute(self.body_code(function), exec_ctx)
+
+    # A call in tail position comes back as a TailCall to run here instead,
+    # in the frame generate_tail_frame gives it
+    while signal == VM_TAIL:
+      function = value.function
+      exec_ctx = function.generate_tail_frame(exec_ctx)
+      function.populate_args(function.arg_names, value.args, exec_ctx)
+      signal, value = self.execute(self.body_code(function), exec_ctx)
+
+    if signal == VM_END:
+      return VM_END, value if function.should_auto_return else Number.null
+    if signal == VM_RETURN:
+      return VM_END, value
+    return signal, value
+
+  def body_code(self, function):
+    # A program resolved since may have taken back global addresses the
+    # bodies were compiled with
+    if Resolver.frame_names_added != self.frame_names_added:
+      self.function_code.clear()
+      self.frame_names_added = Resolver.frame_names_added
+
+    code = self.function_code.get(function.body_node)
+    if code is None:
+      code = Compiler().compile_body(function.body_node, function.should_auto_return)
+      self.function_code[function.body_node] = code
+    return code
+
+  def call_builtin(self, function, args, node, context):
+    # BuiltInFunction.execute for the built-in placed at the call, without
+    # the RTResults around the method
+    function = place(function, node, context)
+    method = getattr(function, f'execute_{function.name}', function.no_visit_method)
+    arg_names = method.arg_names
+    if len(args) != len(arg_names):
+      return VM_ERROR, function.check_args(arg_names, args).error
+
+    exec_ctx = function.generate_new_context()
+    symbols = exec_ctx.symbol_table.symbols
+    for arg_name, arg_value, arg_node in zip(arg_names, args, node.arg_nodes):
+      symbols[arg_name] = place(arg_value, arg_node, context) if type(arg_value) is String else arg_value
+
+    res = method(exec_ctx)
+    if res.error: return VM_ERROR, res.error
+    return VM_END, res.value
+
+  def execute(self, code, context):
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    symbol_table = context.symbol_table
+    slots = symbol_table.slots if type(symbol_table) is FrameTable else None
+    global_symbols = global_symbol_table.symbols
+    # The hottest instructions make their Numbers as new_number does, without
+    # the call
+    new_Number = Number.__new__
+    pc = 0
 
-  def visit_ContinueNode(self, node, context):
-    return RTResult().success_continue()
+    while True:
+      instruction = code[pc]
+      op = instruction[0]
+      pc += 1
+
+      # Opcodes are tested one after another, so each group is looked
+      # through apart, the most common first
+      if op < OP_FOR_ITER:
+        if op < OP_RAW_ARITH:
+          if op == OP_LOAD_SLOT:
+            # A local the body has not set yet is still looked for in the caller
+            value = slots[instruction[4]]
+            if value is None:
+              value = symbol_table.parent.get(instruction[1])
+              if value is None:
+                return VM_ERROR, RTError(instruction[2], instruction[3], f"'{instruction[1]}' is not defined", context)
+            push(value)
+
+          elif op == OP_LOAD_GLOBAL:
+            value = global_symbols.get(instruction[1])
+            if value is None:
+              return VM_ERROR, RTError(instruction[2], instruction[3], f"'{instruction[1]}' is not defined", context)
+            push(value)
+
+          elif op == OP_RAW_GLOBAL_ARITH:
+            value = global_symbols.get(instruction[1])
+            if value is None:
+              return VM_ERROR, RTError(instruction[2], instruction[3], f"'{instruction[1]}' is not defined", context)
+            push(instruction[4](value.value, instruction[5]))
+
+          elif op == OP_RAW_GLOBAL:
+            value = global_symbols.get(instruction[1])
+            if value is None:
+              return VM_ERROR, RTError(instruction[2], instruction[3], f"'{instruction[1]}' is not defined", context)
+            push(value.value)
+
+          elif op == OP_RAW_SLOT_ARITH:
+            value = slots[instruction[4]]
+            if value is None:
+              value = symbol_table.parent.get(instruction[1])
+              if value is None:
+                return VM_ERROR, RTError(instruction[2], instruction[3], f"'{instruction[1]}' is not defined", context)
+            push(instruction[5](value.value, instruction[6]))
+
+          elif op == OP_RAW_SLOT:
+            value = slots[instruction[4]]
+            if value is None:
+              value = symbol_table.parent.get(instruction[1])
+              if value is None:
+                return VM_ERROR, RTError(instruction[2], instruction[3], f"'{instruction[1]}' is not defined", context)
+            push(value.value)
+
+          elif op == OP_RAW_ARITH_NUMBER:
+            stack[-1] = instruction[1](stack[-1], instruction[2])
 
-  def visit_BreakNode(self, node, context):
-    return RTResult().success_break()
+        else:
+          if op == OP_RAW_ARITH:
+            right = pop()
+            stack[-1] = instruction[1](stack[-1], right)
+
+          elif op == OP_STORE_NUMBER_GLOBAL:
+            number = new_Number(Number)
+            number.value = pop()
+            number.context = context
+            number.pos_start = instruction[2]
+            number.pos_end = instruction[3]
+            global_symbols[instruction[1]] = number
+            if instruction[4]: push(number)
+
+          elif op == OP_STORE_ARITH_GLOBAL:
+            right = pop()
+            number = new_Number(Number)
+            number.value = instruction[5](pop(), right)
+            number.context = context
+            number.pos_start = instruction[2]
+            number.pos_end = instruction[3]
+            global_symbols[instruction[1]] = number
+            if instruction[4]: push(number)
+
+          elif op == OP_ARITH_NUMBER:
+            left = stack[-1]
+            if type(left) is Number:
+              number = new_Number(Number)
+              number.value = instruction[1](left.value, instruction[4])
+              number.context = context
+              number.pos_start = instruction[5]
+              number.pos_end = instruction[6]
+              stack[-1] = number
+            else:
+              node = instruction[3].right_node
+              right = new_number(instruction[4], context, node.pos_start, node.pos_end)
+              result, error = operation(instruction[2], left, right, instruction[3], context)
+              if error: return VM_ERROR, error
+              stack[-1] = result
+
+          elif op == OP_ARITH:
+            right = pop()
+            left = stack[-1]
+            if type(left) is Number and type(right) is Number:
+              number = new_Number(Number)
+              number.value = instruction[1](left.value, right.value)
+              number.context = context
+              number.pos_start = instruction[4]
+              number.pos_end = instruction[5]
+              stack[-1] = number
+            else:
+              result, error = operation(instruction[2], left, right, instruction[3], context)
+              if error: return VM_ERROR, error
+              stack[-1] = result
+
+          elif op == OP_STORE_NUMBER_SLOT:
+            number = new_Number(Number)
+            number.value = pop()
+            number.context = context
+            number.pos_start = instruction[2]
+            number.pos_end = instruction[3]
+            slots[instruction[1]] = number
+            if instruction[4]: push(number)
+
+          elif op == OP_STORE_ARITH_SLOT:
+            right = pop()
+            number = new_Number(Number)
+            number.value = instruction[5](pop(), right)
+            number.context = context
+            number.pos_start = instruction[2]
+            number.pos_end = instruction[3]
+            slots[instruction[1]] = number
+            if instruction[4]: push(number)
+
+      elif op < OP_STORE_SLOT:
+        if op < OP_RETURN:
+          if op == OP_FOR_ITER:
+            # [counts, variables, key, one Number to reuse, results]. The
+            # next count, if there is one, is taken without a call to next.
+            state = stack[-1]
+            for i in state[0]:
+              counter = state[3]
+              if counter is None:
+                state[1][state[2]] = new_number(i, None, None, None)
+              else:
+                counter.value = i
+                state[1][state[2]] = counter
+              pc = instruction[1]
+              break
+
+          elif op == OP_RAW_JUMP_UNLESS:
+            if not instruction[1](pop(), instruction[2]):
+              pc = instruction[3]
+
+          elif op == OP_JUMP_UNLESS:
+            left = pop()
+            if type(left) is Number:
+              if not instruction[1](left.value, instruction[4]):
+                pc = instruction[5]
+            else:
+              node = instruction[3].right_node
+              right = new_number(instruction[4], context, node.pos_start, node.pos_end)
+              result, error = operation(instruction[2], left, right, instruction[3], context)
+              if error: return VM_ERROR, error
+              if not result.is_true():
+                pc = instruction[5]
+
+          elif op == OP_CALL:
+            argc = instruction[1]
+            args = stack[len(stack) - argc:]
+            del stack[len(stack) - argc:]
+            value_to_call = pop()
+
+            if type(value_to_call) is Function:
+              if instruction[4] and argc == len(value_to_call.arg_names):
+                return VM_TAIL, TailCall(value_to_call, args)
+              signal, value = self.call(value_to_call, context, args, instruction[5], instruction[6])
+            elif type(value_to_call) is BuiltInFunction:
+              signal, value = self.call_builtin(value_to_call, args, instruction[3], context)
+            else:
+              res = place(value_to_call, instruction[3], context).execute(args)
+              if res.error:
+                signal, value = VM_ERROR, res.error
+              elif res.func_return_value:
+                signal, value = VM_RETURN, res.func_return_value
+              elif res.loop_should_continue:
+                signal, value = VM_CONTINUE, None
+              elif res.loop_should_break:
+                signal, value = VM_BREAK, None
+              else:
+                signal, value = VM_END, res.value
+
+            if signal == VM_END:
+              push(value)
+            elif signal == VM_ERROR or signal == VM_RETURN:
+              return signal, value
+            else:
+              # CONTINUE and BREAK reach through calls to the caller's loop
+              loop = instruction[2]
+              if not loop: return signal, value
+              del stack[loop.depth:]
+              pc = loop.continue_target if signal == VM_CONTINUE else loop.break_target
+
+        else:
+          if op == OP_RETURN:
+            return VM_RETURN, pop()
+
+          elif op == OP_JUMP:
+            pc = instruction[1]
+
+          elif op == OP_APPEND:
+            value = pop()
+            stack[-1][-1].append(value)
+
+          elif op == OP_JUMP_FALSE:
+            if not pop().is_true():
+              pc = instruction[1]
+
+          elif op == OP_JUMP_ZERO:
+            if pop() == 0:
+              pc = instruction[1]
+
+      elif op < OP_FOR_PREP:
+        if op == OP_STORE_SLOT:
+          slots[instruction[1]] = pop()
+
+        elif op == OP_STORE_GLOBAL:
+          global_symbols[instruction[1]] = pop()
+
+        elif op == OP_POP:
+          pop()
+
+        elif op == OP_DUP:
+          push(stack[-1])
+
+        elif op == OP_NUMBER:
+          push(new_number(instruction[1], context, instruction[2], instruction[3]))
+
+        elif op == OP_RAW_NUMBER:
+          push(instruction[1])
+
+        elif op == OP_BOX:
+          stack[-1] = new_number(stack[-1], context, instruction[1], instruction[2])
+
+        elif op == OP_UNBOX:
+          stack[-1] = stack[-1].value
+
+        elif op == OP_LOAD:
+          value = symbol_table.get(instruction[1])
+          if value is None:
+            return VM_ERROR, RTError(instruction[2], instruction[3], f"'{instruction[1]}' is not defined", context)
+          push(value)
+
+        elif op == OP_STORE_POP:
+          symbol_table.set(instruction[1], pop())
+
+        elif op == OP_STRING:
+          push(String(instruction[1]).set_context(context).set_pos(instruction[2], instruction[3]))
+
+        elif op == OP_NULL:
+          push(Number.null)
+
+        elif op == OP_BINOP:
+          right = pop()
+          left = stack[-1]
+          if instruction[1] is None:
+            node = instruction[3]
+            return VM_ERROR, RTError(node.pos_start, node.pos_end, instruction[2], context)
+          result, error = operation(instruction[1], left, right, instruction[3], context)
+          if error: return VM_ERROR, error
+          stack[-1] = result
+
+        elif op == OP_MINUS:
+          number, error = stack[-1].multed_by(Number(-1))
+          if error:
+            number, error = place(stack[-1], instruction[1].node, context).multed_by(Number(-1))
+            return VM_ERROR, error
+          stack[-1] = number
+
+        elif op == OP_NOT:
+          number, error = stack[-1].notted()
+          if error:
+            number, error = place(stack[-1], instruction[1].node, context).notted()
+            return VM_ERROR, error
+          stack[-1] = number
+
+        elif op == OP_LIST:
+          count = instruction[1]
+          elements = stack[len(stack) - count:]
+          del stack[len(stack) - count:]
+          push(List(elements).set_context(context).set_pos(instruction[2], instruction[3]))
+
+        elif op == OP_PLACE:
+          stack[-1] = place(stack[-1], instruction[1], context)
+
+      else:
+        if op == OP_FOR_PREP:
+          step_value = pop() if instruction[1] else None
+          end_value = pop()
+          i = stack[-1].value
+          end = end_value.value
+          step = step_value.value if step_value else 1
+
+          # Integer bounds are range's to count, and a loop whose body never
+          # reads its variable updates one Number in place
+          if type(i) is int and type(end) is int and type(step) is int and step != 0:
+            counts = iter(range(i, end, step))
+          else:
+            counts = stepped_counts(i, end, step)
+
+          depth, key, in_place = instruction[2]
+          if depth is None:
+            variables = symbol_table.symbols
+          elif depth == GLOBAL_DEPTH:
+            variables = global_symbols
+          else:
+            variables = slots
+          stack[-1] = [counts, variables, key, Number(0) if in_place else None, []]
+
+        elif op == OP_WHILE_PREP:
+          push([[]])
+
+        elif op == OP_LOOP_END:
+          elements = pop()[-1]
+          if instruction[1]:
+            push(
+              Number.null if instruction[2] else
+              List(elements).set_context(context).set_pos(instruction[3], instruction[4])
+            )
+
+        elif op == OP_FUNC:
+          func_name = instruction[1]
+          func_value = Function(func_name, instruction[2], instruction[3], instruction[4]).set_context(context).set_pos(instruction[5], instruction[6])
+          func_value.layout = instruction[7]
+          if func_name:
+            symbol_table.set(func_name, func_value)
+          push(func_value)
+
+        elif op == OP_CONTINUE or op == OP_BREAK:
+          loop = instruction[1]
+          if not loop: return (VM_CONTINUE if op == OP_CONTINUE else VM_BREAK), None
+          del stack[loop.depth:]
+          pc = loop.continue_target if op == OP_CONTINUE else loop.break_target
+
+        elif op == OP_INVARIANT:
+          node = instruction[1]
+          bindings = [symbol_table.get(var_name) for var_name in node.var_names]
+
+          if context.invariants is None: context.invariants = {}
+          cached = context.invariants.get(node)
+          if cached:
+            cached_bindings, mutations, value = cached
+            if (mutations is None or mutations == List.mutations) and all(
+              binding is cached_binding for binding, cached_binding in zip(bindings, cached_bindings)
+            ):
+              push(value)
+              pc = instruction[2]
+              continue
+
+          push((bindings, List.mutations))
+
+        elif op == OP_CACHE:
+          node = instruction[1]
+          value = pop()
+          bindings, mutations = stack[-1]
+          stack[-1] = value
+
+          if List.mutations == mutations and all(
+            isinstance(binding, BuiltInFunction) and binding.name in PURE_BUILTINS
+            for var_name, binding in zip(node.var_names, bindings) if var_name in node.callee_names
+          ):
+            if not isinstance(value, List) and not any(isinstance(binding, List) for binding in bindings):
+              mutations = None
+            context.invariants[node] = (bindings, mutations, value)
+
+        elif op == OP_END:
+          return VM_END, stack[-1] if stack else None
+
+############
+# CLOSURES #
+############
+
+class ClosureCompiler:
+  # Turns every node into a Python closure taking the context, once, so
+  # running a program is calling closures. Values, symbol tables and
+  # contexts are the Interpreter's; errors, RETURN, CONTINUE and BREAK
+  # travel as exceptions. Nodes whose value is never used are compiled
+  # into closures that do not build it.
+  def __init__(self):
+    self.tail_calls = set()
+
+  def compile(self, node, keep=True):
+    method_name = f'compile_{type(node).__name__}'
+    method = getattr(self, method_name, self.no_compile_method)
+    return method(node, keep)
+
+  def no_compile_method(self, node, keep):
+    raise Exception(f'No compile_{type(node).__name__} method defined')
+
+  def compile_NumberNode(self, node, keep):
+    value, pos_start, pos_end = node.tok.value, node.pos_start, node.pos_end
+
+    def number(context):
+      return new_number(value, context, pos_start, pos_end)
+    return number
+
+  def compile_StringNode(self, node, keep):
+    value, pos_start, pos_end = node.tok.value, node.pos_start, node.pos_end
+
+    def string(context):
+      return String(value).set_context(context).set_pos(pos_start, pos_end)
+    return string
+
+  def compile_ListNode(self, node, keep):
+    elements = [self.compile(element_node, keep) for element_node in node.element_nodes]
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    if not keep:
+      def statements(context):
+        for element in elements:
+          element(context)
+      return statements
+
+    def list_(context):
+      return List([element(context) for element in elements]).set_context(context).set_pos(pos_start, pos_end)
+    return list_
+
+  def compile_VarAccessNode(self, node, keep):
+    var_name, pos_start, pos_end = node.var_name_tok.value, node.pos_start, node.pos_end
+
+    def var_access(context):
+      symbol_table = context.symbol_table
+      value = symbol_table.symbols.get(var_name)
+      while value is None and symbol_table.parent:
+        symbol_table = symbol_table.parent
+        value = symbol_table.symbols.get(var_name)
+
+      if value is None:
+        raise RuntimeFailure(RTError(pos_start, pos_end, f"'{var_name}' is not defined", context))
+
+      if type(value) is Number:
+        return new_number(value.value, context, pos_start, pos_end)
+      return value.copy().set_pos(pos_start, pos_end).set_context(context)
+    return var_access
+
+  def compile_VarAssignNode(self, node, keep):
+    var_name = node.var_name_tok.value
+    value_node = self.compile(node.value_node)
+
+    def var_assign(context):
+      value = value_node(context)
+      context.symbol_table.symbols[var_name] = value
+      return value
+    return var_assign
+
+  def compile_BinOpNode(self, node, keep):
+    left_node = self.compile(node.left_node)
+    right_node = self.compile(node.right_node)
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    op_tok = node.op_tok
+    if op_tok.matches(LU_KEYWORD, 'AND'):
+      method_name = 'anded_by'
+    elif op_tok.matches(LU_KEYWORD, 'OR'):
+      method_name = 'ored_by'
+    else:
+      method_name = BINOP_METHODS.get(op_tok.type)
+
+    if method_name is None:
+      details = f'Unknown operator: {op_tok}'
+
+      def unknown_operator(context):
+        left_node(context)
+        right_node(context)
+        raise RuntimeFailure(RTError(pos_start, pos_end, details, context))
+      return unknown_operator
+
+    if op_tok.type == LU_PLUS:
+      def add(context):
+        left = left_node(context)
+        right = right_node(context)
+        if type(left) is Number and type(right) is Number:
+          return new_number(left.value + right.value, left.context, pos_start, pos_end)
+        result, error = left.added_to(right)
+        if error: raise RuntimeFailure(error)
+        return result.set_pos(pos_start, pos_end)
+      return add
+
+    if op_tok.type == LU_MINUS:
+      def subtract(context):
+        left = left_node(context)
+        right = right_node(context)
+        if type(left) is Number and type(right) is Number:
+          return new_number(left.value - right.value, left.context, pos_start, pos_end)
+        result, error = left.subbed_by(right)
+        if error: raise RuntimeFailure(error)
+        return result.set_pos(pos_start, pos_end)
+      return subtract
+
+    if op_tok.type in ARITH_OPERATORS:
+      operator = ARITH_OPERATORS[op_tok.type]
+
+      def arith(context):
+        left = left_node(context)
+        right = right_node(context)
+        if type(left) is Number and type(right) is Number:
+          return new_number(operator(left.value, right.value), left.context, pos_start, pos_end)
+        result, error = getattr(left, method_name)(right)
+        if error: raise RuntimeFailure(error)
+        return result.set_pos(pos_start, pos_end)
+      return arith
+
+    def bin_op(context):
+      left = left_node(context)
+      right = right_node(context)
+      result, error = getattr(left, method_name)(right)
+      if error: raise RuntimeFailure(error)
+      return result.set_pos(pos_start, pos_end)
+    return bin_op
+
+  def compile_UnaryOpNode(self, node, keep):
+    operand = self.compile(node.node)
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    if node.op_tok.type == LU_MINUS:
+      def minus(context):
+        number, error = operand(context).multed_by(Number(-1))
+        if error: raise RuntimeFailure(error)
+        return number.set_pos(pos_start, pos_end)
+      return minus
+
+    if node.op_tok.matches(LU_KEYWORD, 'NOT'):
+      def not_(context):
+        number, error = operand(context).notted()
+        if error: raise RuntimeFailure(error)
+        return number.set_pos(pos_start, pos_end)
+      return not_
+
+    def plus(context):
+      return operand(context).set_pos(pos_start, pos_end)
+    return plus
+
+  def compile_branch(self, node, should_return_null, keep):
+    if not should_return_null: return self.compile(node, keep)
+    body = self.compile(node, False)
+
+    def null_branch(context):
+      body(context)
+      return Number.null
+    return null_branch
+
+  def compile_IfNode(self, node, keep):
+    cases = [
+      (self.compile(condition), self.compile_branch(expr, should_return_null, keep))
+      for condition, expr, should_return_null in node.cases
+    ]
+    else_case = self.compile_branch(node.else_case[0], node.else_case[1], keep) if node.else_case else None
+
+    def if_(context):
+      for condition, expr in cases:
+        if condition(context).is_true():
+          return expr(context)
+      if else_case: return else_case(context)
+      return Number.null
+    return if_
+
+  def compile_ForNode(self, node, keep):
+    var_name = node.var_name_tok.value
+    start_value_node = self.compile(node.start_value_node)
+    end_value_node = self.compile(node.end_value_node)
+    step_value_node = self.compile(node.step_value_node) if node.step_value_node else None
+    collect = keep and not node.should_return_null
+    body_node = self.compile(node.body_node, collect)
+    should_return_null, pos_start, pos_end = node.should_return_null, node.pos_start, node.pos_end
+
+    def for_(context):
+      elements = []
+      start_value = start_value_node(context)
+      end_value = end_value_node(context)
+      step_value = step_value_node(context) if step_value_node else None
+
+      i = start_value.value
+      step = step_value.value if step_value else 1
+      counting_up = step >= 0
+      symbols = context.symbol_table.symbols
+
+      while (i < end_value.value) if counting_up else (i > end_value.value):
+        symbols[var_name] = new_number(i, None, None, None)
+        i += step
+
+        try:
+          value = body_node(context)
+        except LoopContinue:
+          continue
+        except LoopBreak:
+          break
+
+        if collect: elements.append(value)
+
+      return (
+        Number.null if should_return_null else
+        List(elements).set_context(context).set_pos(pos_start, pos_end)
+      )
+    return for_
+
+  def compile_WhileNode(self, node, keep):
+    condition_node = self.compile(node.condition_node)
+    collect = keep and not node.should_return_null
+    body_node = self.compile(node.body_node, collect)
+    should_return_null, pos_start, pos_end = node.should_return_null, node.pos_start, node.pos_end
+
+    def while_(context):
+      elements = []
+
+      while condition_node(context).is_true():
+        try:
+          value = body_node(context)
+        except LoopContinue:
+          continue
+        except LoopBreak:
+          break
+
+        if collect: elements.append(value)
+
+      return (
+        Number.null if should_return_null else
+        List(elements).set_context(context).set_pos(pos_start, pos_end)
+      )
+    return while_
+
+  def compile_FuncDefNode(self, node, keep):
+    func_name = node.var_name_tok.value if node.var_name_tok else None
+    body_node = node.body_node
+    arg_names = [arg_name.value for arg_name in node.arg_name_toks]
+    should_auto_return, pos_start, pos_end = node.should_auto_return, node.pos_start, node.pos_end
+    compiled_body = self.compile_body(body_node, should_auto_return)
+
+    def func_def(context):
+      func_value = Function(func_name, body_node, arg_names, should_auto_return).set_context(context).set_pos(pos_start, pos_end)
+      func_value.compiled_body = compiled_body
+      if func_name:
+        context.symbol_table.symbols[func_name] = func_value
+      return func_value
+    return func_def
+
+  def compile_CallNode(self, node, keep):
+    node_to_call = self.compile(node.node_to_call)
+    arg_nodes = [self.compile(arg_node) for arg_node in node.arg_nodes]
+    pos_start, pos_end = node.pos_start, node.pos_end
+    tail = node in self.tail_calls
+
+    def call(context):
+      value_to_call = node_to_call(context).copy().set_pos(pos_start, pos_end)
+      args = [arg_node(context) for arg_node in arg_nodes]
+
+      if type(value_to_call) is Function:
+        if tail and value_to_call.context is context and len(args) == len(value_to_call.arg_names):
+          raise TailCall(value_to_call, args)
+        return_value = self.call_function(value_to_call, args)
+      else:
+        res = value_to_call.execute(args)
+        if res.error: raise RuntimeFailure(res.error)
+        if res.func_return_value: raise FunctionReturn(res.func_return_value)
+        if res.loop_should_continue: raise LoopContinue()
+        if res.loop_should_break: raise LoopBreak()
+        return_value = res.value
+
+      if type(return_value) is Number:
+        return new_number(return_value.value, context, pos_start, pos_end)
+      return return_value.copy().set_pos(pos_start, pos_end).set_context(context)
+    return call
+
+  def compile_body(self, body_node, should_auto_return):
+    self.tail_calls.update(tail_calls(body_node, should_auto_return))
+    return self.compile(body_node, should_auto_return)
+
+  def call_function(self, function, args):
+    # Function.execute, with the body compiled once per FUNC and kept on
+    # every function value made from it. A call in tail position comes back
+    # as a TailCall to run here instead, in the frame generate_tail_frame
+    # gives it.
+    exec_ctx = function.generate_new_context()
+
+    if len(args) != len(function.arg_names):
+      raise RuntimeFailure(function.check_args(function.arg_names, args).error)
+
+    while True:
+      symbols = exec_ctx.symbol_table.symbols
+      for arg_name, arg_value in zip(function.arg_names, args):
+        arg_value.context = exec_ctx
+        symbols[arg_name] = arg_value
+
+      if function.compiled_body is None:
+        function.compiled_body = self.compile_body(function.body_node, function.should_auto_return)
+
+      try:
+        value = function.compiled_body(exec_ctx)
+      except FunctionReturn as function_return:
+        return function_return.value
+      except TailCall as tail_call:
+        function, args = tail_call.function, tail_call.args
+        exec_ctx = function.generate_tail_frame(exec_ctx)
+        continue
+      return value if function.should_auto_return else Number.null
+
+  def compile_ReturnNode(self, node, keep):
+    node_to_return = self.compile(node.node_to_return) if node.node_to_return else None
+
+    def return_(context):
+      raise FunctionReturn(node_to_return(context) if node_to_return else Number.null)
+    return return_
+
+  def compile_ContinueNode(self, node, keep):
+    def continue_(context):
+      raise LoopContinue()
+    return continue_
+
+  def compile_BreakNode(self, node, keep):
+    def break_(context):
+      raise LoopBreak()
+    return break_
+
+  def compile_InvariantNode(self, node, keep):
+    expr = self.compile(node.node)
+
+    def invariant(context):
+      symbol_table = context.symbol_table
+      bindings = [symbol_table.get(var_name) for var_name in node.var_names]
+
+      if context.invariants is None: context.invariants = {}
+      cached = context.invariants.get(node)
+      if cached:
+        cached_bindings, mutations, value = cached
+        if (mutations is None or mutations == List.mutations) and all(
+          binding is cached_binding for binding, cached_binding in zip(bindings, cached_bindings)
+        ):
+          return value.copy()
+
+      mutations = List.mutations
+      value = expr(context)
+
+      if List.mutations == mutations and all(
+        isinstance(binding, BuiltInFunction) and binding.name in PURE_BUILTINS
+        for var_name, binding in zip(node.var_names, bindings) if var_name in node.callee_names
+      ):
+        if not isinstance(value, List) and not any(isinstance(binding, List) for binding in bindings):
+          mutations = None
+        context.invariants[node] = (bindings, mutations, value.copy())
+
+      return value
+    return invariant
+
+##############
+# TRANSPILER #
+##############
+
+# What a variable the running body has not set yet holds
+UNSET = object()
+
+# Numbers that transpiled code holds as Python numbers
+NUMERIC = frozenset({int, float, complex})
+
+# Operators two Python numbers are computed with directly, falling back to
+# the value's method when either is not a number
+PYTHON_OPERATORS = {
+  LU_PLUS: '+',
+  LU_MINUS: '-',
+  LU_MUL: '*',
+  LU_DIV: '/',
+  LU_POW: '**',
+}
+
+PYTHON_COMPARISONS = {
+  LU_LT: '<',
+  LU_GT: '>',
+  LU_LTE: '<=',
+  LU_GTE: '>=',
+}
+
+# Python code objects of transpiled source, keyed by a hash of the source
+TRANSPILED_CODE = {}
+
+class TranspiledFrame:
+  # The Python function the transpiler is writing for one body
+  def __init__(self, local_names, stored_names, top_level, tail_calls):
+    self.lines = []
+    self.indent = 1
+    self.local_names = local_names
+    self.stored_names = stored_names
+    self.top_level = top_level
+    self.tail_calls = tail_calls
+    self.in_loop_body = False
+    self.temps = 0
+
+class Transpiler:
+  # Turns a program or a function body into Python source, with a Python
+  # function for it and one for every function body it defines. Variables a
+  # body sets are Python locals, written to its symbol table before every
+  # call and when the body ends, since the called code may read them.
+  #
+  # Numbers are kept as Python ints and floats and only made into Number
+  # values where one is stored, passed or reported. A Python number stands
+  # for the Number the interpreter would have made at the node it came from,
+  # in the running context, so a node's index goes with it. Everything else
+  # is the interpreter's own values. A node inferred to be a Number always
+  # compiles to a Python number, so code using it needs no check for one.
+  def __init__(self):
+    self.nodes = []
+    self.node_indexes = {}
+    self.constants = []
+    self.functions = []
+    self.frame = None
+
+  def transpile(self, node, keep, top_level=False, arg_names=()):
+    self.body(node, keep, top_level, arg_names)
+    return '\n\n'.join(self.functions) + '\n'
+
+  def emit(self, line):
+    self.frame.lines.append('  ' * self.frame.indent + line)
+
+  def temp(self, prefix='t'):
+    self.frame.temps += 1
+    return f'{prefix}{self.frame.temps}'
+
+  def index(self, node):
+    index = self.node_indexes.get(id(node))
+    if index is None:
+      index = self.node_indexes[id(node)] = len(self.nodes)
+      self.nodes.append(node)
+    return index
+
+  def body(self, node, keep, top_level, arg_names):
+    number = len(self.functions)
+    self.functions.append(None)
+
+    stored_names = assigned_names(node)
+    local_names = stored_names | set(arg_names)
+    outer = self.frame
+    tail = set() if top_level else set(tail_calls(node, keep))
+    frame = self.frame = TranspiledFrame(local_names, stored_names, top_level, tail)
+    if stored_names: frame.indent = 2
+
+    result = self.compile(node, keep)
+    if top_level:
+      self.emit(f'return box({result[0]}, context, {result[1]})' if keep else 'return None')
+    else:
+      self.emit(f'return {result[0]}' if keep else 'return Number.null')
+
+    lines = frame.lines
+    frame.lines = []
+    frame.indent = 1
+    self.emit('symbols = context.symbol_table.symbols')
+    if top_level:
+      self.emit('scripts_run = BuiltInFunction.scripts_run')
+    for name in sorted(local_names):
+      if name in arg_names:
+        self.emit(f'v_{name} = local(symbols[{name!r}])')
+      elif top_level:
+        self.emit(f'v_{name} = local(symbols.get({name!r}, UNSET))')
+      else:
+        self.emit(f'v_{name} = UNSET')
+
+    if stored_names:
+      self.emit('try:')
+      frame.lines.extend(lines)
+      self.emit('finally:')
+      frame.indent = 2
+      self.write_back()
+    else:
+      frame.lines.extend(lines)
+
+    self.functions[number] = f'def body_{number}(context):\n' + '\n'.join(frame.lines)
+    self.frame = outer
+    return f'body_{number}'
+
+  def write_back(self):
+    for name in sorted(self.frame.stored_names):
+      self.emit(
+        f'if v_{name} is not UNSET: symbols[{name!r}] = '
+        f'new_number(v_{name}, context, None, None) if type(v_{name}) in NUMERIC else v_{name}'
+      )
+
+  def block(self, start):
+    # Python blocks cannot be empty
+    if len(self.frame.lines) == start: self.emit('pass')
+
+  def may_signal(self, node):
+    # Whether CONTINUE or BREAK may reach a loop around the node as an
+    # exception, from a call or from a loop condition
+    stack = [node]
+    while stack:
+      node = stack.pop()
+      if isinstance(node, (CallNode, ContinueNode, BreakNode)): return True
+      if isinstance(node, FuncDefNode): continue
+      stack.extend(child_nodes(node))
+    return False
+
+  def compile(self, node, keep=True):
+    method_name = f'compile_{type(node).__name__}'
+    method = getattr(self, method_name, self.no_compile_method)
+    return method(node, keep)
+
+  def no_compile_method(self, node, keep):
+    raise Exception(f'No compile_{type(node).__name__} method defined')
+
+  def condition(self, node):
+    # A Python bool for whether the node's value is true
+    if isinstance(node, BinOpNode) and node.op_tok.type in PYTHON_COMPARISONS:
+      left = self.compile(node.left_node)
+      right = self.compile(node.right_node)
+      method_name = BINOP_METHODS[node.op_tok.type]
+      result = self.temp()
+      if node.left_node.inferred is Number and node.right_node.inferred is Number:
+        self.emit(f'{result} = {left[0]} {PYTHON_COMPARISONS[node.op_tok.type]} {right[0]}')
+        return result
+      self.emit(f'try: {result} = {left[0]} {PYTHON_COMPARISONS[node.op_tok.type]} {right[0]}')
+      self.emit(
+        f'except TypeError: {result} = truth(binop({left[0]}, {right[0]}, {method_name!r}, '
+        f'context, {self.index(node)}, {left[1]}, {right[1]}))'
+      )
+      return result
+
+    value = self.compile(node)[0]
+    if node.inferred is Number: return f'({value} != 0)'
+    return f'({value} != 0 if type({value}) is int else truth({value}))'
+
+  def compile_NumberNode(self, node, keep):
+    if not keep: return None
+    value = node.tok.value
+
+    if type(value) is float and not math.isfinite(value):
+      self.constants.append(value)
+      literal = f'C[{len(self.constants) - 1}]'
+    else:
+      literal = repr(value)
+      if literal.startswith('-'): literal = f'({literal})'
+
+    return literal, str(self.index(node))
+
+  def compile_StringNode(self, node, keep):
+    if not keep: return None
+    index = self.index(node)
+    result = self.temp()
+    self.emit(f'{result} = string({node.tok.value!r}, context, {index})')
+    return result, str(index)
+
+  def compile_ListNode(self, node, keep):
+    if not keep:
+      for element_node in node.element_nodes:
+        self.compile(element_node, False)
+      return None
+
+    index = self.index(node)
+    result = self.temp()
+    self.emit(f'{result} = []')
+    for element_node in node.element_nodes:
+      element = self.compile(element_node)
+      self.emit(f'{result}.append(box({element[0]}, context, {element[1]}))')
+    self.emit(f'{result} = make_list({result}, context, {index})')
+    return result, str(index)
+
+  def compile_VarAccessNode(self, node, keep):
+    var_name = node.var_name_tok.value
+    index = self.index(node)
+    result = self.temp()
+
+    if var_name in self.frame.local_names:
+      self.emit(f'{result} = v_{var_name}')
+      if node.inferred is not Number:
+        self.emit(
+          f'if type({result}) is not int and type({result}) is not float: '
+          f'{result} = read({result}, {var_name!r}, context, {index})'
+        )
+    else:
+      self.emit(f'{result} = lookup({var_name!r}, context, {index})')
+    return result, str(index)
+
+  def compile_VarAssignNode(self, node, keep):
+    value = self.compile(node.value_node)
+    self.emit(f'v_{node.var_name_tok.value} = {value[0]}')
+    return value
+
+  def compile_BinOpNode(self, node, keep):
+    left, left_index = self.compile(node.left_node)
+    right, right_index = self.compile(node.right_node)
+    index = self.index(node)
+    result = self.temp()
+
+    op_tok = node.op_tok
+    if op_tok.matches(LU_KEYWORD, 'AND'):
+      method_name = 'anded_by'
+    elif op_tok.matches(LU_KEYWORD, 'OR'):
+      method_name = 'ored_by'
+    else:
+      method_name = BINOP_METHODS.get(op_tok.type)
+
+    if method_name is None:
+      self.emit(f'{result} = unknown_operator(context, {index})')
+      return result, str(index)
+
+    fallback = f'binop({left}, {right}, {method_name!r}, context, {index}, {left_index}, {right_index})'
+    numbers = node.left_node.inferred is Number and node.right_node.inferred is Number
+
+    if numbers:
+      # Two numbers only fail to divide by zero
+      if op_tok.type in (LU_DIV, LU_POW):
+        self.emit(f'try: {result} = {left} {PYTHON_OPERATORS[op_tok.type]} {right}')
+        self.emit(f'except ZeroDivisionError: {result} = {fallback}')
+      elif op_tok.type in PYTHON_OPERATORS:
+        self.emit(f'{result} = {left} {PYTHON_OPERATORS[op_tok.type]} {right}')
+      elif op_tok.type in PYTHON_COMPARISONS:
+        self.emit(f'{result} = 1 if {left} {PYTHON_COMPARISONS[op_tok.type]} {right} else 0')
+      elif method_name == 'get_comparison_eq':
+        self.emit(f'{result} = 1 if {left} == {right} else 0')
+      elif method_name == 'get_comparison_ne':
+        self.emit(f'{result} = 1 if {left} != {right} else 0')
+      elif method_name == 'anded_by':
+        self.emit(f'{result} = int({left} and {right})')
+      else:
+        self.emit(f'{result} = int({left} or {right})')
+    elif node.inferred is Number:
+      # Strings compared, or a string with a number for AND and OR
+      self.emit(f'{result} = {fallback}.value')
+    elif op_tok.type in PYTHON_OPERATORS:
+      # The methods fail the same way for numbers that Python does
+      self.emit(f'try: {result} = {left} {PYTHON_OPERATORS[op_tok.type]} {right}')
+      self.emit(f'except (TypeError, ZeroDivisionError): {result} = {fallback}')
+    elif op_tok.type in PYTHON_COMPARISONS:
+      self.emit(f'try: {result} = 1 if {left} {PYTHON_COMPARISONS[op_tok.type]} {right} else 0')
+      self.emit(f'except TypeError: {result} = {fallback}')
+    else:
+      if method_name == 'get_comparison_eq':
+        expression = f'1 if {left} == {right} else 0'
+      elif method_name == 'get_comparison_ne':
+        expression = f'1 if {left} != {right} else 0'
+      elif method_name == 'anded_by':
+        expression = f'int({left} and {right})'
+      else:
+        expression = f'int({left} or {right})'
+      self.emit(f'if type({left}) in NUMERIC and type({right}) in NUMERIC: {result} = {expression}')
+      self.emit(f'else: {result} = {fallback}')
+
+    return result, str(index)
+
+  def compile_UnaryOpNode(self, node, keep):
+    operand, operand_index = self.compile(node.node)
+    index = self.index(node)
+    result = self.temp()
+
+    if node.node.inferred is Number:
+      if node.op_tok.type == LU_MINUS:
+        self.emit(f'{result} = {operand} * -1')
+      elif node.op_tok.matches(LU_KEYWORD, 'NOT'):
+        self.emit(f'{result} = 1 if {operand} == 0 else 0')
+      else:
+        self.emit(f'{result} = {operand}')
+    elif node.op_tok.type == LU_MINUS:
+      self.emit(f'try: {result} = {operand} * -1')
+      self.emit(f'except TypeError: {result} = negate({operand}, context, {index}, {operand_index})')
+    elif node.op_tok.matches(LU_KEYWORD, 'NOT'):
+      self.emit(f'if type({operand}) in NUMERIC: {result} = 1 if {operand} == 0 else 0')
+      self.emit(f'else: {result} = invert({operand}, context, {index}, {operand_index})')
+    else:
+      self.emit(f'{result} = {operand} if type({operand}) in NUMERIC else place({operand}, {index})')
+
+    return result, str(index)
+
+  def compile_branch(self, node, should_return_null, keep, result, origin):
+    if should_return_null or not keep:
+      start = len(self.frame.lines)
+      self.compile(node, False)
+      if keep:
+        self.emit(f'{result} = Number.null')
+        self.emit(f'{origin} = 0')
+      self.block(start)
+    else:
+      value = self.compile(node)
+      self.emit(f'{result} = {value[0]}')
+      self.emit(f'{origin} = {value[1]}')
+
+  def compile_IfNode(self, node, keep):
+    result = self.temp() if keep else None
+    origin = self.temp('o') if keep else None
+    indent = self.frame.indent
+
+    for condition, expr, should_return_null in node.cases:
+      self.emit(f'if {self.condition(condition)}:')
+      self.frame.indent += 1
+      self.compile_branch(expr, should_return_null, keep, result, origin)
+      self.frame.indent -= 1
+      self.emit('else:')
+      self.frame.indent += 1
+
+    if node.else_case:
+      self.compile_branch(node.else_case[0], node.else_case[1], keep, result, origin)
+    elif keep:
+      self.emit(f'{result} = Number.null')
+      self.emit(f'{origin} = 0')
+    else:
+      self.emit('pass')
+
+    self.frame.indent = indent
+    return (result, origin) if keep else None
+
+  def compile_loop_body(self, node, elements):
+    frame = self.frame
+    in_loop_body = frame.in_loop_body
+    frame.in_loop_body = True
+
+    handler = self.may_signal(node)
+    if handler:
+      self.emit('try:')
+      frame.indent += 1
+
+    start = len(frame.lines)
+    value = self.compile(node, elements is not None)
+    if elements is not None:
+      self.emit(f'{elements}.append(box({value[0]}, context, {value[1]}))')
+    self.block(start)
+
+    if handler:
+      frame.indent -= 1
+      self.emit('except LoopContinue: continue')
+      self.emit('except LoopBreak: break')
+
+    frame.in_loop_body = in_loop_body
+
+  def number_value(self, node, value):
+    # The value attribute the interpreter reads off a FOR loop's bounds
+    if node.inferred is Number or value[0].isdigit() or value.startswith(('(', 'C[')): return value
+    return f'{value} if type({value}) in NUMERIC else {value}.value'
+
+  def loop_result(self, node, keep, elements):
+    if not keep: return None
+    index = self.index(node)
+    if node.should_return_null: return 'Number.null', str(index)
+    result = self.temp()
+    self.emit(f'{result} = make_list({elements}, context, {index})')
+    return result, str(index)
+
+  def compile_ForNode(self, node, keep):
+    start_value = self.compile(node.start_value_node)[0]
+    end_value = self.compile(node.end_value_node)[0]
+    step_value = self.compile(node.step_value_node)[0] if node.step_value_node else None
+
+    # Read in the order the interpreter reads them
+    i = self.temp('i')
+    self.emit(f'{i} = {self.number_value(node.start_value_node, start_value)}')
+    if step_value:
+      step = self.temp('s')
+      ascending = self.temp('a')
+      self.emit(f'{step} = {self.number_value(node.step_value_node, step_value)}')
+      self.emit(f'{ascending} = {step} >= 0')
+    end = self.temp('e')
+    self.emit(f'{end} = {self.number_value(node.end_value_node, end_value)}')
+
+    elements = None
+    if keep and not node.should_return_null:
+      elements = self.temp('l')
+      self.emit(f'{elements} = []')
+
+    if step_value:
+      self.emit(f'while ({i} < {end} if {ascending} else {i} > {end}):')
+    else:
+      self.emit(f'while {i} < {end}:')
+    self.frame.indent += 1
+    if node.start_value_node.inferred is Number and (not step_value or node.step_value_node.inferred is Number):
+      self.emit(f'v_{node.var_name_tok.value} = {i}')
+    else:
+      self.emit(f'v_{node.var_name_tok.value} = {i} if type({i}) is int else loop_value({i})')
+    self.emit(f'{i} += {step if step_value else 1}')
+    self.compile_loop_body(node.body_node, elements)
+    self.frame.indent -= 1
+
+    return self.loop_result(node, keep, elements)
+
+  def compile_WhileNode(self, node, keep):
+    frame = self.frame
+    elements = None
+    if keep and not node.should_return_null:
+      elements = self.temp('l')
+      self.emit(f'{elements} = []')
+
+    self.emit('while True:')
+    frame.indent += 1
+
+    # CONTINUE and BREAK in the condition are for the loop around this one
+    in_loop_body = frame.in_loop_body
+    frame.in_loop_body = False
+    self.emit(f'if not {self.condition(node.condition_node)}: break')
+    frame.in_loop_body = in_loop_body
+
+    self.compile_loop_body(node.body_node, elements)
+    frame.indent -= 1
+
+    return self.loop_result(node, keep, elements)
+
+  def compile_FuncDefNode(self, node, keep):
+    index = self.index(node)
+    arg_names = [arg_name.value for arg_name in node.arg_name_toks]
+    body = self.body(node.body_node, node.should_auto_return, False, arg_names)
+
+    result = self.temp()
+    self.emit(f'{result} = function(context, {index}, {body})')
+    if node.var_name_tok:
+      self.emit(f'v_{node.var_name_tok.value} = {result}')
+    return result, str(index)
+
+  def compile_CallNode(self, node, keep):
+    frame = self.frame
+    index = self.index(node)
+    node_to_call = node.node_to_call
+
+    # A function called by name runs with the caller's context as its parent
+    by_name = isinstance(node_to_call, VarAccessNode)
+    if by_name:
+      var_name = node_to_call.var_name_tok.value
+      callee_index = self.index(node_to_call)
+      value_to_call = self.temp()
+      if var_name in frame.local_names:
+        self.emit(f'{value_to_call} = v_{var_name}')
+        self.emit(f'if {value_to_call} is UNSET: {value_to_call} = find({var_name!r}, context, {callee_index})')
+      else:
+        self.emit(f'{value_to_call} = find({var_name!r}, context, {callee_index})')
+    else:
+      value_to_call = self.compile(node_to_call)[0]
+
+    args = [self.compile(arg_node) for arg_node in node.arg_nodes]
+    self.write_back()
+
+    result = self.temp()
+    self.emit(
+      f'{result} = {"tail_call" if node in frame.tail_calls else "call"}({value_to_call}, ({"".join(arg[0] + ", " for arg in args)}), '
+      f'({"".join(arg[1] + ", " for arg in args)}), context, {index}, {by_name})'
+    )
+
+    # Only RUN sets variables in another body's symbol table, the program's
+    if frame.top_level and frame.local_names:
+      names = sorted(frame.local_names)
+      self.emit('if BuiltInFunction.scripts_run != scripts_run:')
+      frame.indent += 1
+      self.emit('scripts_run = BuiltInFunction.scripts_run')
+      self.emit(f'{"".join(f"v_{name}, " for name in names)}= reload(symbols, {tuple(names)!r})')
+      frame.indent -= 1
+
+    return result, str(index)
+
+  def compile_ReturnNode(self, node, keep):
+    if node.node_to_return:
+      value = self.compile(node.node_to_return)[0]
+    else:
+      value = 'Number.null'
+
+    if self.frame.top_level:
+      self.emit(f'raise FunctionReturn({value})')
+    else:
+      self.emit(f'return {value}')
+    return ('Number.null', '0') if keep else None
+
+  def compile_ContinueNode(self, node, keep):
+    self.emit('continue' if self.frame.in_loop_body else 'raise LoopContinue()')
+    return ('Number.null', '0') if keep else None
+
+  def compile_BreakNode(self, node, keep):
+    self.emit('break' if self.frame.in_loop_body else 'raise LoopBreak()')
+    return ('Number.null', '0') if keep else None
+
+  def compile_InvariantNode(self, node, keep):
+    # Evaluating the expression again costs about what checking a cached
+    # value would
+    return self.compile(node.node, keep)
+
+class TranspiledUnit:
+  # What transpiled code calls on, for the nodes of one transpiled source
+  def __init__(self, nodes, constants):
+    self.nodes = nodes
+    self.constants = constants
+
+  def namespace(self):
+    return {
+      'C': self.constants,
+      'UNSET': UNSET,
+      'NUMERIC': NUMERIC,
+      'Number': Number,
+      'BuiltInFunction': BuiltInFunction,
+      'FunctionReturn': FunctionReturn,
+      'LoopContinue': LoopContinue,
+      'LoopBreak': LoopBreak,
+      'new_number': new_number,
+      'box': self.box,
+      'local': self.local,
+      'reload': self.reload,
+      'read': self.read,
+      'lookup': self.lookup,
+      'find': self.find,
+      'string': self.string,
+      'make_list': self.make_list,
+      'binop': self.binop,
+      'unknown_operator': self.unknown_operator,
+      'truth': self.truth,
+      'negate': self.negate,
+      'invert': self.invert,
+      'place': self.place,
+      'loop_value': self.loop_value,
+      'function': self.function,
+      'call': self.call,
+      'tail_call': self.tail_call,
+    }
+
+  def box(self, value, context, index):
+    if type(value) not in NUMERIC: return value
+    node = self.nodes[index]
+    return new_number(value, context, node.pos_start, node.pos_end)
+
+  def local(self, value):
+    if type(value) is Number and type(value.value) in NUMERIC: return value.value
+    return value
+
+  def reload(self, symbols, names):
+    return [self.local(symbols.get(name, UNSET)) for name in names]
+
+  def read(self, value, var_name, context, index):
+    if value is UNSET: value = self.find(var_name, context, index)
+    if type(value) in NUMERIC: return value
+    if type(value) is Number and type(value.value) in NUMERIC: return value.value
+    node = self.nodes[index]
+    return value.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
+
+  def lookup(self, var_name, context, index):
+    return self.read(UNSET, var_name, context, index)
+
+  def find(self, var_name, context, index):
+    symbol_table = context.symbol_table
+    value = symbol_table.symbols.get(var_name)
+    while value is None and symbol_table.parent:
+      symbol_table = symbol_table.parent
+      value = symbol_table.symbols.get(var_name)
+
+    if value is None:
+      node = self.nodes[index]
+      raise RuntimeFailure(RTError(node.pos_start, node.pos_end, f"'{var_name}' is not defined", context))
+    return value
+
+  def string(self, value, context, index):
+    node = self.nodes[index]
+    return String(value).set_context(context).set_pos(node.pos_start, node.pos_end)
+
+  def make_list(self, elements, context, index):
+    node = self.nodes[index]
+    return List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
+
+  def binop(self, left, right, method_name, context, index, left_index, right_index):
+    result, error = getattr(self.box(left, context, left_index), method_name)(self.box(right, context, right_index))
+    if error: raise RuntimeFailure(error)
+    node = self.nodes[index]
+    return result.set_pos(node.pos_start, node.pos_end)
+
+  def unknown_operator(self, context, index):
+    node = self.nodes[index]
+    raise RuntimeFailure(RTError(node.pos_start, node.pos_end, f'Unknown operator: {node.op_tok}', context))
+
+  def truth(self, value):
+    if type(value) in NUMERIC: return value != 0
+    return value.is_true()
+
+  def negate(self, value, context, index, operand_index):
+    number, error = self.box(value, context, operand_index).multed_by(Number(-1))
+    if error: raise RuntimeFailure(error)
+    node = self.nodes[index]
+    return number.set_pos(node.pos_start, node.pos_end)
+
+  def invert(self, value, context, index, operand_index):
+    number, error = self.box(value, context, operand_index).notted()
+    if error: raise RuntimeFailure(error)
+    node = self.nodes[index]
+    return number.set_pos(node.pos_start, node.pos_end)
+
+  def place(self, value, index):
+    node = self.nodes[index]
+    return value.set_pos(node.pos_start, node.pos_end)
+
+  def loop_value(self, value):
+    # The interpreter puts whatever the start value held into a Number
+    if type(value) in NUMERIC: return value
+    return new_number(value, None, None, None)
+
+  def function(self, context, index, body):
+    node = self.nodes[index]
+    func_name = node.var_name_tok.value if node.var_name_tok else None
+    arg_names = [arg_name.value for arg_name in node.arg_name_toks]
+    func_value = Function(func_name, node.body_node, arg_names, node.should_auto_return).set_context(context).set_pos(node.pos_start, node.pos_end)
+    func_value.transpiled_body = body
+    return func_value
+
+  def populate(self, arg_names, args, arg_indexes, exec_ctx):
+    symbols = exec_ctx.symbol_table.symbols
+    for arg_name, arg_value, arg_index in zip(arg_names, args, arg_indexes):
+      if type(arg_value) in NUMERIC:
+        node = self.nodes[arg_index]
+        arg_value = new_number(arg_value, exec_ctx, node.pos_start, node.pos_end)
+      else:
+        arg_value.context = exec_ctx
+      symbols[arg_name] = arg_value
+
+  def call(self, value_to_call, args, arg_indexes, context, index, by_name):
+    node = self.nodes[index]
+    pos_start, pos_end = node.pos_start, node.pos_end
+
+    if type(value_to_call) is Function:
+      # Function.execute, for the copy of the function the call would make
+      function_context = context if by_name else value_to_call.context
+      if len(args) != len(value_to_call.arg_names):
+        function = value_to_call.copy().set_pos(pos_start, pos_end).set_context(function_context)
+        raise RuntimeFailure(function.check_args(function.arg_names, args).error)
+
+      exec_ctx = Context(value_to_call.name, function_context, pos_start)
+      exec_ctx.symbol_table = SymbolTable(function_context.symbol_table)
+      self.populate(value_to_call.arg_names, args, arg_indexes, exec_ctx)
+      value = self.function_body(value_to_call)(exec_ctx)
+
+      # A call in tail position comes back as a TailCall to run here
+      # instead, in the frame generate_tail_frame gives it
+      while type(value) is TailCall:
+        function = value.function
+        exec_ctx = function.generate_tail_frame(exec_ctx)
+        symbols = exec_ctx.symbol_table.symbols
+        for arg_name, arg_value in zip(function.arg_names, value.args):
+          arg_value.context = exec_ctx
+          symbols[arg_name] = arg_value
+        value = self.function_body(function)(exec_ctx)
+    elif type(value_to_call) is BuiltInFunction:
+      function = value_to_call.copy().set_pos(pos_start, pos_end)
+      if by_name: function.set_context(context)
+      method = getattr(function, f'execute_{function.name}', function.no_visit_method)
+      if len(args) != len(method.arg_names):
+        raise RuntimeFailure(function.check_args(method.arg_names, args).error)
+
+      exec_ctx = function.generate_new_context()
+      self.populate(method.arg_names, args, arg_indexes, exec_ctx)
+      res = method(exec_ctx)
+      if res.error: raise RuntimeFailure(res.error)
+      value = res.value
+    else:
+      if type(value_to_call) in NUMERIC:
+        value_to_call = new_number(value_to_call, context, pos_start, pos_end)
+      else:
+        value_to_call = value_to_call.copy().set_pos(pos_start, pos_end)
+        if by_name: value_to_call.set_context(context)
+
+      res = value_to_call.execute([
+        self.box(arg_value, context, arg_index) for arg_value, arg_index in zip(args, arg_indexes)
+      ])
+      if res.error: raise RuntimeFailure(res.error)
+      if res.func_return_value: raise FunctionReturn(res.func_return_value)
+      if res.loop_should_continue: raise LoopContinue()
+      if res.loop_should_break: raise LoopBreak()
+      value = res.value
+
+    if type(value) in NUMERIC: return value
+    if type(value) is Number and type(value.value) in NUMERIC: return value.value
+    return value.copy().set_pos(pos_start, pos_end).set_context(context)
+
+  def tail_call(self, value_to_call, args, arg_indexes, context, index, by_name):
+    # A call in tail position returns, rather than raises, the TailCall for
+    # a FUNC the body's caller can run in its place, with its numbers boxed
+    # at their nodes
+    if (
+      type(value_to_call) is Function and (by_name or value_to_call.context is context) and
+      len(args) == len(value_to_call.arg_names)
+    ):
+      return TailCall(value_to_call, [
+        self.box(arg_value, None, arg_index) for arg_value, arg_index in zip(args, arg_indexes)
+      ])
+    return self.call(value_to_call, args, arg_indexes, context, index, by_name)
+
+  def function_body(self, function):
+    if function.transpiled_body is None:
+      function.transpiled_body = transpile(function.body_node, function.should_auto_return, arg_names=function.arg_names)
+    return function.transpiled_body
+
+def transpile(node, keep, top_level=False, arg_names=()):
+  # A Python function running the node in the context it is passed. A
+  # function body returns what the call evaluates to, and the program its
+  # value, raising FunctionReturn for BACK.
+  transpiler = Transpiler()
+  try:
+    source = transpiler.transpile(node, keep, top_level, arg_names)
+    key = hashlib.sha256(source.encode()).hexdigest()
+    code = TRANSPILED_CODE.get(key)
+    if code is None:
+      code = TRANSPILED_CODE[key] = compile(source, '<lumen>', 'exec')
+  except (SyntaxError, RecursionError, MemoryError):
+    # Python nests blocks far less deeply than Lumen, so the deepest bodies
+    # run as closures instead
+    return closure_body(node, keep, top_level)
+
+  namespace = TranspiledUnit(transpiler.nodes, transpiler.constants).namespace()
+  exec(code, namespace)
+  return namespace['body_0']
+
+def closure_body(node, keep, top_level):
+  compiled = ClosureCompiler().compile(node, keep)
+  if top_level: return compiled
+
+  def body(context):
+    try:
+      value = compiled(context)
+    except FunctionReturn as function_return:
+      return function_return.value
+    return value if keep else Number.null
+  return body
 
 #######################################
 # RUN
@@ -2565,21 +6320,162 @@ global_symbol_table.set("RANDOM_FLOAT", BuiltInFunction.random_float)
 global_symbol_table.set("RANDOM_CHOICE", BuiltInFunction.random_choice)
 global_symbol_table.set("FORMAT", BuiltInFunction.format)
 
-def run(fn, text):
-  # Generate tokens
-  lexer = Lexer(fn, text)
-  tokens, error = lexer.make_tokens()
-  if error: return None, error
-  
-  # Generate AST
-  parser = Parser(tokens)
-  ast = parser.parse()
-  if ast.error: return None, ast.error
+def run(fn, text, optimize=True, engine='tree'):
+  node = load_cached_ast(fn, text)
+
+  if node is None:
+    # Generate tokens as the parser asks for them
+    lexer = Lexer(fn, text)
+    tokens = lexer.generate_tokens()
+    
+    # Generate AST
+    parser = Parser(tokens)
+    ast = parser.parse()
+
+    # Lexer errors win over parse errors, even past where parsing stopped
+    if ast.error:
+      for _ in tokens: pass
+    if lexer.error: return None, lexer.error
+    if ast.error: return None, ast.error
+
+    node = ast.node
+    save_cached_ast(fn, text, node)
+
+  # The cache keeps the tree as parsed, so it serves both kinds of run
+  if optimize:
+    node = Optimizer().visit(node)
+  discard_loop_results(node)
 
   # Run program
-  interpreter = Interpreter()
   context = Context('<program>')
   context.symbol_table = global_symbol_table
-  result = interpreter.visit(ast.node, context)
 
-  return result.value, result.error 
+  if engine == 'vm':
+    return VM().run(Resolver().resolve(infer_types(node)), context)
+  if engine not in ('tree', 'closure', 'python'):
+    raise Exception(f"Unknown engine '{engine}'")
+
+  try:
+    if engine == 'tree':
+      return Interpreter().visit(Resolver().resolve(infer_types(node)), context), None
+    if engine == 'closure':
+      program = ClosureCompiler().compile(node)
+    else:
+      program = transpile(infer_types(node), True, True)
+    return program(context), None
+  except RuntimeFailure as failure:
+    return None, failure.error
+  except (FunctionReturn, LoopContinue, LoopBreak):
+    return None, None
+
+def run_stream(fn, text, optimize=True, engine='tree', keep_last=True):
+  # Runs a program one top-level statement at a time, each as soon as it is
+  # parsed. Only the last statement's value is kept, and returned, and not
+  # even that without keep_last. A syntax error is only found when parsing
+  # gets to it, after the statements before it have run.
+  if engine not in ('tree', 'vm', 'closure', 'python'):
+    raise Exception(f"Unknown engine '{engine}'")
+
+  node = load_cached_ast(fn, text)
+  if node is None:
+    lexer = Lexer(fn, text)
+    tokens = lexer.generate_tokens()
+    parser = Parser(tokens)
+    start_tok = parser.current_tok
+    parsed = parser.stream()
+
+    # The statements are cached as one tree once they are all parsed, with
+    # the loops that collected their values as parsed still doing so. A run
+    # an error ends early parses the rest of the program for it.
+    statements = []
+    collecting = []
+  else:
+    lexer = None
+    statements = None
+    parsed = (
+      (ParseResult().success(statement), idx == len(node.element_nodes) - 1)
+      for idx, statement in enumerate(node.element_nodes)
+    )
+
+  context = Context('<program>')
+  context.symbol_table = global_symbol_table
+  vm = VM()
+  value = None
+  result = None
+
+  for res, last in parsed:
+    if res.error:
+      for _ in tokens: pass
+      return None, lexer.error or res.error
+    if lexer and lexer.error: return None, lexer.error
+
+    value = None
+    statement = res.node
+    keep = keep_last and last
+    if statements is not None:
+      statements.append(statement)
+      collecting.extend(collecting_loops(statement))
+    if optimize:
+      statement = Optimizer().visit(statement)
+    discard_loop_results(statement, keep)
+
+    # What the program has set so far is there to see
+    known = {
+      var_name: type(var_value) for var_name, var_value in global_symbol_table.symbols.items()
+      if type(var_value) is Number or type(var_value) is String
+    }
+
+    try:
+      if engine == 'tree':
+        value = Interpreter().visit(Resolver().resolve(infer_types(statement, known)), context)
+      elif engine == 'vm':
+        statement = Resolver().resolve(infer_types(statement, known))
+        signal, value = vm.execute(Compiler().compile_body(statement, keep), context)
+        if signal == VM_ERROR: result = None, value
+        elif signal != VM_END: result = None, None
+      elif engine == 'closure':
+        value = ClosureCompiler().compile(statement, keep)(context)
+      else:
+        value = transpile(infer_types(statement, known), keep, True)(context)
+    except RuntimeFailure as failure:
+      result = None, failure.error
+    except (FunctionReturn, LoopContinue, LoopBreak):
+      result = None, None
+    if result: break
+
+  if result is None:
+    result = (value if keep_last else None), None
+
+  if statements is not None:
+    for res, last in parsed:
+      if res.error: return result
+      statements.append(res.node)
+    if lexer.error: return result
+
+    for loop in collecting:
+      loop.should_return_null = False
+    save_cached_ast(fn, text, ListNode(statements, start_tok.start, parser.current_tok.end, start_tok.src))
+
+  return result
+
+def check(fn, text):
+  # Lex and parse without running anything, collecting every syntax error
+  errors = []
+  lexer = Lexer(fn, text)
+
+  gc_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    Parser(lexer.generate_tokens(errors=errors), errors).parse()
+  finally:
+    if gc_enabled: gc.enable()
+
+  return unique_diagnostics(errors)
+
+def unique_diagnostics(errors):
+  # Keep the first error reported at each offset, later ones follow from it
+  diagnostics = {}
+  for error in sorted(errors, key=lambda error: error.pos_start.idx):
+    diagnostics.setdefault(error.pos_start.idx, Diagnostic(error))
+
+  return list(diagnostics.values())
@@ -2,6 +2,7 @@
 import os
 import sys
 import io
+import json
 
 try:
     import lang
@@ -9,7 +10,7 @@ except ImportError as e:
     print(f"Error importing lang module: {e}")
     sys.exit(1)
 
-def RUN(filename):
+def RUN(filename, optimize=True):
     try:
         with open(filename, 'r', encoding='utf-8') as f:
             text = f.read()
@@ -20,22 +21,37 @@ def RUN(filename):
             line_buffering=True
         )
         
-        result, error = lang.run(filename, text)
+        result, error = lang.run_stream(filename, text, optimize)
 
         if error:
             print(error.as_string(), flush=True)
             return False
-        elif result:
-            if len(result.elements) == 1:
-                print(repr(result.elements[0]), flush=True)
-            else:
-                print(repr(result), flush=True)
+        elif result is not None:
+            print(repr(result), flush=True)
             return True
             
     except Exception as e:
         print(f"Error: {str(e)}", flush=True)
         return False
 
+def CHECK(filename):
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            text = f.read()
+
+        diagnostics = lang.check(filename, text)
+        for diagnostic in diagnostics:
+            print(json.dumps(diagnostic.as_dict()), flush=True)
+        return not diagnostics
+
+    except Exception as e:
+        print(f"Error: {str(e)}", flush=True)
+        return False
+
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 2 and sys.argv[1] == "--check":
+        CHECK(sys.argv[2])
+    elif len(sys.argv) > 2 and sys.argv[1] == "--no-optimize":
+        RUN(sys.argv[2], optimize=False)
+    elif len(sys.argv) > 1:
         RUN(sys.argv[1])
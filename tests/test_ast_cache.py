@@ -0,0 +1,108 @@
+# Parsed trees are cached next to the script, signed with a key of the
+# user's own, and an entry that does not carry a good signature is never
+# unpickled.
+#
+#   python3 -m pytest tests
+import contextlib
+import io
+import os
+import pickle
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lang
+
+TEXT = (
+    'FUNC f(n) -> n * 2\n'
+    'PRINT(f(21))\n'
+)
+
+class Payload:
+    # Unpickling this makes a directory, to show whether it was unpickled
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return os.mkdir, (self.path,)
+
+@pytest.fixture
+def script(tmp_path, monkeypatch):
+    monkeypatch.setattr(lang, 'CACHE_KEY_FILE', str(tmp_path / 'key'))
+    monkeypatch.setattr(lang, 'cache_key', None)
+    path = tmp_path / 'script.lum'
+    path.write_text(TEXT)
+    return str(path)
+
+def entry_path(fn):
+    cache_dir, _, entry = lang.cache_entry(fn, TEXT)
+    return os.path.join(cache_dir, entry)
+
+def run(fn):
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        _, error = lang.run(fn, TEXT)
+    assert error is None
+    return output.getvalue()
+
+def test_signed_entry_is_loaded(script):
+    assert run(script) == '42\n'
+    assert os.path.isfile(entry_path(script))
+
+    node = lang.load_cached_ast(script, TEXT)
+    assert node is not None
+    assert node.src.fn == script
+    assert run(script) == '42\n'
+
+def test_changed_entry_is_ignored(script):
+    # The pickle itself still loads with a byte past its end
+    run(script)
+    with open(entry_path(script), 'ab') as f:
+        f.write(b'.')
+
+    assert lang.load_cached_ast(script, TEXT) is None
+    assert run(script) == '42\n'
+
+    # The run put a good entry back in its place
+    assert lang.load_cached_ast(script, TEXT) is not None
+
+def test_unsigned_pickle_is_not_loaded(script, tmp_path):
+    run(script)
+    marker = tmp_path / 'unpickled'
+    with open(entry_path(script), 'wb') as f:
+        f.write(bytes(32))
+        f.write(pickle.dumps(Payload(str(marker))))
+
+    assert lang.load_cached_ast(script, TEXT) is None
+    assert run(script) == '42\n'
+    assert not marker.exists()
+
+def test_other_key_is_not_trusted(script, tmp_path, monkeypatch):
+    run(script)
+    marker = tmp_path / 'unpickled'
+    data = pickle.dumps(Payload(str(marker)))
+    _, _, entry = lang.cache_entry(script, TEXT)
+
+    # Signed the same way, with a key that is not the user's
+    monkeypatch.setattr(lang, 'cache_key', bytes(range(32)))
+    signature = lang.cache_signature(entry, data)
+    monkeypatch.setattr(lang, 'cache_key', None)
+    with open(entry_path(script), 'wb') as f:
+        f.write(signature)
+        f.write(data)
+
+    assert lang.load_cached_ast(script, TEXT) is None
+    assert run(script) == '42\n'
+    assert not marker.exists()
+
+def test_entry_is_tied_to_its_name(script, tmp_path):
+    # A good entry copied under the name of another text is not loaded
+    run(script)
+    with open(entry_path(script), 'rb') as f:
+        data = f.read()
+    other = TEXT.replace('21', '4')
+    cache_dir, _, entry = lang.cache_entry(script, other)
+    with open(os.path.join(cache_dir, entry), 'wb') as f:
+        f.write(data)
+
+    assert lang.load_cached_ast(script, other) is None
@@ -0,0 +1,204 @@
+# Every engine prints the same and fails with the same traceback as the tree
+# engine, for whole programs run either way, optimized or not.
+#
+#   python3 -m pytest tests
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lang
+
+ENGINES = ('vm', 'closure', 'python')
+RUNS = {'run': lang.run, 'stream': lang.run_stream}
+
+PROGRAMS = {
+    'for': (
+        'SET t = 0\n'
+        'FOR i = 0 TO 10 THEN SET t = t + i * 2\n'
+        'PRINT(t)\n'
+        'PRINT(i)\n'
+    ),
+    'for step down': (
+        'SET t = 0\n'
+        'FOR i = 10 TO 0 STEP -3 THEN SET t = t + i\n'
+        'PRINT(t)\n'
+    ),
+    'for float step': (
+        'SET t = 0\n'
+        'FOR i = 0 TO 2 STEP 0.5 THEN SET t = t + i\n'
+        'PRINT(t)\n'
+        'PRINT(i)\n'
+    ),
+    'for changes its end': (
+        'SET e = 3\n'
+        'FOR i = 0 TO e THEN SET e = 10\n'
+        'PRINT(i)\n'
+    ),
+    'for sets its variable': (
+        'SET t = 0\n'
+        'FOR i = 0 TO 5 THEN\n'
+        '  SET t = t + i\n'
+        '  SET i = 10\n'
+        'STOP\n'
+        'PRINT(i)\n'
+        'PRINT(t)\n'
+    ),
+    'counter kept past the loop': (
+        'SET t = 0\n'
+        'FOR i = 0 TO 5 THEN SET t = t + i\n'
+        'SET k = i\n'
+        'FOR i = 0 TO 2 THEN SET t = t + i\n'
+        'PRINT(k)\n'
+        'PRINT(t)\n'
+    ),
+    'counter kept in a list': (
+        'FUNC f()\n'
+        '  SET t = 0\n'
+        '  FOR i = 0 TO 4 THEN SET t = t * 2 + i\n'
+        '  BACK [t, i]\n'
+        'STOP\n'
+        'PRINT(f())\n'
+    ),
+    'nested for': (
+        'FUNC f()\n'
+        '  SET t = 0\n'
+        '  FOR i = 1 TO 4 THEN FOR j = 0 TO i THEN SET t = t + j\n'
+        '  BACK t\n'
+        'STOP\n'
+        'PRINT(f())\n'
+        'FOR i = 0 TO 3 THEN\n'
+        '  FOR j = 0 TO i THEN PRINT(i * 10 + j)\n'
+        'STOP\n'
+    ),
+    'loop values': (
+        'SET l = FOR i = 0 TO 5 THEN i * i\n'
+        'PRINT(l)\n'
+        'SET k = 0\n'
+        'SET w = WHILE k < 5 THEN SET k = k + 1\n'
+        'PRINT(w)\n'
+    ),
+    'while': (
+        'SET a = 1.5\n'
+        'WHILE a < 10 THEN SET a = a * 2\n'
+        'PRINT(a)\n'
+        'FUNC f(n)\n'
+        '  SET k = n\n'
+        '  WHILE k > 0 THEN SET k = k - 1\n'
+        '  BACK k == 0\n'
+        'STOP\n'
+        'PRINT(f(5))\n'
+    ),
+    'break and continue': (
+        'FUNC f(n)\n'
+        '  SET s = 0\n'
+        '  FOR i = 0 TO n THEN\n'
+        '    IF i == 3 THEN CONTINUE\n'
+        '    IF i == 7 THEN BREAK\n'
+        '    SET s = s + i\n'
+        '  STOP\n'
+        '  BACK s\n'
+        'STOP\n'
+        'PRINT(f(10))\n'
+    ),
+    'recursion': (
+        'FUNC fib(n)\n'
+        '  IF n < 2 THEN BACK n\n'
+        '  BACK fib(n - 1) + fib(n - 2)\n'
+        'STOP\n'
+        'PRINT(fib(15))\n'
+        'FUNC sum(n) -> IF n == 0 THEN 0 ELSE n + sum(n - 1)\n'
+        'PRINT(sum(50))\n'
+    ),
+    'dynamic scope': (
+        'SET x = 5\n'
+        'FUNC g() -> x\n'
+        'FUNC f()\n'
+        '  SET x = 7\n'
+        '  BACK g()\n'
+        'STOP\n'
+        'PRINT(f())\n'
+        'PRINT(g())\n'
+        'FUNC mk()\n'
+        '  FUNC inner(a) -> a + w\n'
+        '  SET w = 10\n'
+        '  BACK inner(1)\n'
+        'STOP\n'
+        'PRINT(mk())\n'
+    ),
+    'conditions': (
+        'SET a = 1\n'
+        'SET b = (a + 2) * (a - 5) > 0\n'
+        'PRINT(b)\n'
+        'IF a + 1 > 1 THEN PRINT("y") ELSE PRINT("n")\n'
+        'SET y = IF a == 1 THEN 2 ELSE 3\n'
+        'PRINT(y)\n'
+        'PRINT(-a)\n'
+        'PRINT(NOT a)\n'
+    ),
+    'strings': (
+        'SET s = "a"\n'
+        'FOR i = 0 TO 3 THEN SET s = s + "b"\n'
+        'PRINT(s)\n'
+        'SET m = 3\n'
+        'FUNC f(n) -> FORMAT("{n} {m}")\n'
+        'PRINT(f(2))\n'
+    ),
+    'shared lists': (
+        'SET l = [1, 2]\n'
+        'SET m = l\n'
+        'APPEND(m, 3)\n'
+        'PRINT(l)\n'
+        'SET n = l + 4\n'
+        'PRINT(n)\n'
+        'PRINT(l)\n'
+    ),
+    'types change at a site': (
+        'FUNC f(x) -> x + 1\n'
+        'PRINT(f(2))\n'
+        'PRINT(f("a"))\n'
+    ),
+    'error in a function': (
+        'FUNC f(a)\n'
+        '  SET b = a * 2\n'
+        '  IF b > 3 THEN BACK b - 1\n'
+        '  BACK b + zz\n'
+        'STOP\n'
+        'PRINT(f(3))\n'
+        'PRINT(f(1))\n'
+    ),
+    'division by zero': (
+        'SET n = 1\n'
+        'SET z = 0\n'
+        'SET b = n / IF 1 THEN z ELSE 2\n'
+    ),
+    'illegal operation': (
+        'SET x = IF 1 THEN "a" ELSE 2\n'
+        'SET y = x - 1\n'
+    ),
+    'wrong arguments': (
+        'FUNC f(x) -> x\n'
+        'PRINT(f(1, 2))\n'
+    ),
+    'not a function': (
+        'SET x = 1\n'
+        'x(2)\n'
+    ),
+}
+
+def outcome(text, run, engine, optimize):
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        _, error = RUNS[run]('<test>', text, optimize=optimize, engine=engine)
+    return output.getvalue(), error and error.as_string()
+
+@pytest.mark.parametrize('optimize', (False, True))
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('run', RUNS)
+@pytest.mark.parametrize('program', PROGRAMS)
+def test_engine_matches_tree(program, run, engine, optimize):
+    text = PROGRAMS[program]
+    expected = outcome(text, run, 'tree', optimize)
+    assert outcome(text, run, engine, optimize) == expected
@@ -0,0 +1,37 @@
+# Runtime errors point at the operand they came from, whatever the engine.
+#
+#   python3 -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lang
+
+ENGINES = ('tree', 'vm', 'closure', 'python')
+RUNS = {'run': lang.run, 'stream': lang.run_stream}
+
+def error_text(run, text, engine, optimize=False):
+    _, error = RUNS[run]('<test>', text, optimize=optimize, engine=engine)
+    assert error is not None
+    return text[error.pos_start.idx:error.pos_end.idx]
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('optimize', (False, True))
+@pytest.mark.parametrize('run', RUNS)
+def test_if_operand(run, engine, optimize):
+    text = 'SET n = 1\nSET z = 0\nSET b = n / IF 1 THEN z ELSE 2'
+    assert error_text(run, text, engine, optimize) == 'z'
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('run', RUNS)
+def test_nested_if_operand(run, engine):
+    text = 'SET z = 0\nSET b = 1 / (IF 0 THEN 1 ELSE IF 1 THEN (SET q = z) ELSE 2)'
+    assert error_text(run, text, engine) == 'z'
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('run', RUNS)
+def test_string_argument(run, engine):
+    text = 'SET s = "{undefined_name}"\nPRINT(IF 1 THEN s ELSE 2)'
+    assert error_text(run, text, engine) == 's'
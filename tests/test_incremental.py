@@ -0,0 +1,117 @@
+# Relexing and reparsing after an edit gives the same tokens, trees and
+# syntax errors as starting over on the edited text.
+#
+#   python3 -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lang
+
+TEXT = (
+    'SET total = 0\n'
+    'FUNC add(a, b)\n'
+    '  SET c = a + b\n'
+    '  BACK c\n'
+    'STOP\n'
+    'FOR i = 0 TO 10 THEN\n'
+    '  SET total = add(total, i)\n'
+    'STOP\n'
+    'PRINT(FORMAT("{total} done"))\n'
+    'SET names = ["a", "b"]\n'
+)
+
+# Each edit replaces `removed` characters from where `anchor` starts, and
+# applies to the text the ones before it left
+EDITS = (
+    ('0\n', 1, '42'),
+    ('total, i', 5, 'count'),
+    ('SET c', 0, '  SET d = 1\n'),
+    ('10 THEN', 2, '1 + 2 *'),
+    ('1 + 2 *', 7, '20'),
+    ('PRINT', 0, 'FUNC twice(x) -> x * 2\n'),
+    ('"{total} done"', 1, ''),
+    ('{total} done"', 0, '"'),
+    ('STOP\nFOR', 5, ''),
+    ('FOR', 0, 'STOP\n'),
+    ('SET total = 42', 14, ''),
+    ('["a", "b"]', 10, '[1, 2, 3]'),
+    ('SET names', 0, '\n\n'),
+    ('BACK c', 6, 'BACK (c'),
+    ('BACK (c', 7, 'BACK c'),
+)
+
+def token_fields(tokens):
+    return [(token.type, token.value, token.start, token.end) for token in tokens]
+
+def shape(item):
+    # Everything the parser put in a tree, with offsets into the text
+    if isinstance(item, lang.Node):
+        fields = tuple(shape(getattr(item, name)) for name in type(item).__slots__)
+        return type(item).__name__, item.start, item.end, fields
+    if isinstance(item, lang.Token):
+        return item.type, item.value, item.start, item.end
+    if isinstance(item, (list, tuple)):
+        return tuple(shape(value) for value in item)
+    return item
+
+def edits():
+    text = TEXT
+    for anchor, removed, inserted in EDITS:
+        offset = text.index(anchor)
+        edited = text[:offset] + inserted + text[offset + removed:]
+        yield text, offset, removed, inserted, edited
+        text = edited
+
+def test_relex_matches_fresh_lex():
+    relexed = list(lang.Lexer('<test>', TEXT).generate_tokens())
+    for _, offset, removed, inserted, text in edits():
+        lexer = lang.Lexer('<test>', text)
+        tokens = list(lexer.generate_tokens())
+
+        # Nothing is left to relex after an error, so start over after it
+        if relexed is None:
+            relexed = tokens
+            continue
+
+        relexed, error = lang.relex(relexed, offset, removed, inserted)
+        if lexer.error:
+            assert relexed == []
+            assert (error.details, error.pos_start.idx) == (lexer.error.details, lexer.error.pos_start.idx)
+            relexed = None
+        else:
+            assert error is None
+            assert token_fields(relexed) == token_fields(tokens)
+
+def check_parse(parser, text):
+    diagnostics = [diagnostic.as_dict() for diagnostic in parser.diagnostics()]
+    assert diagnostics == [diagnostic.as_dict() for diagnostic in lang.check('<test>', text)]
+
+    res = parser.parse()
+    if diagnostics:
+        assert res.error is not None
+    else:
+        fresh = lang.Parser(lang.Lexer('<test>', text).generate_tokens()).parse()
+        assert fresh.error is None
+        assert shape(res.node.element_nodes) == shape(fresh.node.element_nodes)
+    return bool(diagnostics)
+
+def test_reparse_matches_fresh_parse():
+    parser = lang.IncrementalParser('<test>', TEXT)
+    broken = []
+    for _, offset, removed, inserted, text in edits():
+        parser.edit(offset, removed, inserted)
+        broken.append(check_parse(parser, text))
+
+    # The edits go through broken programs and back
+    assert any(broken) and not all(broken)
+
+@pytest.mark.parametrize('edit', range(len(EDITS)))
+def test_single_edit_matches_fresh_parse(edit):
+    # Each edit made to a parser that has only seen the text before it
+    before, offset, removed, inserted, text = list(edits())[edit]
+    parser = lang.IncrementalParser('<test>', before)
+    parser.edit(offset, removed, inserted)
+    check_parse(parser, text)
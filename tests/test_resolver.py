@@ -0,0 +1,75 @@
+# What the resolver registers goes with the trees it resolved, so a long
+# running process does not keep every program it has run.
+#
+#   python3 -m pytest tests
+import contextlib
+import gc
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lang
+
+RUNS = {'run': lang.run, 'stream': lang.run_stream}
+
+def program(i):
+    # Every program binds a frame name of its own, and replaces f
+    return (
+        f'FUNC f(a{i}) -> a{i} + b\n'
+        'SET b = 2\n'
+        'SET r = f(1) * 3 + 1\n'
+        'PRINT(r)\n'
+    )
+
+def registries():
+    gc.collect()
+    return len(lang.INLINE_CACHES), len(lang.FRAME_LAYOUTS), len(lang.FRAME_NAMES)
+
+@pytest.mark.parametrize('engine', ('tree', 'vm'))
+@pytest.mark.parametrize('run', RUNS)
+def test_registries_do_not_grow(run, engine):
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(20):
+            RUNS[run]('<test>', program(i), engine=engine)
+        before = registries()
+        for i in range(20, 220):
+            RUNS[run]('<test>', program(i), engine=engine)
+    assert registries() == before
+
+def test_stats_follow_live_trees():
+    # Once the program is gone, only f, still set, has a cache left
+    with contextlib.redirect_stdout(io.StringIO()):
+        lang.run('<stats>', program(0))
+    gc.collect()
+    stats = [entry for entry in lang.inline_cache_stats() if entry['file'] == '<stats>']
+    assert [(entry['line'], entry['operator'], entry['hits'] + entry['misses']) for entry in stats] == [
+        (1, 'added_to', 1),
+    ]
+
+def test_later_frame_name_takes_back_global_read():
+    # f reads zq from the globals until g binds zq in a frame f runs in
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        lang.run('<test>', 'SET zq = 1\nFUNC f() -> zq\nPRINT(f())\n')
+        lang.run('<test>', 'FUNC g(zq) -> f()\nPRINT(g(5))\n')
+    assert output.getvalue().split() == ['1', '5']
+
+def test_polymorphic_site_misses_and_computes():
+    # Each change of operand types misses the cache and is still added
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        _, error = lang.run('<poly>', (
+            'FUNC add(a, b) -> a + b\n'
+            'FOR i = 0 TO 10 THEN add(i, 1)\n'
+            'PRINT(add("a", "b"))\n'
+            'PRINT(add(2, 3))\n'
+        ))
+    assert error is None
+    assert output.getvalue().split() == ['ab', '5']
+
+    gc.collect()
+    stats = [entry for entry in lang.inline_cache_stats() if entry['file'] == '<poly>']
+    assert [(entry['hits'], entry['misses'], entry['types'], entry['polymorphic']) for entry in stats] == [
+        (9, 3, [('Number', 'Number'), ('String', 'String')], True),
+    ]
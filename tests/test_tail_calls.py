@@ -0,0 +1,60 @@
+# Calls in tail position run in place of the call that made them, in every
+# engine, so tail recursion through any number of functions runs in
+# constant stack and memory.
+#
+#   python3 -m pytest tests
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lang
+
+ENGINES = ('tree', 'vm', 'closure', 'python')
+
+MUTUAL = (
+    'FUNC even(n) -> IF n == 0 THEN {bottom} ELSE odd(n - 1)\n'
+    'FUNC odd(n)\n'
+    '  IF n == 0 THEN BACK 0\n'
+    '  BACK even(n - 1)\n'
+    'STOP\n'
+    'PRINT(even({depth}))\n'
+)
+
+def run(text, engine):
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        _, error = lang.run('<test>', text, engine=engine)
+    return output.getvalue(), error
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_deep_mutual_recursion(engine):
+    output, error = run(MUTUAL.format(bottom='1', depth=100000), engine)
+    assert error is None
+    assert output == '1\n'
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_elided_frames_are_counted(engine):
+    output, error = run(MUTUAL.format(bottom='1 / 0', depth=1000), engine)
+    assert error.details == 'Division by zero'
+
+    # The frame the error is in hangs straight off the program's
+    assert error.context.display_name == 'even'
+    assert error.context.tail_calls == 1000
+    assert error.context.parent.display_name == '<program>'
+    assert error.context.parent.parent is None
+    assert '[1000 tail calls not shown]' in error.as_string()
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_tail_call_sees_callers_variables(engine):
+    output, error = run(
+        'FUNC inner() -> FORMAT("{x} {y}") + STR(y)\n'
+        'FUNC middle(y) -> inner()\n'
+        'FUNC outer(x) -> middle(x + 1)\n'
+        'PRINT(outer(1))\n',
+        engine,
+    )
+    assert error is None
+    assert output == '1 22\n'
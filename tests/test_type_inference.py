@@ -0,0 +1,65 @@
+# A global a loop's call changes the type of is not proven on the next time
+# round, whatever the engine.
+#
+#   python3 -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lang
+
+ENGINES = ('tree', 'vm', 'closure', 'python')
+RUNS = {'run': lang.run, 'stream': lang.run_stream}
+
+LOOPS = {
+    'while body': (
+        'SET x = 1\n'
+        'SET n = 0\n'
+        'WHILE n < 2 THEN\n'
+        '  SET y = x + 1\n'
+        '  RUN("{script}")\n'
+        '  SET n = n + 1\n'
+        'STOP\n'
+    ),
+    'while condition': (
+        'SET x = 1\n'
+        'WHILE x < 5 THEN\n'
+        '  RUN("{script}")\n'
+        'STOP\n'
+    ),
+    'for body': (
+        'SET x = 1\n'
+        'FOR i = 0 TO 2 THEN\n'
+        '  SET y = x + 1\n'
+        '  RUN("{script}")\n'
+        'STOP\n'
+    ),
+    'after for': (
+        'SET x = 1\n'
+        'FOR i = 0 TO 1 THEN RUN("{script}")\n'
+        'SET y = x + 1\n'
+    ),
+}
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('run', RUNS)
+@pytest.mark.parametrize('loop', LOOPS)
+def test_run_in_loop_changes_type(tmp_path, loop, run, engine):
+    script = tmp_path / 'script.lum'
+    script.write_text('SET x = "s"\n')
+    text = LOOPS[loop].replace('{script}', script.as_posix())
+
+    _, error = RUNS[run]('<test>', text, engine=engine)
+    assert isinstance(error, lang.RTError)
+    assert error.details == 'Illegal operation'
+
+def test_loop_without_calls_is_proven():
+    node = lang.infer_types(lang.Parser(lang.Lexer('<test>', (
+        'SET x = 1\n'
+        'WHILE x < 5 THEN SET x = x + 1\n'
+    )).generate_tokens()).parse().node)
+    condition = node.element_nodes[1].condition_node
+    assert condition.inferred is lang.Number
+    assert condition.left_node.inferred is lang.Number